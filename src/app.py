@@ -1,20 +1,66 @@
+import argparse
 import os
+import subprocess
+import sys
+import uuid
+from datetime import datetime
 
 import dash_bootstrap_components as dbc
+import numpy as np
 import plotly.graph_objects as go
-from dash import Dash, Input, Output, Patch, State, clientside_callback, html
+from dash import (Dash, Input, Output, Patch, State, clientside_callback, html,
+                  no_update)
 from dash.exceptions import PreventUpdate
 
-from scripts.config import (DIS_WIN_COLOR, FROZ_WIN_COLOR, PROJ_COLOR,
-                            SYMMLINE_COLOR, VASP_COLOR, VASP_COLOR2,
+from scripts.analytics import compare
+from scripts.bands import reorder_bands
+from scripts.config import (DIS_WIN_COLOR, DOS_COLOR, DOS_PANEL_WIDTH,
+                            EIGENVAL_SIZE_RATIO, FAT_BAND_COLOR,
+                            FAT_BAND_COLOR2, FAT_BAND_SIZE, FAT_BAND_THRESHOLD,
+                            FROZ_WIN_COLOR, GROUP_COLORS, HIGHLIGHT_COLOR,
+                            KPLANE_BROADENING, KPLANE_MAX_RESOLUTION,
+                            KPLANE_RESOLUTION, LAYER_COLORS, PDOS_COLOR,
+                            PRELOAD, PROJ_COLOR, PROJ_COLOR2,
+                            SPIN_TEXTURE_COLOR, SYMMLINE_COLOR, TB_COLOR,
+                            TB_MAX_DENSITY, VASP_COLOR, VASP_COLOR2,
                             WANN_COLOR, WORK_DIR)
-from scripts.layout import layout, make_error_info
-from scripts.parser import (ParseKpointsError, ParseProcarError,
-                            ParseWannError, ParseXmlError, ProjParser,
-                            VaspParser, WannParser)
-from scripts.plot import make_symm_lines, plain_bandplot, proj_bandplot
+from scripts.dataset import file_key, load_efermi
+from scripts.dos import broaden, dos_grid, select, total_histograms
+from scripts.index import ensure_indexer, get_calc, search
+from scripts.layout import (layout, make_band_edge_tables,
+                            make_diagnostics_tables, make_error_info,
+                            make_profile_table, make_reload_info,
+                            make_wout_status)
+from scripts.metrics import instrument_callbacks, prometheus_text, summary
+from scripts.parser import (ParseEigenvalError, ParseKpointsError,
+                            ParseProcarError, ParseTBError, ParseVaspoutError,
+                            ParseWannError, ParseXmlError, find_eigenval,
+                            preload_heavy_modules)
+from scripts.plot import (add_notice, composition_figure, dos_plot,
+                          fat_band_mask, fat_bandplot, group_bandplot,
+                          kplane_figure, make_symm_lines, normalize_color,
+                          normalize_kpath, plain_bandplot, proj_bandplot,
+                          wout_figure)
+from scripts.profiling import get_profile, list_profiles, profile_callbacks
+from scripts.session import (session_band_edges, session_band_order,
+                             session_composition, session_dos_histograms,
+                             session_group_weights, session_layers,
+                             session_proj, session_spin_texture, session_tb,
+                             session_tb_bands, session_tb_plane, session_vasp,
+                             session_vasprun_dos, session_wann,
+                             session_wann_band_edges, session_weights)
+from scripts.tb import PLANES, find_tb_file, is_tb_file
 from scripts.utils import (check_yrange_input, find_indices,
-                           generate_path_completions)
+                           generate_path_completions, group_by_species)
+from scripts.vaspout import PROJECTIONS, find_vaspout
+from scripts.watch import watcher
+from scripts.wout import CURVES, curves, default_wout, get_monitor
+
+if PRELOAD:
+    preload_heavy_modules()
+
+# values of the proj-color control, in the order of the PROCAR spin channels 1-3
+SPIN_COMPONENTS = ["sx", "sy", "sz"]
 
 app = Dash(__name__, external_stylesheets=[dbc.themes.COSMO])
 
@@ -22,10 +68,67 @@ app.title = "Wannier Dash"
 app.layout = layout
 
 
-@app.callback(Output("wann-input-dropdown", "data"), [Input("wann-input", "value")])
-def update_wann_dropdown_options(input_value):
+@app.server.before_request
+def start_background_tasks():
+    ensure_indexer()
+
+
+@app.callback(
+    Output("session-id", "data"),
+    Input("session-id", "modified_timestamp"),
+    State("session-id", "data"),
+)
+def init_session_id(modified_timestamp, session_id):
+    # parsed data is kept on the server under this id, see scripts/session.py
+    if session_id:
+        raise PreventUpdate
+    return uuid.uuid4().hex
+
+
+@app.callback(Output("calc-search-results", "data"), Input("calc-search", "value"))
+def update_calc_search_results(query):
+    if not query:
+        return []
+    options = []
+    for calc in search(query):
+        label = "{} | {} | {} bands, {} k, ISPIN={}".format(
+            os.path.relpath(calc["dir"], WORK_DIR),
+            calc["formula"] or "",
+            calc["nbands"],
+            calc["nkpts"],
+            calc["ispin"],
+        )
+        options.append({"label": label, "value": calc["dir"]})
+    return options
+
+
+@app.callback(
+    [
+        Output("vasp-input", "value", allow_duplicate=True),
+        Output("kpoints-input", "value", allow_duplicate=True),
+        Output("proj-input", "value", allow_duplicate=True),
+        Output("wann-input", "value", allow_duplicate=True),
+    ],
+    Input("calc-search-results", "value"),
+    prevent_initial_call=True,
+)
+def fill_paths_from_index(calc_dir):
+    calc = get_calc(calc_dir) if calc_dir else None
+    if calc is None:
+        raise PreventUpdate
+    return [
+        os.path.relpath(calc[key], WORK_DIR) if calc[key] else ""
+        for key in ("vasprun", "kpoints", "procar", "wann")
+    ]
+
+
+@app.callback(
+    Output("wann-input-dropdown", "data"),
+    [Input("wann-input", "value"), Input("relevant-only", "checked")],
+)
+def update_wann_dropdown_options(input_value, relevant_only):
     if input_value:
-        completions = generate_path_completions(input_value)
+        completions = generate_path_completions(input_value, relevant_only)
         if completions:
             return completions
         else:
@@ -43,10 +146,13 @@ def update_wann_input_value(dropdown_value):
 
 
 # ------------------------------------
-@app.callback(Output("vasp-input-dropdown", "data"), [Input("vasp-input", "value")])
-def update_vasp_dropdown_options(input_value):
+@app.callback(
+    Output("vasp-input-dropdown", "data"),
+    [Input("vasp-input", "value"), Input("relevant-only", "checked")],
+)
+def update_vasp_dropdown_options(input_value, relevant_only):
     if input_value:
-        completions = generate_path_completions(input_value)
+        completions = generate_path_completions(input_value, relevant_only)
         if completions:
             return completions
         else:
@@ -64,10 +170,13 @@ def update_vasp_input_value(dropdown_value):
 
 
 # -----------------------------------------
-@app.callback(Output("proj-input-dropdown", "data"), [Input("proj-input", "value")])
-def update_proj_dropdown_options(input_value):
+@app.callback(
+    Output("proj-input-dropdown", "data"),
+    [Input("proj-input", "value"), Input("relevant-only", "checked")],
+)
+def update_proj_dropdown_options(input_value, relevant_only):
     if input_value:
-        completions = generate_path_completions(input_value)
+        completions = generate_path_completions(input_value, relevant_only)
         if completions:
             return completions
         else:
@@ -86,11 +195,12 @@ def update_proj_input_value(dropdown_value):
 
 # -----------------------------------------
 @app.callback(
-    Output("kpoints-input-dropdown", "data"), [Input("kpoints-input", "value")]
+    Output("kpoints-input-dropdown", "data"),
+    [Input("kpoints-input", "value"), Input("relevant-only", "checked")],
 )
-def update_kpoints_dropdown_options(input_value):
+def update_kpoints_dropdown_options(input_value, relevant_only):
     if input_value:
-        completions = generate_path_completions(input_value)
+        completions = generate_path_completions(input_value, relevant_only)
         if completions:
             return completions
         else:
@@ -127,11 +237,10 @@ def update_is_file_required(checklist_values):
         required[1] = True
     if "proj" in checklist_values:
         required[0] = True
-        required[1] = True
         required[2] = True
         required[4] = True
         required[5] = True
-    if "wann" in checklist_values:
+    if "wann" in checklist_values or "tb" in checklist_values:
         required[0] = True
         required[1] = True
         required[3] = True
@@ -157,6 +266,7 @@ clientside_callback(
         Output("load-data", "loading"),
         Output("loaded-data", "data"),
         Output("spin-pol", "disabled"),
+        Output("proj-color", "disabled"),
         Output("notify-container", "children"),
     ],
     [
@@ -165,22 +275,38 @@ clientside_callback(
         State("kpoints-input", "value"),
         State("proj-input", "value"),
         State("wann-input", "value"),
+        State("session-id", "data"),
     ],
     prevent_initial_call=True,
 )
-def update_path_and_options(n_clicks, vasp_data, kpoints_data, proj_data, wann_data):
+def update_path_and_options(
+    n_clicks, vasp_data, kpoints_data, proj_data, wann_data, session_id
+):
     atom_list = []
     orbital_list = []
     loaded_data = {}
     disable_spin = True
+    disable_spin_texture = True
     error_info = []
     if n_clicks > 0:
+        vasp_data = vasp_data and os.path.join(WORK_DIR, vasp_data)
+        kpoints_data = kpoints_data and os.path.join(WORK_DIR, kpoints_data)
+        proj_data = proj_data and os.path.join(WORK_DIR, proj_data)
+        if vasp_data:
+            # vaspout.h5 is read in milliseconds, and EIGENVAL has all the band plot
+            # needs: read them instead of vasprun.xml (if missing, truncated or much
+            # larger for EIGENVAL)
+            vasp_data = (
+                find_vaspout(vasp_data)
+                or find_eigenval(vasp_data, EIGENVAL_SIZE_RATIO)
+                or vasp_data
+            )
+        if proj_data:
+            proj_data = find_vaspout(proj_data, PROJECTIONS) or proj_data
         if vasp_data and kpoints_data:
-            vasp_data = os.path.join(WORK_DIR, vasp_data)
-            kpoints_data = os.path.join(WORK_DIR, kpoints_data)
             try:
-                vasp = VaspParser(vasp_data, kpoints_data)
-                atom_list = list(set(vasp.atom_list))
+                vasp = session_vasp(session_id, vasp_data, kpoints_data)
+                atom_list = list(dict.fromkeys(vasp.atom_list))
                 loaded_data["vasp"] = vasp_data
                 loaded_data["kpoints"] = kpoints_data
                 disable_spin = not vasp.is_spin_polarized
@@ -188,27 +314,526 @@ def update_path_and_options(n_clicks, vasp_data, kpoints_data, proj_data, wann_d
                 error_info.append("vasprun.xml")
             except ParseKpointsError:
                 error_info.append("KPOINTS")
+            except ParseEigenvalError:
+                error_info.append("EIGENVAL")
+            except ParseVaspoutError:
+                error_info.append("vaspout.h5")
 
         if proj_data and vasp_data:
-            proj_data = os.path.join(WORK_DIR, proj_data)
             try:
-                proj = ProjParser(proj_data, vasp_xml=vasp_data)
+                proj = session_proj(session_id, proj_data, vasp_data)
                 orbital_list = proj.orbitals
                 loaded_data["proj"] = proj_data
+                # so that the band character panel opens without waiting
+                session_composition(session_id, proj_data, vasp_data)
+                disable_spin_texture = not proj.is_soc
+                # projections are plotted along the PROCAR path, also without the
+                # band structure of vasprun.xml
+                if "vasp" not in loaded_data:
+                    atom_list = list(dict.fromkeys(proj.atom_list))
+                    disable_spin = not proj.is_spin_polarized
+                    loaded_data["vasp"] = vasp_data
+                    if kpoints_data and os.path.isfile(kpoints_data):
+                        loaded_data["kpoints"] = kpoints_data
             except ParseProcarError:
                 error_info.append("PROCAR")
+            except ParseVaspoutError:
+                error_info.append("vaspout.h5")
 
         # if kpoints_data:
         #    kpoints_data = os.path.join(WORK_DIR, kpoints_data)
         #    loaded_data["kpoints"] = kpoints_data
         if wann_data:
             wann_data = os.path.join(WORK_DIR, wann_data)
-            loaded_data["wann"] = wann_data
+            # the field takes seedname_band.dat or the tight-binding model itself
+            if not is_tb_file(wann_data):
+                loaded_data["wann"] = wann_data
+            tb_data = find_tb_file(wann_data)
+            if tb_data:
+                try:
+                    session_tb(session_id, tb_data)
+                    loaded_data["tb"] = tb_data
+                except ParseTBError:
+                    error_info.append(os.path.basename(tb_data))
 
         if len(error_info) > 0:
             error_info = make_error_info(error_info)
 
-    return atom_list, orbital_list, False, loaded_data, disable_spin, error_info
+    return (
+        atom_list,
+        orbital_list,
+        False,
+        loaded_data,
+        disable_spin,
+        disable_spin_texture,
+        error_info,
+    )
+
+
+@app.callback(
+    [
+        Output("layers", "data"),
+        Output("layer-select", "data"),
+        Output("layer-select", "value"),
+        Output("notify-container", "children", allow_duplicate=True),
+    ],
+    [
+        Input("add-layer", "n_clicks"),
+        State("layer-name", "value"),
+        State("layer-shift", "value"),
+        State("vasp-input", "value"),
+        State("kpoints-input", "value"),
+        State("wann-input", "value"),
+        State("layers", "data"),
+        State("layer-select", "value"),
+    ],
+    prevent_initial_call=True,
+)
+def add_layer(
+    n_clicks, name, shift, vasp_data, kpoints_data, wann_data, layers, selected
+):
+    if not ((vasp_data and kpoints_data) or wann_data):
+        raise PreventUpdate
+
+    layer = {"shift": shift or 0}
+    if vasp_data:
+        layer["vasp"] = os.path.join(WORK_DIR, vasp_data)
+    if vasp_data and kpoints_data:
+        layer["kpoints"] = os.path.join(WORK_DIR, kpoints_data)
+    if wann_data:
+        layer["wann"] = os.path.join(WORK_DIR, wann_data)
+    missing = [
+        path
+        for path in layer.values()
+        if isinstance(path, str) and not os.path.isfile(path)
+    ]
+    if missing:
+        return (
+            layers,
+            [item["name"] for item in layers],
+            selected,
+            make_error_info(missing),
+        )
+
+    # adding a layer under an existing name replaces it
+    layer["name"] = name or "layer {}".format(len(layers) + 1)
+    layers = [item for item in layers if item["name"] != layer["name"]]
+    layer["color"] = LAYER_COLORS[len(layers) % len(LAYER_COLORS)]
+    layers.append(layer)
+    names = [item["name"] for item in layers]
+    selected = [item for item in (selected or []) if item in names]
+    if layer["name"] not in selected:
+        selected.append(layer["name"])
+
+    return layers, names, selected, []
+
+
+@app.callback(
+    [
+        Output("proj-groups", "data"),
+        Output("group-select", "data"),
+        Output("group-select", "value"),
+    ],
+    [
+        Input("add-group", "n_clicks"),
+        State("atom-select", "value"),
+        State("site-select", "value"),
+        State("orbital-select", "value"),
+        State("group-color", "value"),
+        State("proj-groups", "data"),
+        State("group-select", "value"),
+    ],
+    prevent_initial_call=True,
+)
+def add_proj_group(n_clicks, atoms, sites, orbitals, color, groups, selected):
+    if not (atoms or sites) or not orbitals:
+        raise PreventUpdate
+    if color:
+        # stored as rgb(), which the mixed group colors are computed from
+        try:
+            color = normalize_color(color)
+        except ValueError:
+            # shown next to the input, see `update_group_color_error`
+            raise PreventUpdate
+
+    # adding a group with an existing name replaces it
+    name = "{} {}".format(sites or "+".join(atoms), "+".join(orbitals))
+    groups = [group for group in groups if group["name"] != name]
+    groups.append(
+        {
+            "name": name,
+            "atoms": atoms or [],
+            "sites": sites,
+            "orbitals": orbitals,
+            "color": color or GROUP_COLORS[len(groups) % len(GROUP_COLORS)],
+        }
+    )
+    names = [group["name"] for group in groups]
+    selected = [item for item in (selected or []) if item in names]
+    if name not in selected:
+        selected.append(name)
+
+    return groups, names, selected
+
+
+@app.callback(Output("group-color", "error"), Input("group-color", "value"))
+def update_group_color_error(color):
+    if not color:
+        return False
+    try:
+        normalize_color(color)
+    except ValueError:
+        return "Invalid color"
+    return False
+
+
+def atom_indices(proj, atoms, sites=None) -> list[int]:
+    """
+    Indices of the sites of a site selection (see `scripts.sites`) if one is given,
+    otherwise of all atoms of the selected species
+    """
+    if sites:
+        try:
+            return proj.sites.select(sites).tolist()
+        except ValueError:
+            # shown next to the input, fall back to the species
+            pass
+    return proj.sites.species_indices(atoms or []).tolist()
+
+
+def plot_proj_groups(
+    fig, session_id, kpath, vasp_proj, loaded_data, groups, mode, order, blocks
+):
+    """
+    Fat bands of the projection groups, all evaluated in one contraction
+    """
+    indices = [
+        (
+            atom_indices(vasp_proj, group["atoms"], group.get("sites")),
+            list(find_indices(vasp_proj.orbitals, group["orbitals"])),
+        )
+        for group in groups
+    ]
+    weights = session_group_weights(
+        session_id, loaded_data["proj"], loaded_data["vasp"], indices
+    )
+    bands = vasp_proj.bands
+    if order is not None:
+        bands = reorder_bands(bands, order)
+        weights = np.stack([reorder_bands(w, order) for w in weights])
+    for block, suffix in blocks:
+        group_bandplot(
+            fig,
+            kpath,
+            bands[:, block],
+            weights[:, :, block],
+            [group["color"] for group in groups],
+            [group["name"] for group in groups],
+            mode=mode,
+            threshold=FAT_BAND_THRESHOLD,
+            max_size=FAT_BAND_SIZE,
+            label_suffix=suffix,
+        )
+
+
+def plot_wann(fig, wann):
+    plain_bandplot(
+        fig,
+        wann.kpath,
+        wann.bands,
+        color=WANN_COLOR,
+        # yrange=y_range,
+        label="wannier band",
+    )
+
+
+def plot_layers(fig, session_id, layers, checklist_values, x_range=None):
+    """
+    Overlay the bands of all layers, each aligned to its own Fermi level.
+    Layers are mapped onto x_range so that paths of different lengths share the x-axis.
+    Returns the first parsed vasprun of the layers, if any, to take ticks from.
+    """
+    first_vasp = None
+    for layer, parsed in zip(layers, session_layers(session_id, layers)):
+        for kind, dash in (("vasp", None), ("wann", "dot")):
+            data = parsed.get(kind)
+            if (
+                kind not in checklist_values
+                or data is None
+                or isinstance(data, Exception)
+            ):
+                continue
+            kpath = data.kpath
+            if x_range is not None:
+                kpath = normalize_kpath(kpath) * (x_range[1] - x_range[0]) + x_range[0]
+            plain_bandplot(
+                fig,
+                kpath,
+                data.bands + layer["shift"],
+                color=layer["color"],
+                label="{} ({})".format(layer["name"], kind),
+                dash=dash,
+            )
+            if kind == "vasp" and first_vasp is None:
+                first_vasp = data
+
+    return first_vasp
+
+
+def proj_colors(session_id, proj_map: dict, mode: str):
+    """
+    Marker colors of the projected bands described by `proj_map` (see update_figure):
+    the weights of the selection, or for SOC calculations one spin texture component.
+    Returns the values and their colorscale, range and color bar title.
+    """
+    order = _proj_order(session_id, proj_map)
+    proj = session_proj(session_id, proj_map["procar"], proj_map["vasp"])
+    if mode in SPIN_COMPONENTS and proj.is_soc:
+        texture = session_spin_texture(
+            session_id,
+            proj_map["procar"],
+            proj_map["vasp"],
+            proj_map["atoms"],
+            proj_map["orbitals"],
+        )
+        values = texture[SPIN_COMPONENTS.index(mode)]
+        if order is not None:
+            values = reorder_bands(values, order)
+        # symmetric range so that zero is the middle of the diverging scale
+        limit = max(float(np.abs(values).max()), 1e-6)
+        return values, SPIN_TEXTURE_COLOR, -limit, limit, mode.capitalize()
+
+    return proj_weights_of(session_id, proj_map), PROJ_COLOR, None, None, None
+
+
+def _proj_order(session_id, proj_map: dict):
+    if not proj_map["groups"]:
+        return None
+    return session_band_order(
+        session_id, proj_map["procar"], proj_map["vasp"], proj_map["groups"]
+    )
+
+
+def proj_weights_of(session_id, proj_map: dict):
+    """
+    Weights of the selection in `proj_map`, in the band order of the figure
+    """
+    weights = session_weights(
+        session_id,
+        proj_map["procar"],
+        proj_map["vasp"],
+        [0],
+        proj_map["atoms"],
+        proj_map["orbitals"],
+    )
+    order = _proj_order(session_id, proj_map)
+    if order is not None:
+        weights = reorder_bands(weights, order)
+    return weights
+
+
+@app.callback(
+    Output("graph", "figure", allow_duplicate=True),
+    Input("proj-color", "value"),
+    State("trace-map", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def update_proj_color(mode, trace_map, session_id):
+    """
+    Recolor the projected bands of a SOC calculation in place
+    """
+    proj_map = (trace_map or {}).get("proj")
+    if not proj_map:
+        raise PreventUpdate
+    proj = session_proj(session_id, proj_map["procar"], proj_map["vasp"])
+    if not proj.is_soc:
+        raise PreventUpdate
+
+    values, cmap, cmin, cmax, title = proj_colors(session_id, proj_map, mode)
+    cmin = float(values.min()) if cmin is None else cmin
+    cmax = float(values.max()) if cmax is None else cmax
+    patched_figure = Patch()
+    if proj_map.get("style") == "fat":
+        # one trace, holding the points kept by the weight threshold
+        mask, _ = fat_band_mask(
+            proj_weights_of(session_id, proj_map), FAT_BAND_THRESHOLD
+        )
+        marker = patched_figure["data"][proj_map["start"]]["marker"]
+        if title is None:
+            marker["color"] = FAT_BAND_COLOR
+            marker["showscale"] = False
+        else:
+            marker["color"] = values[mask]
+            marker["colorscale"] = cmap
+            marker["cmin"] = cmin
+            marker["cmax"] = cmax
+            marker["showscale"] = True
+            marker["colorbar"] = dict(title=title, len=0.5, thickness=15)
+        return patched_figure
+
+    for band, idx in enumerate(range(proj_map["start"], proj_map["stop"])):
+        marker = patched_figure["data"][idx]["marker"]
+        marker["color"] = values[:, band]
+        marker["colorscale"] = cmap
+        marker["cmin"] = cmin
+        marker["cmax"] = cmax
+    first = patched_figure["data"][proj_map["start"]]["marker"]
+    first["showscale"] = title is not None
+    first["colorbar"] = dict(title=title, len=0.5, thickness=15)
+    return patched_figure
+
+
+def dos_selection(session_id, dos_map: dict, atoms, orbitals, sites=None):
+    """
+    Indices of the selected atoms (or sites) and orbitals, empty without a PROCAR
+    """
+    if not dos_map["procar"]:
+        return [], []
+    proj = session_proj(session_id, dos_map["procar"], dos_map["vasp"])
+    return (
+        atom_indices(proj, atoms, sites),
+        list(find_indices(proj.orbitals, orbitals or [])),
+    )
+
+
+def dos_curves(session_id, dos_map: dict, sigma, atoms: list[int], orbitals: list[int]):
+    """
+    Energies and DOS curves of the side panel described by `dos_map` (see
+    update_figure): for each spin block the total DOS, followed by the DOS projected
+    on the selection when a PROCAR is loaded. Spin down curves are negated.
+    """
+    vasp = session_vasp(session_id, dos_map["vasp"], dos_map["kpoints"])
+    partials = None
+    if dos_map["source"] == "vasprun":
+        dos = session_vasprun_dos(session_id, dos_map["vasp"])
+        energies = dos["energies"] - vasp.efermi
+        totals = dos["total"]
+        if dos_map["procar"] and dos["partial"] is not None:
+            partials = select(dos["partial"], atoms, orbitals)
+    else:
+        blocks = [vasp.bands_up]
+        if vasp.is_spin_polarized:
+            blocks.append(vasp.bands_down)
+        energies = dos_grid(np.hstack(blocks))
+        step = energies[1] - energies[0]
+        totals = broaden(total_histograms(blocks, energies), sigma, step)
+        if dos_map["procar"]:
+            hists = session_dos_histograms(
+                session_id, dos_map["procar"], dos_map["vasp"], energies
+            )
+            partials = broaden(select(hists, atoms, orbitals), sigma, step)
+
+    curves = []
+    for block in range(dos_map["blocks"]):
+        sign = -1 if block == 1 else 1
+        curves.append(sign * totals[block])
+        if partials is not None:
+            curves.append(sign * partials[block])
+    return energies, curves
+
+
+@app.callback(
+    Output("graph", "figure", allow_duplicate=True),
+    Input("dos-sigma", "value"),
+    Input("atom-select", "value"),
+    Input("site-select", "value"),
+    Input("orbital-select", "value"),
+    State("trace-map", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def update_dos(sigma, atoms, sites, orbitals, trace_map, session_id):
+    """
+    Recompute the DOS panel in place for a new broadening or selection
+    """
+    dos_map = (trace_map or {}).get("dos")
+    if not dos_map:
+        raise PreventUpdate
+    atoms, orbitals = dos_selection(session_id, dos_map, atoms, orbitals, sites)
+    _, curves = dos_curves(session_id, dos_map, sigma, atoms, orbitals)
+    patched_figure = Patch()
+    for idx, curve in zip(range(dos_map["start"], dos_map["stop"]), curves):
+        patched_figure["data"][idx]["x"] = curve
+    return patched_figure
+
+
+@app.callback(
+    Output("watch-interval", "disabled"),
+    Input("watch-mode", "checked"),
+)
+def toggle_watch_interval(checked):
+    return not checked
+
+
+@app.callback(
+    [
+        Output("graph", "figure", allow_duplicate=True),
+        Output("trace-map", "data", allow_duplicate=True),
+        Output("notify-container", "children", allow_duplicate=True),
+    ],
+    Input("watch-interval", "n_intervals"),
+    State("trace-map", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def reload_wann(n_intervals, trace_map, session_id):
+    """
+    Replace the Wannier bands in place when their file was rewritten, the other
+    layers and their parsed files are left alone
+    """
+    wann_map = (trace_map or {}).get("wann")
+    if not wann_map:
+        raise PreventUpdate
+    key = watcher.changed(wann_map["path"], wann_map["key"])
+    if key is None:
+        raise PreventUpdate
+    try:
+        wann = session_wann(session_id, wann_map["path"], vasp_xml=wann_map["vasp"])
+    except ParseWannError:
+        # e.g. truncated by a run that is starting, retried on the next change
+        raise PreventUpdate
+
+    new_fig = go.Figure()
+    plot_wann(new_fig, wann)
+    patched_figure = Patch()
+    for idx in reversed(range(wann_map["start"], wann_map["stop"])):
+        del patched_figure["data"][idx]
+    for offset, trace in enumerate(new_fig.data):
+        patched_figure["data"].insert(
+            wann_map["start"] + offset, trace.to_plotly_json()
+        )
+
+    # the number of Wannier bands may have changed, move the traces after them
+    shift = len(new_fig.data) - (wann_map["stop"] - wann_map["start"])
+    for name, entry in trace_map.items():
+        if name != "wann" and entry["start"] >= wann_map["stop"]:
+            entry["start"] += shift
+            entry["stop"] += shift
+    wann_map["stop"] += shift
+    wann_map["key"] = key
+    return patched_figure, trace_map, make_reload_info(wann_map["path"])
+
+
+@app.callback(
+    [Output("site-select", "error"), Output("site-select", "description")],
+    Input("site-select", "value"),
+    State("loaded-data", "data"),
+    State("session-id", "data"),
+)
+def update_site_selection(sites, loaded_data, session_id):
+    """
+    Check a site selection against the loaded structure and summarize it
+    """
+    loaded_data = loaded_data or {}
+    if not sites or not (loaded_data.get("proj") and loaded_data.get("vasp")):
+        return False, None
+    proj = session_proj(session_id, loaded_data["proj"], loaded_data["vasp"])
+    try:
+        indices = proj.sites.select(sites)
+    except ValueError as e:
+        return str(e), None
+    return False, proj.sites.describe(indices)
 
 
 @app.callback(Output("yrange", "error"), Input("yrange", "value"))
@@ -239,26 +864,30 @@ def update_yrange(n_clicks, y_range):
         State("loaded-data", "data"),
         State("atom-select", "value"),
         State("orbital-select", "value"),
+        State("band-order", "value"),
+        State("session-id", "data"),
     ],
 )
-def get_band_min_max(n_clicks, band_idx, loaded_data, atoms, orbitals):
+def get_band_min_max(
+    n_clicks, band_idx, loaded_data, atoms, orbitals, band_order, session_id
+):
     if n_clicks > 0:
         proj_data = loaded_data.get("proj", None)
         vasp_data = loaded_data.get("vasp", None)
         kpoints_data = loaded_data.get("kpoints", None)
 
-        if proj_data and vasp_data and kpoints_data:
-            vasp = VaspParser(vasp_data, kpoints_data)
-            vasp_proj = ProjParser(proj_data, vasp_xml=vasp_data)
+        if proj_data and vasp_data:
+            vasp_proj = session_proj(session_id, proj_data, vasp_data)
             efermi = vasp_proj.efermi
-            atom_list = vasp.atom_list
-            atoms = list(find_indices(atom_list, atoms))
-            orbital_list = vasp_proj.orbitals
-            orbitals = list(find_indices(orbital_list, orbitals))
-            vasp_proj.select_atom_and_orb([0], atoms, orbitals)
+            atom_list = vasp_proj.atom_list
+            bands = vasp_proj.bands
+            if band_order == "character":
+                groups = list(group_by_species(atom_list).values())
+                order = session_band_order(session_id, proj_data, vasp_data, groups)
+                bands = reorder_bands(bands, order)
             if band_idx:
                 band_idx = int(band_idx)
-            band = vasp_proj.bands[:, band_idx - 1]
+            band = bands[:, band_idx - 1]
             band_min = band.min()
             band_min_nofermi = band_min + efermi
             band_max = band.max()
@@ -410,7 +1039,7 @@ def update_froz_win_range(n_clicks, froz_win):
 
 
 @app.callback(
-    Output("graph", "figure"),
+    [Output("graph", "figure"), Output("trace-map", "data")],
     [
         State("checklist", "value"),
         Input("generate-button", "n_clicks"),
@@ -419,6 +1048,18 @@ def update_froz_win_range(n_clicks, froz_win):
         State("orbital-select", "value"),
         State("yrange", "value"),
         State("spin-pol", "checked"),
+        State("band-order", "value"),
+        State("layers", "data"),
+        State("layer-select", "value"),
+        State("session-id", "data"),
+        State("proj-color", "value"),
+        State("proj-style", "value"),
+        State("proj-groups", "data"),
+        State("group-select", "value"),
+        State("group-mode", "value"),
+        State("dos-sigma", "value"),
+        State("tb-density", "value"),
+        State("site-select", "value"),
     ],
 )
 def update_figure(
@@ -429,12 +1070,25 @@ def update_figure(
     orbitals,
     y_range,
     spin_polarized,
+    band_order,
+    layers,
+    selected_layers,
+    session_id,
+    proj_color,
+    proj_style,
+    proj_groups,
+    selected_groups,
+    group_mode,
+    dos_sigma,
+    tb_density,
+    sites,
     # dis_win,
     # switch_dis_win_checked,
     # froz_win,
     # switch_froz_win_checked,
 ):
     fig = go.Figure()
+    trace_map = {}
     y_min = float(y_range.replace(" ", "").split(",")[0])
     y_max = float(y_range.replace(" ", "").split(",")[1])
     y_range = (y_min, y_max)
@@ -456,22 +1110,73 @@ def update_figure(
     )
 
     if n_clicks > 0:
+        loaded_data = loaded_data or {}
         vasp_data = loaded_data.get("vasp", None)
         kpoints_data = loaded_data.get("kpoints", None)
         wann_data = loaded_data.get("wann", None)
+        tb_data = loaded_data.get("tb", None)
         proj_data = loaded_data.get("proj", None)
 
-        if vasp_data and kpoints_data:
-            vasp = VaspParser(vasp_data, kpoints_data)
-            x_range = [vasp.kpath[0], vasp.kpath[-1]]
+        # the band structure of vasprun.xml is only parsed for the plots using it,
+        # projections and Wannier bands have paths of their own
+        vasp = None
+        if vasp_data and kpoints_data and {"vasp", "dos", "tb"} & set(checklist_values):
+            try:
+                vasp = session_vasp(session_id, vasp_data, kpoints_data)
+            except (
+                ParseXmlError,
+                ParseKpointsError,
+                ParseEigenvalError,
+                ParseVaspoutError,
+            ):
+                vasp = None
+
+        kpath, ticks = None, None
+        if vasp is not None:
+            kpath, ticks = vasp.kpath, vasp.ticks
+        elif proj_data and vasp_data:
+            path = session_proj(session_id, proj_data, vasp_data).path(kpoints_data)
+            kpath, ticks = path.distances, path.ticks
+        elif "wann" in checklist_values and wann_data:
+            wann = session_wann(session_id, wann_data, vasp_xml=vasp_data)
+            kpath, ticks = wann.kpath, wann.ticks
+        x_range = None
+        if kpath is not None:
+            x_range = [kpath[0], kpath[-1]]
             layout["xaxis"]["range"] = x_range
 
-        if "vasp" in checklist_values and vasp:
+        order = None
+        groups = None
+        if band_order == "character" and proj_data and vasp_data:
+            atom_list = session_proj(session_id, proj_data, vasp_data).atom_list
+            groups = list(group_by_species(atom_list).values())
+            order = session_band_order(session_id, proj_data, vasp_data, groups)
+
+        if "vasp" in checklist_values and vasp is not None:
+            bands_up = vasp.bands_up
+            num_kpts, num_bands = bands_up.shape
+            # the order comes from PROCAR, which may hold other k-points or bands
+            vasp_order = order
+            num_blocks = 2 if vasp.is_spin_polarized else 1
+            if order is not None and order.shape != (num_kpts, num_blocks * num_bands):
+                vasp_order = None
+                add_notice(
+                    fig,
+                    "DFT bands in energy order: the k-points or bands of the "
+                    "projections differ",
+                )
+            if vasp_order is not None:
+                bands_up = reorder_bands(bands_up, vasp_order[:, :num_bands])
             if spin_polarized:
+                bands_down = vasp.bands_down
+                if vasp_order is not None:
+                    bands_down = reorder_bands(
+                        bands_down, vasp_order[:, num_bands:] - num_bands
+                    )
                 plain_bandplot(
                     fig,
                     vasp.kpath,
-                    vasp.bands_up,
+                    bands_up,
                     # yrange=y_range,
                     color=VASP_COLOR,
                     label="vasp spin up",
@@ -479,7 +1184,7 @@ def update_figure(
                 plain_bandplot(
                     fig,
                     vasp.kpath,
-                    vasp.bands_down,
+                    bands_down,
                     # yrange=y_range,
                     color=VASP_COLOR2,
                     label="vasp band down",
@@ -488,42 +1193,183 @@ def update_figure(
                 plain_bandplot(
                     fig,
                     vasp.kpath,
-                    vasp.bands,
+                    bands_up,
                     # yrange=y_range,
                     color=VASP_COLOR,
                     label="vasp band",
                 )
 
         if "wann" in checklist_values and wann_data:
-            wann = WannParser(wann_data, vasp_xml=vasp_data)
-            wann.read_file()
+            wann = session_wann(session_id, wann_data, vasp_xml=vasp_data)
+            start = len(fig.data)
+            plot_wann(fig, wann)
+            trace_map["wann"] = {
+                "start": start,
+                "stop": len(fig.data),
+                "path": wann_data,
+                "vasp": vasp_data,
+                "key": file_key(wann_data),
+            }
+            # so that a rerun is noticed even before the watch mode is switched on
+            watcher.watch(wann_data)
+
+        if "tb" in checklist_values and tb_data and vasp is not None:
+            density = min(max(int(tb_density or 1), 1), TB_MAX_DENSITY)
+            # the TB path has more points than `kpath` with a density above 1
+            tb_kpath, tb_bands = session_tb_bands(
+                session_id, tb_data, vasp_data, kpoints_data, density
+            )
             plain_bandplot(
                 fig,
-                wann.kpath,
-                wann.bands,
-                color=WANN_COLOR,
-                # yrange=y_range,
-                label="wannier band",
+                tb_kpath,
+                tb_bands,
+                color=TB_COLOR,
+                dash="dash",
+                label="wannier TB band",
             )
 
-        if "proj" in checklist_values and proj_data:
-            vasp_proj = ProjParser(proj_data, vasp_xml=vasp_data)
-            atom_list = vasp.atom_list
-            atoms = list(find_indices(atom_list, atoms))
-            orbital_list = vasp_proj.orbitals
-            orbitals = list(find_indices(orbital_list, orbitals))
-            vasp_proj.select_atom_and_orb([0], atoms, orbitals)
+        if "dos" in checklist_values and vasp is not None:
+            has_vasprun_dos = session_vasprun_dos(session_id, vasp_data) is not None
+            dos_map = {
+                "start": len(fig.data),
+                "vasp": vasp_data,
+                "kpoints": kpoints_data,
+                "procar": proj_data,
+                "source": "vasprun" if has_vasprun_dos else "computed",
+                "blocks": 2 if spin_polarized and vasp.is_spin_polarized else 1,
+            }
+            energies, curves = dos_curves(
+                session_id,
+                dos_map,
+                dos_sigma,
+                *dos_selection(session_id, dos_map, atoms, orbitals, sites),
+            )
+            # total and projected curves alternate, see dos_curves
+            per_block = len(curves) // dos_map["blocks"]
+            for idx, curve in enumerate(curves):
+                label = "DOS" if idx % per_block == 0 else "PDOS"
+                if dos_map["blocks"] > 1:
+                    label += " down" if idx >= per_block else " up"
+                dos_plot(
+                    fig,
+                    energies,
+                    curve,
+                    DOS_COLOR if idx % per_block == 0 else PDOS_COLOR,
+                    label=label,
+                    fill=idx % per_block == 1,
+                )
+            dos_map["stop"] = len(fig.data)
+            trace_map["dos"] = dos_map
+
+            band_width = 1 - DOS_PANEL_WIDTH
+            layout["width"] = int(layout["width"] / band_width)
+            layout["xaxis"]["domain"] = [0, band_width - 0.02]
+            layout["xaxis2"] = dict(
+                domain=[band_width, 1],
+                anchor="y",
+                title="DOS",
+                showgrid=False,
+                zeroline=True,
+            )
 
-            proj_bandplot(
+        selected_groups = [
+            group
+            for group in (proj_groups or [])
+            if group["name"] in (selected_groups or [])
+        ]
+        if "proj" in checklist_values and proj_data and vasp_data and selected_groups:
+            vasp_proj = session_proj(session_id, proj_data, vasp_data)
+            up, *down = vasp_proj.spin_blocks
+            blocks = [(up, "")]
+            if spin_polarized and down:
+                blocks = [(up, " (up)"), (down[0], " (down)")]
+            plot_proj_groups(
                 fig,
-                vasp.kpath,
-                vasp_proj.bands,
-                vasp_proj.weights,
-                normalize=False,
-                cmap=PROJ_COLOR,
-                # yrange=y_range,
-                label="projected band",
+                session_id,
+                kpath,
+                vasp_proj,
+                loaded_data,
+                selected_groups,
+                group_mode,
+                order,
+                blocks,
             )
+        elif "proj" in checklist_values and proj_data and vasp_data:
+            vasp_proj = session_proj(session_id, proj_data, vasp_data)
+            atoms = atom_indices(vasp_proj, atoms, sites)
+            orbital_list = vasp_proj.orbitals
+            orbitals = list(find_indices(orbital_list, orbitals))
+            proj_bands = vasp_proj.bands
+            if order is not None:
+                proj_bands = reorder_bands(proj_bands, order)
+            trace_map["proj"] = {
+                "start": len(fig.data),
+                "procar": proj_data,
+                "vasp": vasp_data,
+                "atoms": atoms,
+                "orbitals": orbitals,
+                "groups": groups,
+                "style": proj_style,
+            }
+            proj_values, cmap, cmin, cmax, title = proj_colors(
+                session_id, trace_map["proj"], proj_color
+            )
+            proj_weights = proj_weights_of(session_id, trace_map["proj"])
+
+            # spin channels are views of the same projected arrays
+            up, *down = vasp_proj.spin_blocks
+            channels = [(up, cmap, FAT_BAND_COLOR, "projected band", 1.0)]
+            if spin_polarized and down:
+                channels = [
+                    (up, PROJ_COLOR, FAT_BAND_COLOR, "projected spin up", 1.0),
+                    (
+                        down[0],
+                        PROJ_COLOR2,
+                        FAT_BAND_COLOR2,
+                        "projected spin down",
+                        1.12,
+                    ),
+                ]
+            for block, cmap, fat_color, label, colorbar_x in channels:
+                colorbar = None
+                if len(channels) > 1 or title:
+                    colorbar = dict(
+                        title=title or label.replace("projected ", ""),
+                        x=colorbar_x,
+                        len=0.5,
+                        thickness=15,
+                    )
+                if proj_style == "fat":
+                    fat_bandplot(
+                        fig,
+                        kpath,
+                        proj_bands[:, block],
+                        proj_weights[:, block],
+                        fat_color if title is None else proj_values[:, block],
+                        threshold=FAT_BAND_THRESHOLD,
+                        weight_max=proj_weights.max(),
+                        max_size=FAT_BAND_SIZE,
+                        label=label,
+                        colorscale=cmap,
+                        cmin=cmin,
+                        cmax=cmax,
+                        colorbar=colorbar,
+                    )
+                    continue
+                proj_bandplot(
+                    fig,
+                    kpath,
+                    proj_bands[:, block],
+                    proj_values[:, block],
+                    normalize=False,
+                    cmap=cmap,
+                    # yrange=y_range,
+                    label=label,
+                    colorbar=colorbar,
+                    cmin=cmin,
+                    cmax=cmax,
+                )
+            trace_map["proj"]["stop"] = len(fig.data)
 
         # if switch_dis_win_checked > 0:
         #    if dis_win:
@@ -549,14 +1395,398 @@ def update_figure(
         #            opacity=0.2,
         #        )
 
+        selected_layers = [
+            layer for layer in layers if layer["name"] in (selected_layers or [])
+        ]
+        layer_vasp = plot_layers(
+            fig, session_id, selected_layers, checklist_values, x_range
+        )
+
+        # empty until a band is picked in the band character panel
+        if proj_data and vasp_data and kpath is not None:
+            trace_map["highlight"] = {
+                "start": len(fig.data),
+                "stop": len(fig.data) + 1,
+                "procar": proj_data,
+                "vasp": vasp_data,
+                "kpoints": kpoints_data,
+                # the band order of the figure, see `_proj_order`
+                "groups": groups,
+            }
+            fig.add_trace(
+                go.Scatter(
+                    x=[],
+                    y=[],
+                    mode="lines",
+                    line=dict(color=HIGHLIGHT_COLOR, width=5),
+                    opacity=0.8,
+                    name="highlighted band",
+                    showlegend=False,
+                )
+            )
+
         fig.update_layout(layout)
-        make_symm_lines(fig, vasp.ticks, color=SYMMLINE_COLOR, use_dash=False)
-        return fig
+        if ticks is None and layer_vasp is not None:
+            ticks = layer_vasp.ticks
+        if ticks is not None:
+            make_symm_lines(fig, ticks, color=SYMMLINE_COLOR, use_dash=False)
+        return fig, trace_map
     else:
-        return go.Figure(layout=layout)
+        return go.Figure(layout=layout), trace_map
+
+
+@app.callback(
+    Output("wout-input", "value"),
+    Input("loaded-data", "data"),
+    prevent_initial_call=True,
+)
+def fill_wout_path(loaded_data):
+    """
+    Monitor the .wout of the loaded Wannier bands
+    """
+    wout_path = default_wout((loaded_data or {}).get("wann"))
+    if not wout_path or not os.path.isfile(wout_path):
+        raise PreventUpdate
+    return wout_path
+
+
+@app.callback(
+    Output("wout-interval", "disabled"),
+    Input("wout-accordion", "value"),
+    Input("wout-follow", "checked"),
+)
+def toggle_wout_interval(opened, follow):
+    return opened != "wout" or not follow
+
+
+@app.callback(
+    [
+        Output("wout-graph", "figure"),
+        Output("wout-graph", "extendData"),
+        Output("wout-state", "data"),
+        Output("wout-status", "children"),
+    ],
+    [
+        Input("wout-interval", "n_intervals"),
+        Input("wout-input", "value"),
+        Input("wout-accordion", "value"),
+        State("wout-state", "data"),
+    ],
+)
+def update_wout(n_intervals, wout_path, opened, state):
+    """
+    Draw the convergence of a .wout once, then only send the points appended since
+    """
+    if opened != "wout" or not wout_path:
+        raise PreventUpdate
+    if not os.path.isfile(wout_path):
+        return go.Figure(), no_update, {}, html.Small("File not found")
+
+    monitor = get_monitor(wout_path)
+    monitor.poll()
+    # a new file, or a new run written to the same path, is drawn from scratch
+    available = [len(x) for x, _ in curves(monitor)]
+    redraw = (
+        state.get("path") != wout_path
+        or state.get("identity") != list(monitor.identity)
+        or any(count < first for count, first in zip(available, state["sent"]))
+    )
+    sent = [0] * len(CURVES) if redraw else state["sent"]
+    new_curves = curves(monitor, sent)
+    new_state = {
+        "path": wout_path,
+        "identity": list(monitor.identity),
+        "sent": [first + len(x) for first, (x, _) in zip(sent, new_curves)],
+        "steps": len(monitor.centres),
+        "warnings": len(monitor.warnings),
+        "finished": monitor.finished,
+    }
+    if new_state == state:
+        raise PreventUpdate
+
+    figure, extend = no_update, no_update
+    if redraw:
+        figure = wout_figure(new_curves, CURVES)
+    else:
+        extend = [
+            dict(x=[x for x, _ in new_curves], y=[y for _, y in new_curves]),
+            list(range(len(new_curves))),
+        ]
+    status = make_wout_status(
+        {
+            "dis": monitor.dis.size,
+            "conv": monitor.conv.size,
+            "finished": monitor.finished,
+            "centres": monitor.centres[-1] if len(monitor.centres) else [],
+            "spreads": monitor.spreads[-1] if len(monitor.spreads) else [],
+            "warnings": monitor.warnings,
+        }
+    )
+    return figure, extend, new_state, status
 
 
+@app.callback(
+    [Output("kplane-graph", "figure"), Output("kplane-status", "children")],
+    [
+        Input("kplane-button", "n_clicks"),
+        Input("kplane-energy", "value"),
+        Input("kplane-style", "value"),
+        State("kplane-plane", "value"),
+        State("kplane-offset", "value"),
+        State("kplane-resolution", "value"),
+        State("loaded-data", "data"),
+        State("session-id", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def update_kplane(
+    n_clicks, energy, style, plane, offset, resolution, loaded_data, session_id
+):
+    """
+    Constant energy contours of the Wannier model on a k-plane. The bands of a plane
+    are computed once per resolution, changing the energy only redraws them.
+    """
+    if not n_clicks:
+        raise PreventUpdate
+    loaded_data = loaded_data or {}
+    tb_data = loaded_data.get("tb")
+    if not tb_data:
+        return go.Figure(), html.Small(
+            "Load a seedname_hr.dat or seedname_tb.dat in the Wannier field first"
+        )
+    resolution = min(
+        max(int(resolution or KPLANE_RESOLUTION), 2), KPLANE_MAX_RESOLUTION
+    )
+    try:
+        grid, energies = session_tb_plane(
+            session_id, tb_data, plane, offset or 0, resolution
+        )
+    except ParseTBError as e:
+        return go.Figure(), html.Small(str(e))
+
+    # contours of the absolute energies rather than shifting all bands
+    vasp_data = loaded_data.get("vasp")
+    efermi = load_efermi(vasp_data) if vasp_data else 0.0
+    first, second, _ = PLANES[plane]
+    fig = kplane_figure(
+        grid,
+        energies,
+        (energy or 0) + efermi,
+        style,
+        ("k along b{}".format(first + 1), "k along b{}".format(second + 1)),
+        KPLANE_BROADENING,
+        LAYER_COLORS,
+    )
+    crossing = len(fig.data) - (style == "heatmap")
+    status = html.Small(
+        "{} of {} bands cross {:.3f} eV{}".format(
+            crossing,
+            energies.shape[2],
+            energy or 0,
+            " (relative to E_F)" if vasp_data else "",
+        )
+    )
+    return fig, status
+
+
+def composition_rows(proj) -> list[str]:
+    """
+    Band numbers of the composition heatmap, marked by spin channel for ISPIN=2
+    """
+    blocks = proj.spin_blocks
+    if len(blocks) == 1:
+        return [str(band + 1) for band in range(blocks[0].stop)]
+    return [
+        "{}{}".format(band + 1, arrow)
+        for block, arrow in zip(blocks, ["↑", "↓"])
+        for band in range(block.stop - block.start)
+    ]
+
+
+@app.callback(
+    [Output("composition-graph", "figure"), Output("composition-status", "children")],
+    [
+        Input("loaded-data", "data"),
+        Input("composition-reduce", "value"),
+        State("session-id", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def update_composition(loaded_data, reduce, session_id):
+    """
+    Band character heatmap, from the composition computed when the data was loaded
+    """
+    loaded_data = loaded_data or {}
+    proj_data = loaded_data.get("proj")
+    vasp_data = loaded_data.get("vasp")
+    if not (proj_data and vasp_data):
+        return go.Figure(), html.Small("Load a PROCAR to see the band character")
+    proj = session_proj(session_id, proj_data, vasp_data)
+    composition = session_composition(session_id, proj_data, vasp_data)
+    fig = composition_figure(
+        composition[reduce],
+        composition["labels"],
+        composition_rows(proj),
+        composition["energies"],
+    )
+    return fig, None
+
+
+@app.callback(
+    Output("graph", "figure", allow_duplicate=True),
+    Input("composition-graph", "clickData"),
+    State("trace-map", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def highlight_band(click_data, trace_map, session_id):
+    """
+    Draw the band of the clicked heatmap cell over the band structure, in the band
+    order of the figure
+    """
+    highlight = (trace_map or {}).get("highlight")
+    if not (highlight and click_data):
+        raise PreventUpdate
+    proj = session_proj(session_id, highlight["procar"], highlight["vasp"])
+    band = composition_rows(proj).index(click_data["points"][0]["y"])
+    patched_figure = Patch()
+    trace = patched_figure["data"][highlight["start"]]
+    bands = proj.bands
+    order = _proj_order(session_id, highlight)
+    if order is not None:
+        bands = reorder_bands(bands, order)
+    trace["x"] = proj.path(highlight["kpoints"]).distances
+    trace["y"] = bands[:, band]
+    trace["name"] = "band {}".format(click_data["points"][0]["y"])
+    trace["showlegend"] = True
+    return patched_figure
+
+
+@app.callback(
+    Output("band-edges", "children"),
+    Input("band-edges-accordion", "value"),
+    Input("loaded-data", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def update_band_edges(opened, loaded_data, session_id):
+    """
+    Band edge analytics of the loaded DFT and Wannier bands, computed once per
+    dataset when the panel is first opened
+    """
+    if opened != "band-edges":
+        raise PreventUpdate
+    loaded_data = loaded_data or {}
+    vasp_data = loaded_data.get("vasp")
+    kpoints_data = loaded_data.get("kpoints")
+    wann_data = loaded_data.get("wann")
+    results = {}
+    if vasp_data and kpoints_data:
+        try:
+            results["DFT"] = session_band_edges(session_id, vasp_data, kpoints_data)
+        except (
+            ParseXmlError,
+            ParseKpointsError,
+            ParseEigenvalError,
+            ParseVaspoutError,
+        ):
+            pass
+    # Wannier bands are only comparable relative to the VASP Fermi level
+    if wann_data and vasp_data:
+        try:
+            results["Wannier"] = session_wann_band_edges(
+                session_id, wann_data, vasp_data
+            )
+        except ParseWannError:
+            pass
+    if not results:
+        return html.Small(
+            "Load vasprun.xml with KPOINTS, or Wannier bands with vasprun.xml, first"
+        )
+    comparison = None
+    if len(results) == 2:
+        comparison = compare(results["DFT"], results["Wannier"])
+    return make_band_edge_tables(results, comparison)
+
+
+@app.callback(
+    Output("diagnostics-interval", "disabled"),
+    Input("diagnostics-accordion", "value"),
+)
+def toggle_diagnostics_interval(opened):
+    return opened != "diagnostics"
+
+
+@app.callback(
+    Output("diagnostics", "children"),
+    Input("diagnostics-interval", "n_intervals"),
+    Input("diagnostics-accordion", "value"),
+)
+def update_diagnostics(n_intervals, opened):
+    if opened != "diagnostics":
+        raise PreventUpdate
+    return make_diagnostics_tables(summary())
+
+
+@app.callback(
+    Output("profile-select", "data"),
+    Input("diagnostics-interval", "n_intervals"),
+    Input("diagnostics-accordion", "value"),
+)
+def update_profile_options(n_intervals, opened):
+    if opened != "diagnostics":
+        raise PreventUpdate
+    return [
+        {
+            "value": profile["id"],
+            "label": "{} {} ({:.0f} ms)".format(
+                datetime.fromtimestamp(profile["time"]).strftime("%H:%M:%S"),
+                profile["callback"],
+                profile["seconds"] * 1e3,
+            ),
+        }
+        for profile in list_profiles()
+    ]
+
+
+@app.callback(Output("profile-stats", "children"), Input("profile-select", "value"))
+def show_profile(capture_id):
+    profile = get_profile(capture_id) if capture_id else None
+    if profile is None:
+        return []
+    return make_profile_table(profile)
+
+
+@app.server.route("/metrics")
+def metrics_endpoint():
+    return prometheus_text(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+# after all callbacks are registered
+instrument_callbacks(app)
+# the diagnostics panel polls while open, keep it out of the captures
+profile_callbacks(
+    app,
+    exclude=("update_diagnostics", "update_profile_options", "show_profile"),
+)
+
 server = app.server
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="report import time and memory of the app and its dependencies, then exit",
+    )
+    args = parser.parse_args()
+    if args.profile_startup:
+        # measure in a fresh interpreter, this one has imported the app already
+        sys.exit(
+            subprocess.call(
+                [sys.executable, "-m", "scripts.startup"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+        )
+
     app.run_server(debug=False)
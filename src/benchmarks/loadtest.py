@@ -0,0 +1,457 @@
+"""
+Load test of a running app with concurrent simulated sessions.
+
+Run from the src directory, against a server on localhost:
+    python -m benchmarks.loadtest [--url http://127.0.0.1:8050] [--sessions 8]
+                                  [--iterations 3] [--size small] [--variant ispin1]
+                                  [--output loadtest.json]
+or let the harness start gunicorn itself with --spawn [--workers 4].
+
+Every session replays what the browser sends to /_dash-update-component while a user
+types the file paths (path completion), loads the data, plots, changes the atom and
+orbital selection and edits the disentanglement window. Requests are built from
+/_dash-dependencies and the component values of /_dash-layout the way the Dash
+renderer builds them, outputs of a callback trigger the callbacks depending on them,
+and clientside callbacks are skipped. The synthetic calculation is written to a
+temporary directory first.
+
+Reported are the p50/p95/p99 latency of every callback, the throughput, the error
+rate and the resident memory of the workers sampled from /metrics.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+from .run import SIZES, VARIANTS, _git_revision
+from .synthetic import SyntheticCalc
+
+RSS_PATTERN = re.compile(r'^wann_app_worker_rss_bytes\{pid="(\d+)"\} (\S+)$', re.M)
+# callbacks fired by one of their outputs are followed this many levels deep
+CHAIN_DEPTH = 2
+
+
+def _walk_layout(node, values: dict) -> None:
+    """
+    Initial value of every property of the components with an id
+    """
+    if isinstance(node, list):
+        for child in node:
+            _walk_layout(child, values)
+        return
+    if not isinstance(node, dict) or "props" not in node:
+        return
+    props = node["props"]
+    if isinstance(props.get("id"), str):
+        for prop, value in props.items():
+            if prop not in ("id", "children"):
+                values[(props["id"], prop)] = value
+    for value in props.values():
+        if isinstance(value, (dict, list)):
+            _walk_layout(value, values)
+
+
+def _split_output(output: str) -> list[dict]:
+    """
+    Output ids and properties of a callback, "..a.b...c.d.." for several outputs
+    """
+    parts = output.strip(".").split("...") if output.startswith("..") else [output]
+    return [
+        {"id": part.split(".", 1)[0], "property": part.split(".", 1)[1]}
+        for part in parts
+    ]
+
+
+class App:
+    """
+    Callback graph and initial values of the app at `url`
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.callbacks = [
+            callback
+            for callback in requests.get(self.url + "/_dash-dependencies").json()
+            if not callback.get("clientside_function")
+        ]
+        self.defaults: dict = {}
+        _walk_layout(requests.get(self.url + "/_dash-layout").json(), self.defaults)
+
+    def triggered_by(self, component: str, prop: str) -> list[dict]:
+        return [
+            callback
+            for callback in self.callbacks
+            if {"id": component, "property": prop} in callback["inputs"]
+        ]
+
+
+def _name(callback: dict, trigger: str) -> str:
+    outputs = _split_output(callback["output"])
+    first = outputs[0]
+    name = "{}.{}".format(first["id"], first["property"].split("@")[0])
+    if len(outputs) > 1:
+        name += " +{}".format(len(outputs) - 1)
+    return "{} <- {}".format(name, trigger)
+
+
+class Session:
+    """
+    One simulated browser session: component values and the callbacks they fire
+    """
+
+    def __init__(self, app: App, stats: "Stats", think: float):
+        self.app = app
+        self.stats = stats
+        self.think = think
+        self.values = dict(app.defaults)
+        self.values[("session-id", "data")] = "loadtest-" + uuid.uuid4().hex
+        self.http = requests.Session()
+
+    def pause(self) -> None:
+        if self.think > 0:
+            time.sleep(self.think * random.uniform(0.5, 1.5))
+
+    def set(self, component: str, prop: str, value, depth: int = 0) -> None:
+        """
+        Change a property as the user would and run the callbacks it triggers
+        """
+        self.values[(component, prop)] = value
+        for callback in self.app.triggered_by(component, prop):
+            self.call(callback, "{}.{}".format(component, prop), depth)
+
+    def call(self, callback: dict, trigger: str, depth: int) -> None:
+        def spec(items):
+            return [
+                dict(item, value=self.values.get((item["id"], item["property"])))
+                for item in items
+            ]
+
+        outputs = _split_output(callback["output"])
+        body = {
+            "output": callback["output"],
+            "outputs": outputs if callback["output"].startswith("..") else outputs[0],
+            "inputs": spec(callback["inputs"]),
+            "changedPropIds": [trigger],
+            "state": spec(callback["state"]),
+        }
+        start = time.perf_counter()
+        try:
+            response = self.http.post(
+                self.app.url + "/_dash-update-component", json=body, timeout=300
+            )
+            ok = response.status_code in (200, 204)
+        except requests.RequestException:
+            response, ok = None, False
+        self.stats.record(_name(callback, trigger), time.perf_counter() - start, ok)
+        if not ok or response.status_code == 204:
+            return
+
+        changed = []
+        for component, props in response.json().get("response", {}).items():
+            for prop, value in props.items():
+                # partial updates (Patch) and figures are never read back as state
+                if prop == "figure" or (
+                    isinstance(value, dict) and "__dash_patch_update" in value
+                ):
+                    continue
+                self.values[(component, prop)] = value
+                changed.append((component, prop))
+        if depth < CHAIN_DEPTH:
+            for component, prop in changed:
+                for dependent in self.app.triggered_by(component, prop):
+                    self.call(dependent, "{}.{}".format(component, prop), depth + 1)
+
+    def type_path(self, component: str, path: str) -> None:
+        """
+        Path completion while typing `path` one directory at a time
+        """
+        prefixes = [path[: i + 1] for i, char in enumerate(path) if char == "/"]
+        for prefix in prefixes + [path]:
+            self.set(component, "value", prefix)
+            self.pause()
+
+    def select(self, component: str, count: int) -> None:
+        """
+        Pick `count` of the options offered by a multi-select
+        """
+        options = [
+            item["value"] if isinstance(item, dict) else item
+            for item in self.values.get((component, "data")) or []
+        ]
+        if options:
+            self.set(
+                component, "value", random.sample(options, min(count, len(options)))
+            )
+
+    def run(self, files: dict, iterations: int) -> None:
+        for component in ("vasp", "kpoints", "proj", "wann"):
+            self.type_path(component + "-input", files[component])
+        self.set("load-data", "n_clicks", 1)
+        self.pause()
+        self.select("atom-select", 1)
+        self.select("orbital-select", 2)
+        self.set("checklist", "value", ["vasp", "proj", "wann"])
+        for iteration in range(iterations):
+            self.set("generate-button", "n_clicks", 2 * iteration + 1)
+            self.pause()
+            self.select("atom-select", 1)
+            self.select("orbital-select", 2)
+            self.pause()
+            self.set("generate-button", "n_clicks", 2 * iteration + 2)
+            self.pause()
+            for window in ("dis-win", "froz-win"):
+                self.set("switch-" + window, "checked", True)
+                self.values[(window, "value")] = "{:.1f}, {:.1f}".format(
+                    random.uniform(-6, -2), random.uniform(2, 6)
+                )
+                self.set("update-{}-button".format(window), "n_clicks", iteration + 1)
+                self.pause()
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: dict[str, list] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.latency[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def report(self, wall: float) -> dict:
+        callbacks = {}
+        for name, values in sorted(self.latency.items()):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            callbacks[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+                "max": max(values),
+            }
+        total = sum(len(values) for values in self.latency.values())
+        return {
+            "requests": total,
+            "seconds": wall,
+            "throughput": total / wall if wall else 0.0,
+            "error_rate": sum(self.errors.values()) / total if total else 0.0,
+            "callbacks": callbacks,
+        }
+
+
+class RssSampler(threading.Thread):
+    """
+    Resident memory of the workers from /metrics, sampled every `interval` seconds
+    """
+
+    def __init__(self, url: str, interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.url = url.rstrip("/") + "/metrics"
+        self.interval = interval
+        self.samples: list[dict] = []
+        self._done = threading.Event()
+
+    def sample(self) -> dict:
+        try:
+            text = requests.get(self.url, timeout=10).text
+        except requests.RequestException:
+            return {}
+        return {pid: float(value) for pid, value in RSS_PATTERN.findall(text)}
+
+    def run(self) -> None:
+        while not self._done.is_set():
+            sample = self.sample()
+            if sample:
+                self.samples.append(sample)
+            self._done.wait(self.interval)
+
+    def stop(self) -> dict:
+        self._done.set()
+        self.join()
+        if not self.samples:
+            return {}
+        totals = [sum(sample.values()) for sample in self.samples]
+        peak = defaultdict(float)
+        for sample in self.samples:
+            for pid, value in sample.items():
+                peak[pid] = max(peak[pid], value)
+        return {
+            "start_mb": totals[0] / 2**20,
+            "peak_mb": max(totals) / 2**20,
+            "end_mb": totals[-1] / 2**20,
+            "peak_per_worker_mb": {pid: value / 2**20 for pid, value in peak.items()},
+        }
+
+
+def spawn_server(port: int, workers: int) -> subprocess.Popen:
+    """
+    gunicorn with the app of this checkout on localhost:`port`
+    """
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, WANN_APP_WORKERS=str(workers))
+    env.setdefault("WANN_APP_METRICS_DIR", tempfile.mkdtemp(prefix="wann_metrics_"))
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "--bind",
+            "127.0.0.1:{}".format(port),
+            "app:server",
+        ],
+        cwd=src,
+        env=env,
+    )
+    url = "http://127.0.0.1:{}".format(port)
+    for _ in range(600):
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with {}".format(process.returncode))
+        try:
+            requests.get(url + "/metrics", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+
+def run(
+    url: str,
+    sessions: int,
+    iterations: int,
+    size: str,
+    variant: str,
+    think: float,
+    ramp: float,
+) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = SyntheticCalc(**SIZES[size], **VARIANTS[variant]).write_all(tmp)
+        files = {
+            "vasp": os.path.join(directory, "vasprun.xml"),
+            "kpoints": os.path.join(directory, "KPOINTS"),
+            "proj": os.path.join(directory, "PROCAR"),
+            "wann": os.path.join(directory, "wannier90_band.dat"),
+        }
+        app = App(url)
+        stats = Stats()
+        sampler = RssSampler(url)
+        sampler.start()
+
+        def simulate(index: int) -> None:
+            time.sleep(ramp * index / max(sessions, 1))
+            Session(app, stats, think).run(files, iterations)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            for future in [pool.submit(simulate, i) for i in range(sessions)]:
+                future.result()
+        wall = time.perf_counter() - start
+        rss = sampler.stop()
+
+    report = stats.report(wall)
+    report["rss"] = rss
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(
+        "{:>60s} {:>6s} {:>6s} {:>8s} {:>8s} {:>8s}".format(
+            "callback", "count", "errors", "p50 ms", "p95 ms", "p99 ms"
+        )
+    )
+    for name, stats in report["callbacks"].items():
+        print(
+            "{:>60s} {:6d} {:6d} {:8.0f} {:8.0f} {:8.0f}".format(
+                name[-60:],
+                stats["count"],
+                stats["errors"],
+                stats["p50"] * 1e3,
+                stats["p95"] * 1e3,
+                stats["p99"] * 1e3,
+            )
+        )
+    print(
+        "{} requests in {:.1f}s, {:.1f} req/s, error rate {:.2%}".format(
+            report["requests"],
+            report["seconds"],
+            report["throughput"],
+            report["error_rate"],
+        )
+    )
+    if report["rss"]:
+        print(
+            "worker RSS: start {start_mb:.0f} MB, peak {peak_mb:.0f} MB, "
+            "end {end_mb:.0f} MB".format(**report["rss"])
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--size", choices=list(SIZES), default="small")
+    parser.add_argument("--variant", choices=list(VARIANTS), default="ispin1")
+    parser.add_argument(
+        "--think", type=float, default=0.5, help="mean pause between actions (s)"
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=5.0, help="seconds over which sessions start"
+    )
+    parser.add_argument("--spawn", action="store_true", help="start gunicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    if args.spawn:
+        server = spawn_server(args.port, args.workers)
+        url = "http://127.0.0.1:{}".format(args.port)
+    try:
+        report = run(
+            url,
+            args.sessions,
+            args.iterations,
+            args.size,
+            args.variant,
+            args.think,
+            args.ramp,
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.output:
+        report["config"] = dict(vars(args), url=url)
+        report["revision"] = _git_revision()
+        report["date"] = datetime.now().isoformat(timespec="seconds")
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
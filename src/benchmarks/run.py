@@ -0,0 +1,242 @@
+"""
+Benchmark the parsers and plot builders on synthetic calculations of increasing size.
+
+Run from the src directory:
+    python -m benchmarks.run [--sizes small medium] [--variants ispin1 ispin2 soc]
+                             [--repeat 3] [--output results.json]
+
+For every size and variant the synthetic files are written to a temporary directory,
+then each stage is timed (best of --repeat) and its peak traced memory recorded
+in a separate run.
+The plot stages also record the size of the figure JSON. Results are saved as JSON
+together with the git revision so that runs can be compared over time.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import plotly.graph_objects as go
+
+from scripts.analytics import analyze
+from scripts.parser import (EigenvalParser, ProjParser, VaspParser, WannParser,
+                            preload_heavy_modules)
+from scripts.plot import plain_bandplot, proj_bandplot
+from scripts.tb import TBModel, densify, plane_vectors, read_hr
+from scripts.utils import group_by_species
+from scripts.vaspout import VaspoutParser, VaspoutProjParser
+
+from .synthetic import SyntheticCalc
+
+# natoms, nbands, k-points per segment of the 4 segment path
+SIZES = {
+    "tiny": dict(natoms=2, nbands=16, nkpts_per_seg=10),
+    "small": dict(natoms=4, nbands=32, nkpts_per_seg=25),
+    "medium": dict(natoms=16, nbands=96, nkpts_per_seg=50),
+    "large": dict(natoms=48, nbands=256, nkpts_per_seg=100),
+}
+
+VARIANTS = {
+    "ispin1": dict(ispin=1, soc=False),
+    "ispin2": dict(ispin=2, soc=False),
+    "soc": dict(ispin=1, soc=True),
+}
+
+
+def _measure(func, repeat: int) -> dict:
+    """
+    Peak traced memory of one run and best wall time of `repeat` untraced runs
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"seconds": min(times), "peak_mb": peak / 2**20}, result
+
+
+def _figure_mb(fig: go.Figure) -> float:
+    return len(fig.to_json()) / 2**20
+
+
+def bench_calc(directory: str, repeat: int) -> dict:
+    vasp_xml = os.path.join(directory, "vasprun.xml")
+    kpoints = os.path.join(directory, "KPOINTS")
+    procar = os.path.join(directory, "PROCAR")
+    bandfile = os.path.join(directory, "wannier90_band.dat")
+    hrfile = os.path.join(directory, "wannier90_hr.dat")
+    eigenval = os.path.join(directory, "EIGENVAL")
+    vaspout = os.path.join(directory, "vaspout.h5")
+    vaspout_opt = os.path.join(directory, "vaspout_opt.h5")
+    stages = {}
+
+    stages["vasp_parse"], vasp = _measure(lambda: VaspParser(vasp_xml, kpoints), repeat)
+    stages["eigenval_parse"], _ = _measure(
+        lambda: EigenvalParser(eigenval, kpoints), repeat
+    )
+    stages["vaspout_parse"], _ = _measure(
+        lambda: VaspoutParser(vaspout, kpoints), repeat
+    )
+    # the segments and labels of the KPOINTS_OPT copy in the file
+    stages["vaspout_opt_parse"], _ = _measure(
+        lambda: VaspoutParser(vaspout_opt), repeat
+    )
+    stages["wann_read"], _ = _measure(
+        lambda: WannParser._read_wann_data(bandfile), repeat
+    )
+    stages["tb_read"], model = _measure(lambda: TBModel(*read_hr(hrfile)), repeat)
+    tb_kpoints, _ = densify(vasp.kpoints, vasp.kpath, 4)
+    stages["tb_bands"], _ = _measure(lambda: model.eigenvalues(tb_kpoints), repeat)
+    stages["tb_plane"], _ = _measure(
+        lambda: model.plane_eigenvalues(*plane_vectors("b1-b2"), 100), repeat
+    )
+    stages["procar_parse"], proj = _measure(
+        lambda: ProjParser(procar, vasp_xml, efermi=vasp.efermi), repeat
+    )
+    atoms = list(range(proj.num_ions))
+    orbitals = list(range(len(proj.orbitals)))
+    # one group per species with all orbitals, as the group projections of the app
+    groups = [
+        (species_atoms, orbitals)
+        for species_atoms in group_by_species(proj.atom_list).values()
+    ]
+
+    stages["procar_project_all"], proj_weights = _measure(
+        lambda: proj.project([0], atoms, orbitals), repeat
+    )
+    stages["procar_project"], _ = _measure(
+        lambda: proj.project([0], atoms[:1], orbitals), repeat
+    )
+    stages["procar_project_groups"], _ = _measure(
+        lambda: proj.project_groups(groups), repeat
+    )
+    stages["vaspout_proj_parse"], h5_proj = _measure(
+        lambda: VaspoutProjParser(vaspout, vaspout), repeat
+    )
+    stages["vaspout_project"], _ = _measure(
+        lambda: h5_proj.project([0], atoms[:1], orbitals), repeat
+    )
+    stages["vaspout_project_window"], _ = _measure(
+        lambda: h5_proj.project([0], atoms[:1], orbitals, window=(-2, 2)), repeat
+    )
+    stages["vaspout_project_groups"], _ = _measure(
+        lambda: h5_proj.project_groups(groups), repeat
+    )
+    stages["composition"], _ = _measure(proj.composition, repeat)
+    stages["band_edges"], _ = _measure(
+        lambda: analyze(vasp.kpath, {"up": vasp.bands}), repeat
+    )
+
+    bands = vasp.bands
+    stages["plain_bandplot"], fig = _measure(
+        lambda: plain_bandplot(go.Figure(), vasp.kpath, bands, color="blue"), repeat
+    )
+    stages["plain_bandplot"]["figure_mb"] = _figure_mb(fig)
+
+    proj_bands = proj.bands
+    stages["proj_bandplot"], fig = _measure(
+        lambda: proj_bandplot(go.Figure(), vasp.kpath, proj_bands, proj_weights),
+        repeat,
+    )
+    stages["proj_bandplot"]["figure_mb"] = _figure_mb(fig)
+
+    stages["files_mb"] = {
+        name: os.path.getsize(path) / 2**20
+        for name, path in (
+            ("vasprun", vasp_xml),
+            ("eigenval", eigenval),
+            ("vaspout", vaspout),
+            ("procar", procar),
+            ("wann", bandfile),
+            ("tb", hrfile),
+        )
+    }
+    return stages
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(sizes: list[str], variants: list[str], repeat: int = 3) -> dict:
+    # keep the lazy imports out of the first measurement
+    preload_heavy_modules()
+    results = []
+    for size in sizes:
+        for variant in variants:
+            calc = SyntheticCalc(**SIZES[size], **VARIANTS[variant])
+            with tempfile.TemporaryDirectory() as directory:
+                calc.write_all(directory)
+                # not in write_all, where the app would prefer it to vasprun.xml
+                calc.write_vaspout(os.path.join(directory, "vaspout.h5"))
+                calc.write_vaspout(
+                    os.path.join(directory, "vaspout_opt.h5"), kpoints_opt=True
+                )
+                stages = bench_calc(directory, repeat)
+            results.append(
+                {
+                    "size": size,
+                    "variant": variant,
+                    **SIZES[size],
+                    "nkpts": calc.nkpts,
+                    "stages": stages,
+                }
+            )
+            print(
+                "{:>7s} {:>7s}  ".format(size, variant)
+                + "  ".join(
+                    "{} {:.3f}s".format(name, stage["seconds"])
+                    for name, stage in stages.items()
+                    if "seconds" in stage
+                ),
+                flush=True,
+            )
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", nargs="+", default=["tiny", "small", "medium"])
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.variants, args.repeat)
+    output = args.output or "benchmark-{}.json".format(
+        datetime.now().strftime("%Y%m%d-%H%M%S")
+    )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to {}".format(output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""
+Writers for synthetic VASP / Wannier90 outputs used by the benchmarks
+"""
+
+import os
+
+import numpy as np
+
+ORBITALS = ["s", "py", "pz", "px", "dxy", "dyz", "dz2", "dxz", "x2-y2"]
+
+# fcc-like path G-X-W-L-G in fractional coordinates
+PATH = [
+    ("GAMMA", [0.0, 0.0, 0.0]),
+    ("X", [0.5, 0.0, 0.5]),
+    ("W", [0.5, 0.25, 0.75]),
+    ("L", [0.5, 0.5, 0.5]),
+    ("GAMMA", [0.0, 0.0, 0.0]),
+]
+
+
+class SyntheticCalc:
+    """
+    Random but self-consistent band structure used to write all input files
+    """
+
+    def __init__(
+        self,
+        natoms=4,
+        nbands=32,
+        nkpts_per_seg=20,
+        ispin=1,
+        soc=False,
+        species=("Fe", "O"),
+        efermi=5.0,
+        seed=0,
+    ):
+        rng = np.random.default_rng(seed)
+        self.natoms = natoms
+        self.nbands = nbands
+        self.ispin = ispin
+        self.soc = soc
+        self.efermi = efermi
+        self.species = [species[i % len(species)] for i in range(natoms)]
+        self.lattice = np.diag([4.0, 4.2, 4.4])
+        self.positions = rng.random((natoms, 3))
+        self.nkpts_per_seg = nkpts_per_seg
+
+        kpts = []
+        for (_, start), (_, end) in zip(PATH[:-1], PATH[1:]):
+            t = np.linspace(0, 1, nkpts_per_seg)[:, np.newaxis]
+            kpts.append(np.array(start) + t * (np.array(end) - np.array(start)))
+        self.kpoints = np.vstack(kpts)
+        nk = len(self.kpoints)
+
+        # cosine bands with random centres, sorted by energy at every k
+        phase = 2 * np.pi * self.kpoints @ rng.random((3, nbands))
+        centres = np.linspace(efermi - 10, efermi + 10, nbands)
+        self.eigenvalues = np.empty((ispin, nk, nbands))
+        for s in range(ispin):
+            bands = centres + 1.5 * np.cos(phase + s * 0.3)
+            self.eigenvalues[s] = np.sort(bands, axis=1)
+
+        weights = rng.random((ispin, nk, nbands, natoms, len(ORBITALS)))
+        weights /= weights.sum(axis=(3, 4), keepdims=True)
+        self.projections = weights
+
+    @property
+    def nkpts(self):
+        return len(self.kpoints)
+
+    def write_all(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.write_vasprun(os.path.join(directory, "vasprun.xml"))
+        self.write_kpoints(os.path.join(directory, "KPOINTS"))
+        self.write_procar(os.path.join(directory, "PROCAR"))
+        self.write_wann_band(os.path.join(directory, "wannier90_band.dat"))
+        self.write_wann_hr(os.path.join(directory, "wannier90_hr.dat"))
+        self.write_eigenval(os.path.join(directory, "EIGENVAL"))
+        self.write_poscar(os.path.join(directory, "POSCAR"))
+        self.write_doscar(os.path.join(directory, "DOSCAR"))
+        return directory
+
+    def write_eigenval(self, path):
+        lines = [
+            "{:5d}{:5d}{:5d}{:5d}".format(self.natoms, self.natoms, 1, self.ispin),
+            "  0.1000000E+02  0.4000000E-09  0.4000000E-09  0.4400000E-09  0.5000000E-15",
+            "  1.000000000000000E-004",
+            "  CAR",
+            " synthetic",
+            "{:7d}{:7d}{:7d}".format(2 * self.nbands, self.nkpts, self.nbands),
+        ]
+        for ik, k in enumerate(self.kpoints):
+            lines += ["", "  {:.7E}  {:.7E}  {:.7E}  {:.7E}".format(*k, 1 / self.nkpts)]
+            eig = self.eigenvalues[:, ik]
+            occ = (eig < self.efermi).astype(float)
+            for ib in range(self.nbands):
+                lines.append(
+                    "{:5d}".format(ib + 1)
+                    + "".join("  {:12.6f}".format(e) for e in eig[:, ib])
+                    + "".join("  {:8.6f}".format(o) for o in occ[:, ib])
+                )
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def write_poscar(self, path):
+        # one species entry per run of equal species, so that the atoms keep the
+        # order of vasprun.xml and PROCAR
+        runs = []
+        for species in self.species:
+            if runs and runs[-1][0] == species:
+                runs[-1][1] += 1
+            else:
+                runs.append([species, 1])
+        lines = ["synthetic", "1.0"]
+        lines += ["  {:.10f}  {:.10f}  {:.10f}".format(*v) for v in self.lattice]
+        lines += ["  " + "  ".join(species for species, _ in runs)]
+        lines += ["  " + "  ".join(str(count) for _, count in runs)]
+        lines += ["Direct"]
+        lines += ["  {:.10f}  {:.10f}  {:.10f}".format(*p) for p in self.positions]
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def write_vaspout(self, path, kpoints_opt=False):
+        """
+        The datasets of vaspout.h5 read by the app, as VASP 6 writes them. With
+        `kpoints_opt` the path is written as the KPOINTS_OPT results, next to
+        regular results of the first k-point only, as of a self-consistent run on a
+        Gamma-only mesh.
+        """
+        import h5py
+
+        runs = []
+        for species in self.species:
+            if runs and runs[-1][0] == species:
+                runs[-1][1] += 1
+            else:
+                runs.append([species, 1])
+        # (spin, ion, orbital, k-point, band)
+        par = np.moveaxis(self.projections, (3, 4), (1, 2))
+        if self.soc:
+            par = np.concatenate([par] + [par * c for c in (0.3, -0.2, 0.5)])
+        with h5py.File(path, "w") as f:
+            f["results/electron_dos/efermi"] = self.efermi
+            f["results/positions/ion_types"] = np.array(
+                [species for species, _ in runs], dtype="S"
+            )
+            f["results/positions/number_ion_types"] = [count for _, count in runs]
+            f["results/positions/lattice_vectors"] = self.lattice
+            f["results/positions/scale"] = 1.0
+            f["results/positions/position_ions"] = self.positions
+            if kpoints_opt:
+                self._write_vaspout_results(f, "", par[..., :1, :], self.kpoints[:1])
+                mesh = f.create_group("input/kpoints")
+                mesh["mode"] = np.bytes_("gamma")
+                mesh["number_kpoints"] = 1
+                self._write_vaspout_results(f, "_kpoints_opt", par, self.kpoints)
+                self._write_vaspout_path(f.create_group("input/kpoints_opt"))
+            else:
+                self._write_vaspout_results(f, "", par, self.kpoints)
+                self._write_vaspout_path(f.create_group("input/kpoints"))
+
+    def _write_vaspout_results(self, f, suffix, par, kpoints):
+        eigenvalues = self.eigenvalues[:, : len(kpoints)]
+        f["results/electron_eigenvalues{}/eigenvalues".format(suffix)] = eigenvalues
+        f["results/electron_eigenvalues{}/kpoint_coords".format(suffix)] = kpoints
+        f["results/projectors{}/par".format(suffix)] = par
+        f["results/projectors{}/lchar".format(suffix)] = np.array(ORBITALS, dtype="S")
+
+    def _write_vaspout_path(self, group):
+        group["mode"] = np.bytes_("line")
+        group["number_kpoints"] = self.nkpts_per_seg
+        corners = [point for pair in zip(PATH[:-1], PATH[1:]) for point in pair]
+        group["coordinates_kpoints"] = [point for _, point in corners]
+        group["labels_kpoints"] = np.array([label for label, _ in corners], dtype="S")
+        group["positions_labels_kpoints"] = np.arange(1, len(corners) + 1)
+
+    def write_doscar(self, path):
+        # only the header, which holds the Fermi level
+        lines = [
+            "{:4d}{:4d}{:4d}{:4d}".format(self.natoms, self.natoms, 1, 0),
+            "  0.1000000E+02  0.4000000E-09  0.4000000E-09  0.4400000E-09  0.5000000E-15",
+            "  1.000000000000000E-004",
+            "  CAR",
+            " synthetic",
+            "{:14.8f}{:14.8f}{:6d}{:14.8f}{:14.8f}".format(
+                self.efermi + 10, self.efermi - 10, 0, self.efermi, 1.0
+            ),
+        ]
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def write_kpoints(self, path):
+        lines = ["k-path", str(self.nkpts_per_seg), "Line-mode", "Reciprocal"]
+        for (label_a, start), (label_b, end) in zip(PATH[:-1], PATH[1:]):
+            lines.append("{:.6f} {:.6f} {:.6f} ! {}".format(*start, label_a))
+            lines.append("{:.6f} {:.6f} {:.6f} ! {}".format(*end, label_b))
+            lines.append("")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def write_vasprun(self, path):
+        types = list(dict.fromkeys(self.species))
+        out = [
+            '<?xml version="1.0" encoding="ISO-8859-1"?>',
+            "<modeling>",
+            " <generator>",
+            '  <i name="program" type="string">vasp </i>',
+            '  <i name="version" type="string">6.3.0  </i>',
+            " </generator>",
+            " <incar>",
+            '  <i type="int" name="ISPIN">{}</i>'.format(self.ispin),
+            " </incar>",
+            " <kpoints>",
+            '  <generation param="listgenerated">',
+            '   <i name="divisions" type="int">{}</i>'.format(self.nkpts_per_seg),
+            " </generation>",
+            '  <varray name="kpointlist" >',
+        ]
+        out += ["   <v>{:16.8f}{:16.8f}{:16.8f} </v>".format(*k) for k in self.kpoints]
+        out += ["  </varray>", '  <varray name="weights" >']
+        out += ["   <v>{:16.8f} </v>".format(1.0 / self.nkpts)] * self.nkpts
+        out += [
+            "  </varray>",
+            " </kpoints>",
+            " <parameters>",
+            '  <i type="int" name="ISPIN">{}</i>'.format(self.ispin),
+            '  <i type="int" name="NBANDS">{}</i>'.format(self.nbands),
+            '  <i type="logical" name="LSORBIT">{}</i>'.format(
+                " T  " if self.soc else " F  "
+            ),
+            " </parameters>",
+            " <atominfo>",
+            "  <atoms>{}</atoms>".format(self.natoms),
+            "  <types>{}</types>".format(len(types)),
+            '  <array name="atoms" >',
+            '   <dimension dim="1">ion</dimension>',
+            '   <field type="string">element</field>',
+            '   <field type="int">atomtype</field>',
+            "   <set>",
+        ]
+        out += [
+            "    <rc><c>{:2s}</c><c>{:4d}</c></rc>".format(s, types.index(s) + 1)
+            for s in self.species
+        ]
+        out += [
+            "   </set>",
+            "  </array>",
+            '  <array name="atomtypes" >',
+            '   <dimension dim="1">type</dimension>',
+            '   <field type="int">atomspertype</field>',
+            '   <field type="string">element</field>',
+            "   <field>mass</field>",
+            "   <field>valence</field>",
+            '   <field type="string">pseudopotential</field>',
+            "   <set>",
+        ]
+        out += [
+            "    <rc><c>{:4d}</c><c>{:2s}</c><c>1.0</c><c>8.0</c>"
+            "<c>  PAW_PBE {} 06Sep2000</c></rc>".format(self.species.count(t), t, t)
+            for t in types
+        ]
+        out += ["   </set>", "  </array>", " </atominfo>"]
+        out += self._structure("initialpos")
+        out += [" <calculation>"]
+        out += self._structure(None, indent="  ")
+        out += [
+            "  <eigenvalues>",
+            "   <array>",
+            '    <dimension dim="1">band</dimension>',
+            '    <dimension dim="2">kpoint</dimension>',
+            '    <dimension dim="3">spin</dimension>',
+            "    <field>eigene</field>",
+            "    <field>occ</field>",
+            "    <set>",
+        ]
+        for s in range(self.ispin):
+            out.append('     <set comment="spin {}">'.format(s + 1))
+            for ik in range(self.nkpts):
+                out.append('      <set comment="kpoint {}">'.format(ik + 1))
+                eig = self.eigenvalues[s, ik]
+                occ = (eig < self.efermi).astype(float)
+                out += [
+                    "       <r>{:12.4f}{:10.4f} </r>".format(e, o)
+                    for e, o in zip(eig, occ)
+                ]
+                out.append("      </set>")
+            out.append("     </set>")
+        out += [
+            "    </set>",
+            "   </array>",
+            "  </eigenvalues>",
+            "  <dos>",
+            '   <i name="efermi">{:14.8f} </i>'.format(self.efermi),
+            "  </dos>",
+            " </calculation>",
+        ]
+        out += self._structure("finalpos")
+        out += ["</modeling>"]
+        with open(path, "w") as f:
+            f.write("\n".join(out) + "\n")
+
+    def _structure(self, name, indent=" "):
+        rec = np.linalg.inv(self.lattice).T
+        head = '<structure name="{}" >'.format(name) if name else "<structure>"
+        out = [
+            indent + head,
+            indent + " <crystal>",
+            indent + '  <varray name="basis" >',
+        ]
+        out += [
+            indent + "   <v>{:16.8f}{:16.8f}{:16.8f} </v>".format(*v)
+            for v in self.lattice
+        ]
+        out += [indent + "  </varray>"]
+        out += [
+            indent
+            + '  <i name="volume">{:16.8f} </i>'.format(np.linalg.det(self.lattice))
+        ]
+        out += [indent + '  <varray name="rec_basis" >']
+        out += [indent + "   <v>{:16.8f}{:16.8f}{:16.8f} </v>".format(*v) for v in rec]
+        out += [indent + "  </varray>", indent + " </crystal>"]
+        out += [indent + ' <varray name="positions" >']
+        out += [
+            indent + "  <v>{:16.8f}{:16.8f}{:16.8f} </v>".format(*p)
+            for p in self.positions
+        ]
+        out += [indent + " </varray>", indent + "</structure>"]
+        return out
+
+    def write_procar(self, path):
+        norb = len(ORBITALS)
+        nspin_blocks = self.ispin
+        header = "ion " + " ".join("{:>6s}".format(o) for o in ORBITALS) + "    tot"
+        with open(path, "w") as f:
+            f.write("PROCAR lm decomposed\n")
+            for s in range(nspin_blocks):
+                if s > 0:
+                    f.write("\n")
+                f.write(
+                    "# of k-points:  {}         # of bands:  {}         # of ions:   {}\n\n".format(
+                        self.nkpts, self.nbands, self.natoms
+                    )
+                )
+                for ik, k in enumerate(self.kpoints):
+                    f.write(
+                        " k-point {:4d} :    {:.8f} {:.8f} {:.8f}     weight = {:.8f}\n\n".format(
+                            ik + 1, *k, 1.0 / self.nkpts
+                        )
+                    )
+                    for ib in range(self.nbands):
+                        f.write(
+                            "band {:4d} # energy {:14.8f} # occ.  {:.8f}\n\n".format(
+                                ib + 1, self.eigenvalues[s, ik, ib], 1.0
+                            )
+                        )
+                        w = self.projections[s, ik, ib]
+                        blocks = [w]
+                        if self.soc:
+                            blocks += [w * c for c in (0.3, -0.2, 0.5)]
+                        for block in blocks:
+                            f.write(header + "\n")
+                            for ia in range(self.natoms):
+                                row = block[ia]
+                                f.write(
+                                    "{:3d} ".format(ia + 1)
+                                    + " ".join("{:6.3f}".format(x) for x in row)
+                                    + " {:6.3f}\n".format(row.sum())
+                                )
+                            tot = block.sum(axis=0)
+                            f.write(
+                                "tot "
+                                + " ".join("{:6.3f}".format(x) for x in tot)
+                                + " {:6.3f}\n".format(tot.sum())
+                            )
+                        f.write("\n")
+                    f.write("\n")
+
+    def write_wann_band(self, path, num_wann=None):
+        num_wann = num_wann or min(self.nbands, 16)
+        rec = 2 * np.pi * np.linalg.inv(self.lattice).T
+        cart = self.kpoints @ rec
+        dist = np.concatenate(
+            [[0.0], np.cumsum(np.linalg.norm(np.diff(cart, axis=0), axis=1))]
+        )
+        bands = self.eigenvalues[0, :, :num_wann]
+        with open(path, "w") as f:
+            for ib in range(num_wann):
+                for x, e in zip(dist, bands[:, ib]):
+                    f.write(" {:16.8E} {:16.8E}\n".format(x, e))
+                f.write("\n")
+
+    def write_wann_hr(self, path, num_wann=None, reach=2, seed=0):
+        """
+        Random hermitian tight-binding model with R-vectors up to `reach` in every
+        direction, in the format of seedname_hr.dat
+        """
+        num_wann = num_wann or min(self.nbands, 16)
+        rng = np.random.default_rng(seed)
+        span = range(-reach, reach + 1)
+        rvecs = np.array([(a, b, c) for a in span for b in span for c in span])
+        nrpts = len(rvecs)
+        hoppings = rng.normal(size=(nrpts, num_wann, num_wann)) * 0.1 + 1j * (
+            rng.normal(size=(nrpts, num_wann, num_wann)) * 0.1
+        )
+        # H(-R) = H(R)^dagger, rvecs are symmetric about R = 0 at index nrpts // 2
+        hoppings = (hoppings + hoppings[::-1].conj().transpose(0, 2, 1)) / 2
+        hoppings[nrpts // 2] += np.diag(np.linspace(-5, 5, num_wann) + self.efermi)
+        with open(path, "w") as f:
+            f.write(" written by benchmarks.synthetic\n")
+            f.write("{:12d}\n{:12d}\n".format(num_wann, nrpts))
+            for start in range(0, nrpts, 15):
+                f.write("".join("{:5d}".format(1) for _ in rvecs[start : start + 15]))
+                f.write("\n")
+            for r, h in zip(rvecs, hoppings):
+                for n in range(num_wann):
+                    for m in range(num_wann):
+                        f.write(
+                            "{:5d}{:5d}{:5d}{:5d}{:5d}{:12.6f}{:12.6f}\n".format(
+                                *r, m + 1, n + 1, h[m, n].real, h[m, n].imag
+                            )
+                        )
@@ -0,0 +1,29 @@
+import gc
+import os
+
+bind = "0.0.0.0:8050"
+workers = int(os.environ.get("WANN_APP_WORKERS", "4"))
+
+# Import the app together with its heavy dependencies once in the master process.
+# The forked workers then share those pages copy-on-write instead of each paying the
+# import time and memory. Set WANN_APP_PRELOAD=0 to import lazily in every worker.
+preload_app = os.environ.setdefault("WANN_APP_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    # one indexer of the calculation directories for all workers, which inherit its
+    # process id and do not start their own
+    from scripts.index import ensure_indexer
+
+    ensure_indexer()
+    # keep the garbage collector of the workers from writing to (and so copying)
+    # the pages of the preloaded objects
+    if preload_app:
+        gc.freeze()
+
+
+def on_starting(server):
+    # drop the metric snapshots of workers from a previous run
+    from scripts.metrics import clear
+
+    clear()
@@ -0,0 +1,161 @@
+"""
+Band edges of band structures along a k-path: band gaps, bands crossing the Fermi
+level and effective masses at the valence band maximum and conduction band minimum.
+
+Bands are arrays (nkpts, nbands) relative to the Fermi level, as `VaspParser` and
+`WannParser` return them, and the k-path holds the distances of the points in 1/Å
+(with the factor 2 pi). Each quantity is found for all bands at once: extrema and
+crossings from reductions and sign changes over the whole array, and the parabolas
+of all band edges from one batched least squares solve.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+# hbar^2 / m_e in eV Å^2
+HBAR2_OVER_ME = 7.619964
+# points on each side of a band edge used for its parabola
+MASS_POINTS = 4
+
+
+def _segments(kpath: np.ndarray) -> np.ndarray:
+    """
+    Segment index of every point, segments are separated by steps of zero length
+    """
+    return np.concatenate([[0], np.cumsum(np.diff(kpath) <= 1e-8)])
+
+
+def _edge(bands: np.ndarray, kpath: np.ndarray, flat: int) -> dict:
+    k, band = np.unravel_index(flat, bands.shape)
+    return {
+        "energy": float(bands[k, band]),
+        "k": int(k),
+        "x": float(kpath[k]),
+        "band": int(band),
+    }
+
+
+def crossings(bands: np.ndarray, kpath: np.ndarray) -> dict[int, list[float]]:
+    """
+    Positions along the path where each band crosses the Fermi level, linearly
+    interpolated between the points around every sign change. Steps of zero length
+    join two segments and are not crossings.
+    """
+    above = bands > 0
+    change = above[1:] != above[:-1]
+    change[np.diff(kpath) <= 1e-8] = False
+    k, band = np.nonzero(change)
+    e0, e1 = bands[k, band], bands[k + 1, band]
+    x = kpath[k] + (kpath[k + 1] - kpath[k]) * e0 / (e0 - e1)
+    found: dict[int, list[float]] = {}
+    for idx, position in zip(band, x):
+        found.setdefault(int(idx), []).append(float(position))
+    return found
+
+
+def effective_masses(
+    bands: np.ndarray, kpath: np.ndarray, edges: list[tuple[int, int]]
+) -> np.ndarray:
+    """
+    Effective masses (in m_e) at band edges given as (k index, band), on the side
+    before and after the edge along the path, shape (len(edges), 2). A parabola is
+    fitted to the edge and the MASS_POINTS following points of the same segment on
+    each side; sides with fewer than three points give nan.
+    """
+    if not edges:
+        return np.zeros((0, 2))
+    k0, band = np.array(edges).T
+    segments = _segments(kpath)
+    offsets = np.arange(MASS_POINTS + 1)
+    # (edges, sides, points): indices before (reversed) and after every edge
+    idx = k0[:, None, None] + np.stack([-offsets, offsets])[None]
+    valid = (idx >= 0) & (idx < len(kpath))
+    idx = np.clip(idx, 0, len(kpath) - 1)
+    valid &= segments[idx] == segments[k0][:, None, None]
+
+    dx = np.where(valid, kpath[idx] - kpath[k0][:, None, None], 0)
+    energy = np.where(valid, bands[idx, band[:, None, None]], 0)
+    # normal equations of E = c0 + c1 dx + c2 dx^2 for all edges and sides at once
+    powers = np.stack([np.ones_like(dx), dx, dx**2], axis=-1) * valid[..., None]
+    lhs = np.einsum("espi,espj->esij", powers, powers)
+    rhs = np.einsum("espi,esp->esi", powers, energy)
+    enough = valid.sum(axis=2) >= 3
+    lhs[~enough] = np.eye(3)
+    curvature = np.linalg.solve(lhs, rhs[..., None])[..., 2, 0]
+    with np.errstate(divide="ignore"):
+        masses = HBAR2_OVER_ME / (2 * curvature)
+    masses[~enough | (curvature == 0)] = np.nan
+    return masses
+
+
+def band_edges(bands: np.ndarray, kpath: np.ndarray) -> dict:
+    """
+    Gap, valence band maximum, conduction band minimum, bands crossing the Fermi
+    level and effective masses at the edges of one spin channel. A band with
+    energies on both sides of the Fermi level makes the channel metallic, gaps are
+    then zero.
+    """
+    kpath = np.ravel(kpath)
+    bands = np.asarray(bands)
+    result = {"crossings": crossings(bands, kpath), "vbm": None, "cbm": None}
+    below = np.where(bands <= 0, bands, -np.inf)
+    above = np.where(bands > 0, bands, np.inf)
+    if np.isfinite(below).any():
+        result["vbm"] = _edge(bands, kpath, np.argmax(below))
+    if np.isfinite(above).any():
+        result["cbm"] = _edge(bands, kpath, np.argmin(above))
+
+    metallic = bool(result["crossings"])
+    result["metallic"] = metallic
+    result["gap"], result["direct_gap"], result["direct_x"] = None, None, None
+    if result["vbm"] and result["cbm"]:
+        if metallic:
+            result["gap"], result["direct_gap"] = 0.0, 0.0
+        else:
+            result["gap"] = result["cbm"]["energy"] - result["vbm"]["energy"]
+            direct = above.min(axis=1) - below.max(axis=1)
+            k = int(np.argmin(direct))
+            result["direct_gap"] = float(direct[k])
+            result["direct_x"] = float(kpath[k])
+
+    edges = [result[name] for name in ("vbm", "cbm") if result[name]]
+    masses = effective_masses(bands, kpath, [(e["k"], e["band"]) for e in edges])
+    for edge, pair in zip(edges, masses):
+        edge["masses"] = [None if np.isnan(m) else float(m) for m in pair]
+    return result
+
+
+def analyze(kpath: np.ndarray, channels: dict[str, np.ndarray]) -> dict:
+    """
+    Band edges of every spin channel, and the gap between the highest valence and
+    lowest conduction states of all channels together
+    """
+    result = {name: band_edges(bands, kpath) for name, bands in channels.items()}
+    vbms = [r["vbm"]["energy"] for r in result.values() if r["vbm"]]
+    cbms = [r["cbm"]["energy"] for r in result.values() if r["cbm"]]
+    gap: Optional[float] = None
+    if any(r["metallic"] for r in result.values()):
+        gap = 0.0
+    elif vbms and cbms:
+        gap = min(cbms) - max(vbms)
+    return {"channels": result, "gap": gap}
+
+
+def compare(dft: dict, wann: dict) -> dict:
+    """
+    Differences Wannier - DFT of the gaps and band edge energies of the channels
+    present in both
+    """
+    diff = {}
+    for name in dft["channels"].keys() & wann["channels"].keys():
+        a, b = dft["channels"][name], wann["channels"][name]
+        entry = {}
+        for key in ("gap", "direct_gap"):
+            if a[key] is not None and b[key] is not None:
+                entry[key] = b[key] - a[key]
+        for edge in ("vbm", "cbm"):
+            if a[edge] and b[edge]:
+                entry[edge] = b[edge]["energy"] - a[edge]["energy"]
+        diff[name] = entry
+    return diff
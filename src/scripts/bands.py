@@ -0,0 +1,102 @@
+import numpy as np
+
+# largest number of clashing bands given to the Hungarian solver at one k-point
+MAX_ASSIGNMENT = 256
+
+
+def _score(unit_prev, e_prev, unit_next, e_next, max_jump):
+    """
+    Character overlap between tracked bands and candidate bands. The energy term
+    only breaks ties between bands of equal character.
+    """
+    jump = np.abs(e_prev[..., np.newaxis] - e_next)
+    score = np.einsum("...c,...wc->...w", unit_prev, unit_next) - 1e-3 * jump
+    score[jump > max_jump] = -2.0
+    return score
+
+
+def _connect_step(unit_prev, e_prev, unit_next, e_next, max_jump):
+    """
+    Assign each tracked band to one band at the next k-point, maximizing the
+    total score. Only bands within `max_jump` of each other are compared and
+    only rows that compete for the same band go to the Hungarian solver. When more
+    than MAX_ASSIGNMENT rows compete the characters do not tell the bands apart
+    (e.g. noisy projections), and they take the free bands in energy order.
+    """
+    nbands = len(e_next)
+    rows = np.arange(nbands)
+    lo = np.searchsorted(e_next, e_prev - max_jump, side="left")
+    hi = np.searchsorted(e_next, e_prev + max_jump, side="right")
+    width = max(int((hi - lo).max()), 1)
+    cand = np.minimum(lo[:, np.newaxis] + np.arange(width), nbands - 1)
+    score = _score(unit_prev, e_prev, unit_next[cand], e_next[cand], max_jump)
+    best = cand[rows, score.argmax(axis=1)]
+
+    counts = np.bincount(best, minlength=nbands)
+    clash = counts[best] > 1
+    if not clash.any():
+        return best
+
+    clash_rows = np.flatnonzero(clash)
+    taken = np.zeros(nbands, dtype=bool)
+    taken[best[~clash]] = True
+    free_cols = np.flatnonzero(~taken)
+    if len(clash_rows) > MAX_ASSIGNMENT:
+        best[clash_rows[np.argsort(e_prev[clash_rows], kind="stable")]] = free_cols
+        return best
+
+    from scipy.optimize import linear_sum_assignment
+
+    score = _score(
+        unit_prev[clash_rows],
+        e_prev[clash_rows],
+        unit_next[np.newaxis, free_cols],
+        e_next[np.newaxis, free_cols],
+        max_jump,
+    )
+    r, c = linear_sum_assignment(score, maximize=True)
+    best[clash_rows[r]] = free_cols[c]
+    return best
+
+
+def connect_bands(
+    bands: np.ndarray, characters: np.ndarray, max_jump: float = 1.0
+) -> np.ndarray:
+    """
+    Track band identity along the k-path by orbital character.
+
+    bands: (nkpts, nbands) energies, sorted at each k-point
+    characters: (nkpts, nbands, nchannels) projection vectors
+    max_jump: largest energy change (eV) allowed between neighbouring k-points
+
+    Returns an (nkpts, nbands) index array `order` so that
+    `np.take_along_axis(bands, order, axis=1)[:, i]` follows band i.
+    """
+    nkpts, nbands = bands.shape
+    norm = np.linalg.norm(characters, axis=2, keepdims=True)
+    unit = np.divide(
+        characters, norm, out=np.zeros_like(characters, dtype=float), where=norm > 0
+    )
+
+    order = np.empty((nkpts, nbands), dtype=int)
+    order[0] = np.arange(nbands)
+    for ik in range(1, nkpts):
+        prev = order[ik - 1]
+        order[ik] = _connect_step(
+            unit[ik - 1, prev], bands[ik - 1, prev], unit[ik], bands[ik], max_jump
+        )
+
+    return order
+
+
+def reorder_bands(data: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """
+    Apply a band order from `connect_bands` to bands or weights of shape (nkpts, nbands)
+    """
+    if order.shape != data.shape:
+        raise ValueError(
+            "Band order of shape {} for data of shape {}".format(
+                order.shape, data.shape
+            )
+        )
+    return np.take_along_axis(data, order, axis=1)
@@ -1,13 +1,134 @@
 import os
+import tempfile
 
-import plotly.express as px
+from plotly.colors import qualitative
 
 # for docker build, change WORK_DIR to /data
 WORK_DIR = os.path.expanduser("~")
-VASP_COLOR = px.colors.qualitative.Plotly[0]
-VASP_COLOR2 = px.colors.qualitative.Plotly[2]
-WANN_COLOR = px.colors.qualitative.Plotly[1]
+VASP_COLOR = qualitative.Plotly[0]
+VASP_COLOR2 = qualitative.Plotly[2]
+WANN_COLOR = qualitative.Plotly[1]
+TB_COLOR = qualitative.Plotly[5]
 PROJ_COLOR = "Agsunset"
-DIS_WIN_COLOR = px.colors.qualitative.Pastel[1]
-FROZ_WIN_COLOR = px.colors.qualitative.Pastel[0]
-SYMMLINE_COLOR = px.colors.qualitative.Prism[10]
+PROJ_COLOR2 = "Tealgrn"
+SPIN_TEXTURE_COLOR = "RdBu_r"
+FAT_BAND_COLOR = qualitative.Plotly[3]
+FAT_BAND_COLOR2 = qualitative.Plotly[4]
+# default colors of projection groups, red, blue and green first for RGB mixing
+GROUP_COLORS = ["#e41a1c", "#377eb8", "#4daf4a"] + qualitative.Set1[3:]
+DIS_WIN_COLOR = qualitative.Pastel[1]
+FROZ_WIN_COLOR = qualitative.Pastel[0]
+SYMMLINE_COLOR = qualitative.Prism[10]
+LAYER_COLORS = qualitative.Dark24
+DOS_COLOR = "black"
+PDOS_COLOR = qualitative.Plotly[3]
+HIGHLIGHT_COLOR = qualitative.Plotly[9]
+
+# import pymatgen/pyprocar/pandas when the app is imported instead of on first use,
+# set by gunicorn.conf.py so that preloaded workers share them
+PRELOAD = os.environ.get("WANN_APP_PRELOAD") == "1"
+
+# fat bands: points with a weight below this fraction of the largest weight are
+# not drawn, marker diameter (px) of the largest weight
+FAT_BAND_THRESHOLD = 0.02
+FAT_BAND_SIZE = 14
+
+# DOS computed from band energies: bin width and default Gaussian broadening (eV),
+# fraction of the figure width taken by the DOS panel
+DOS_STEP = 0.01
+DOS_SIGMA = 0.05
+DOS_PANEL_WIDTH = 0.22
+
+# number of recently read plain values (Fermi levels) kept in memory, parsed
+# datasets are held by the sessions only; threads used to parse datasets
+VALUE_CACHE_SIZE = 64
+LOAD_WORKERS = 4
+
+# memory budget (MB) of the datasets and derived arrays of one session and of all
+# sessions of a worker, and seconds after which an idle session is dropped
+SESSION_MEMORY_MB = int(os.environ.get("WANN_APP_SESSION_MEMORY_MB", "1024"))
+TOTAL_SESSION_MEMORY_MB = int(
+    os.environ.get("WANN_APP_TOTAL_SESSION_MEMORY_MB", "4096")
+)
+SESSION_TTL = 3600
+
+# path completion: entries shown per directory, directory listings kept in memory
+# and the files shown when only relevant files are requested
+COMPLETION_LIMIT = 200
+COMPLETION_CACHE_SIZE = 256
+RELEVANT_FILES = (
+    "vasprun.xml*",
+    "vaspout*.h5",
+    "EIGENVAL*",
+    "KPOINTS*",
+    "PROCAR*",
+    "*_band.dat",
+    "*_hr.dat",
+    "*_tb.dat",
+)
+
+# bands are read from EIGENVAL instead of a vasprun.xml this many times larger
+EIGENVAL_SIZE_RATIO = 10
+
+# local files written by the app, e.g. the calculation index
+CACHE_DIR = os.path.join(WORK_DIR, ".wannier_app")
+INDEX_DB = os.path.join(CACHE_DIR, "calc_index.sqlite")
+# seconds between rescans of WORK_DIR
+INDEX_INTERVAL = 600
+
+# Wannier tight-binding bands: binary cache of the parsed hoppings, memory (bytes) of
+# the H(k) diagonalized at once, threads used for models of at least
+# TB_PARALLEL_NWANN Wannier functions and largest k-point density of the plot
+TB_CACHE_DIR = os.path.join(CACHE_DIR, "tb")
+TB_CHUNK_BYTES = 64 * 2**20
+TB_WORKERS = min(os.cpu_count() or 1, 8)
+TB_PARALLEL_NWANN = 64
+TB_MAX_DENSITY = 20
+# k-plane view: default and largest number of points along each axis, Lorentzian
+# broadening (eV) of the spectral weight heatmap
+KPLANE_RESOLUTION = 100
+KPLANE_MAX_RESOLUTION = 400
+KPLANE_BROADENING = 0.05
+
+# watch mode: milliseconds between checks of the loaded files, seconds a file must
+# be left unmodified before it is reloaded, stat polling instead of inotify (set
+# WANN_APP_WATCH_POLL=1) and filesystems that are always polled
+WATCH_INTERVAL = 2000
+WATCH_SETTLE = 1.0
+WATCH_POLL = os.environ.get("WANN_APP_WATCH_POLL") == "1"
+REMOTE_FILESYSTEMS = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "fuse.sshfs",
+    "lustre",
+    "gpfs",
+    "beegfs",
+    "ceph",
+    "9p",
+}
+
+# wannier90.wout monitor: milliseconds between polls, largest chunk (bytes) parsed
+# per poll, monitors kept per process and warnings kept per file
+WOUT_INTERVAL = 2000
+WOUT_MAX_READ = 64 * 2**20
+WOUT_MONITORS = 8
+WOUT_MAX_WARNINGS = 100
+
+# per-process metric snapshots, merged by the /metrics endpoint
+METRICS_DIR = os.environ.get(
+    "WANN_APP_METRICS_DIR", os.path.join(tempfile.gettempdir(), "wann_app_metrics")
+)
+
+# cProfile captures of callbacks: callbacks always profiled (comma separated names),
+# number of captures kept and functions listed per capture
+PROFILE_DIR = os.path.join(CACHE_DIR, "profiles")
+PROFILE_CALLBACKS = {
+    name.strip()
+    for name in os.environ.get("WANN_APP_PROFILE_CALLBACKS", "").split(",")
+    if name.strip()
+}
+PROFILE_KEEP = 50
+PROFILE_TOP_N = 20
@@ -0,0 +1,165 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .config import LOAD_WORKERS, VALUE_CACHE_SIZE
+from .metrics import inc
+from .parser import (BandArrays, EigenvalParser, ProjArrays, ProjParser,
+                     VaspParser, WannParser, is_eigenval, read_efermi)
+from .tb import TBModel, read_tb_model
+from .vaspout import VaspoutParser, VaspoutProjParser, is_vaspout
+
+# every parsed object still referenced somewhere, e.g. by a session, so that sessions
+# opening the same files share one object. Parsed objects are only held by the
+# sessions (see session.py), where they count against the memory budgets.
+_shared: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+# plain values like the Fermi level, which can't be weakly referenced
+_values: OrderedDict = OrderedDict()
+_pending: dict[tuple, Future] = {}
+_lock = threading.Lock()
+
+
+def file_key(*paths: Optional[str]) -> tuple:
+    """
+    Identify files by path and modification time, so that a rewritten file is re-parsed
+    """
+    key = []
+    for path in paths:
+        try:
+            key.append((path, os.stat(path).st_mtime_ns))
+        except (TypeError, OSError):
+            # missing files are left to the parser to report
+            key.append((path, None))
+    return tuple(key)
+
+
+def _cached(kind: str, paths: tuple, loader: Callable):
+    """
+    Return the parsed object for `paths`, parsing it at most once while it is
+    referenced. Concurrent requests for the same files wait for the first parse
+    instead of parsing again, so datasets pointing at the same files share one object.
+    """
+    key = (kind,) + file_key(*paths)
+    with _lock:
+        if key in _values:
+            _values.move_to_end(key)
+            inc("wann_app_cache_requests_total", cache="dataset", result="hit")
+            return _values[key]
+        obj = _shared.get(key)
+        if obj is not None:
+            inc("wann_app_cache_requests_total", cache="dataset", result="hit")
+            return obj
+        future = _pending.get(key)
+        owner = future is None
+        # waiting for another thread's parse counts as a hit
+        inc(
+            "wann_app_cache_requests_total",
+            cache="dataset",
+            result="miss" if owner else "hit",
+        )
+        if owner:
+            future = _pending[key] = Future()
+
+    if not owner:
+        return future.result()
+
+    try:
+        obj = loader()
+    except Exception as e:
+        with _lock:
+            _pending.pop(key, None)
+        future.set_exception(e)
+        raise
+
+    with _lock:
+        _pending.pop(key, None)
+        try:
+            _shared[key] = obj
+        except TypeError:
+            _values[key] = obj
+            while len(_values) > VALUE_CACHE_SIZE:
+                _values.popitem(last=False)
+    future.set_result(obj)
+    return obj
+
+
+def load_vasp(vasp_xml: str, kpoint_file: str) -> VaspParser | BandArrays:
+    """
+    Bands of vasprun.xml, or of vaspout.h5 or EIGENVAL when given instead (see
+    `find_vaspout` and `find_eigenval`)
+    """
+    if is_vaspout(vasp_xml):
+        parser = VaspoutParser
+    else:
+        parser = EigenvalParser if is_eigenval(vasp_xml) else VaspParser
+    return _cached(
+        "vasp", (vasp_xml, kpoint_file), lambda: parser(vasp_xml, kpoint_file)
+    )
+
+
+def load_efermi(vasp_xml: str) -> float:
+    return _cached("efermi", (vasp_xml,), lambda: read_efermi(vasp_xml))
+
+
+def load_wann(bandfile: str, vasp_xml: Optional[str] = None) -> WannParser:
+    def loader():
+        efermi = load_efermi(vasp_xml) if vasp_xml else None
+        wann = WannParser(bandfile, efermi=efermi)
+        wann.read_file()
+        return wann
+
+    return _cached("wann", (bandfile, vasp_xml), loader)
+
+
+def load_tb(path: str) -> TBModel:
+    return _cached("tb", (path,), lambda: read_tb_model(path))
+
+
+def load_proj(procar: str, vasp_xml: str) -> ProjArrays:
+    """
+    Parsed PROCAR (or the projections of vaspout.h5), shared by all callers: use
+    `project` on it, the pyprocar selection of ProjParser modifies the parser and
+    is not offered for vaspout.h5
+    """
+
+    def loader():
+        if is_vaspout(procar):
+            # the Fermi level of the same vaspout.h5 is read with the projections
+            efermi = None if vasp_xml == procar else load_efermi(vasp_xml)
+            return VaspoutProjParser(procar, vasp_xml, efermi=efermi)
+        return ProjParser(procar, vasp_xml, efermi=load_efermi(vasp_xml))
+
+    return _cached("proj", (procar, vasp_xml), loader)
+
+
+def load_layers(layers: list[dict]) -> list[dict]:
+    """
+    Parse the files of all layers concurrently.
+
+    Each layer is a dict with optional "vasp", "kpoints" and "wann" paths. Returns a
+    list with one dict per layer holding the parsed "vasp" and "wann" objects, or the
+    exception raised while parsing them.
+    """
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        futures = []
+        for layer in layers:
+            jobs = {}
+            if layer.get("vasp") and layer.get("kpoints"):
+                jobs["vasp"] = pool.submit(load_vasp, layer["vasp"], layer["kpoints"])
+            if layer.get("wann"):
+                jobs["wann"] = pool.submit(load_wann, layer["wann"], layer.get("vasp"))
+            futures.append(jobs)
+
+    results = []
+    for jobs in futures:
+        result = {}
+        for kind, future in jobs.items():
+            try:
+                result[kind] = future.result()
+            except Exception as e:
+                result[kind] = e
+        results.append(result)
+    return results
@@ -0,0 +1,165 @@
+"""
+Density of states for the side panel of the band plot.
+
+The DOS is read from vasprun.xml when VASP wrote one, otherwise it is computed from
+the band energies: the (projected) weights are binned on an energy grid once, for
+all atoms and orbitals at the same time, and every broadening or selection change
+only sums the binned weights and convolves them with a Gaussian by FFT.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from .config import DOS_STEP
+from .metrics import timer
+
+# number of energies binned per chunk, bounds the temporary index arrays
+_CHUNK = 2**21
+
+
+def dos_grid(bands: np.ndarray, step: float = DOS_STEP) -> np.ndarray:
+    """
+    Bin centres covering the band energies with a margin of 1 eV
+    """
+    emin = np.floor(bands.min()) - 1
+    emax = np.ceil(bands.max()) + 1
+    return emin + step * (np.arange(int(round((emax - emin) / step))) + 0.5)
+
+
+def histogram(
+    energies: np.ndarray, weights: np.ndarray, grid: np.ndarray
+) -> np.ndarray:
+    """
+    Weights binned by energy, all channels at once.
+    energies: (n,), weights: (n, nchannels). Returns an array (len(grid), nchannels).
+    """
+    step = grid[1] - grid[0]
+    nbins = len(grid)
+    nchannels = weights.shape[1]
+    hist = np.zeros(nbins * nchannels)
+    channels = np.arange(nchannels)
+    chunk = max(_CHUNK // nchannels, 1)
+    for start in range(0, len(energies), chunk):
+        idx = np.floor((energies[start : start + chunk] - grid[0]) / step + 0.5)
+        idx = idx.astype(int)
+        inside = (idx >= 0) & (idx < nbins)
+        flat = (idx[inside, np.newaxis] * nchannels + channels).ravel()
+        hist += np.bincount(
+            flat,
+            weights=weights[start : start + chunk][inside].ravel(),
+            minlength=nbins * nchannels,
+        )
+    return hist.reshape(nbins, nchannels)
+
+
+def broaden(hist: np.ndarray, sigma: float, step: float) -> np.ndarray:
+    """
+    Density (states/eV) from binned weights, convolved along the last axis with a
+    normalized Gaussian of width `sigma` (eV) by FFT
+    """
+    if not sigma or sigma <= 0:
+        return hist / step
+    nbins = hist.shape[-1]
+    # zero padding keeps the circular convolution from wrapping around
+    n = nbins + int(np.ceil(5 * sigma / step))
+    freq = np.fft.rfftfreq(n, d=step)
+    kernel = np.exp(-2 * (np.pi * freq * sigma) ** 2)
+    spectrum = np.fft.rfft(hist, n=n) * kernel
+    return np.fft.irfft(spectrum, n=n)[..., :nbins] / step
+
+
+def total_histograms(blocks: list[np.ndarray], grid: np.ndarray) -> np.ndarray:
+    """
+    Number of states per k-point binned on `grid`, for each spin block of band
+    energies (nkpts, nbands). Returns an array (nblocks, len(grid)).
+
+    All k-points of the path are weighted equally, so the DOS is that of the path
+    rather than of the Brillouin zone.
+    """
+    return np.array(
+        [
+            histogram(bands.ravel(), np.ones((bands.size, 1)), grid)[:, 0]
+            / bands.shape[0]
+            for bands in blocks
+        ]
+    )
+
+
+def projected_histograms(proj, grid: np.ndarray) -> np.ndarray:
+    """
+    PROCAR weights of every atom and orbital binned on `grid`, per spin block.
+    Returns an array (nblocks, len(grid), nions, norbitals).
+    """
+    weights = proj.orbital_weights
+    nkpts, _, nions, norbs = weights.shape
+    hists = []
+    with timer("wann_app_parser_seconds", stage="dos_histogram"):
+        for block in proj.spin_blocks:
+            energies = proj.bands[:, block].ravel()
+            channels = weights[:, block].reshape(len(energies), nions * norbs)
+            hist = histogram(energies, channels, grid) / nkpts
+            hists.append(hist.reshape(len(grid), nions, norbs).astype(np.float32))
+    return np.array(hists)
+
+
+def select(hists: np.ndarray, atoms: list[int], orbs: list[int]) -> np.ndarray:
+    """
+    Sum of histograms (..., nions, norbitals) over the given atoms and orbitals
+    """
+    atom_mask = np.zeros(hists.shape[-2])
+    atom_mask[[atom for atom in atoms if atom < len(atom_mask)]] = 1
+    orb_mask = np.zeros(hists.shape[-1])
+    orb_mask[[orb for orb in orbs if orb < len(orb_mask)]] = 1
+    return np.einsum("...ao,a,o->...", hists, atom_mask, orb_mask)
+
+
+def _rows(sets) -> np.ndarray:
+    """
+    Values of the <r> rows of every set, shape (nsets, nrows, ncolumns)
+    """
+    values = [
+        np.array(" ".join(row.text for row in s.iter("r")).split(), dtype=float)
+        for s in sets
+    ]
+    nrows = len(sets[0].findall("r"))
+    return np.array(values).reshape(len(sets), nrows, -1)
+
+
+def read_vasprun_dos(vasp_xml: str) -> Optional[dict]:
+    """
+    Total and partial DOS written by VASP, None if vasprun.xml has none.
+
+    Returns energies (ne,), total (nspin, ne) and partial (nspin, ne, nions, norb)
+    or None without LORBIT. For non-collinear runs only the total (not the
+    magnetization) channel is kept.
+    """
+    import xml.etree.ElementTree as ET
+
+    dos = {}
+    inside = False
+    with timer("wann_app_parser_seconds", stage="vasprun_dos"):
+        for event, elem in ET.iterparse(vasp_xml, events=("start", "end")):
+            if elem.tag == "dos":
+                if event == "end":
+                    break
+                inside = True
+            if event != "end":
+                continue
+            if elem.tag == "total" and inside:
+                total = _rows(elem.find("array/set").findall("set"))
+                dos["energies"] = total[0, :, 0]
+                dos["total"] = total[:, :, 1]
+            elif elem.tag == "partial" and inside:
+                ions = elem.find("array/set").findall("set")
+                # (nions, nspin, ne, 1 + norb)
+                partial = np.array([_rows(ion.findall("set")) for ion in ions])
+                if len(dos.get("total", ())) == 1:
+                    partial = partial[:, :1]
+                dos["partial"] = partial[..., 1:].transpose(1, 2, 0, 3)
+            elif not inside:
+                elem.clear()
+    if "total" not in dos:
+        return None
+    dos.setdefault("partial", None)
+    return dos
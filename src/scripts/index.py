@@ -0,0 +1,361 @@
+import fcntl
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from .config import INDEX_DB, INDEX_INTERVAL, WORK_DIR
+from .utils import search_file_tail
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calcs (
+    dir TEXT PRIMARY KEY,
+    vasprun TEXT,
+    kpoints TEXT,
+    procar TEXT,
+    wann TEXT,
+    formula TEXT,
+    natoms INTEGER,
+    nbands INTEGER,
+    nkpts INTEGER,
+    ispin INTEGER,
+    efermi REAL,
+    vasprun_size INTEGER,
+    vasprun_mtime REAL,
+    procar_size INTEGER,
+    procar_mtime REAL,
+    wann_size INTEGER,
+    wann_mtime REAL,
+    scanned REAL
+)
+"""
+
+# listing of every directory below the root at its last modification, so that
+# directories that did not change are not listed again: subdirectories and the
+# names of calculation files, newline separated
+DIRS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    dir TEXT PRIMARY KEY,
+    mtime REAL,
+    subdirs TEXT,
+    filenames TEXT
+)
+"""
+
+CALC_FILES = {"vasprun.xml", "KPOINTS", "PROCAR"}
+WANN_SUFFIX = "_band.dat"
+
+# environment variable holding the process id of the process running the indexer,
+# inherited by processes forked from it (e.g. the gunicorn workers of the master)
+INDEXER_PID = "WANN_APP_INDEXER_PID"
+
+# bytes read from the start of vasprun.xml for the header data
+HEAD_BYTES = 4 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+_indexer: Optional[threading.Thread] = None
+_indexer_pid: Optional[int] = None
+_indexer_lock = threading.Lock()
+
+
+def connect(db_path: str = INDEX_DB) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(SCHEMA)
+    conn.execute(DIRS_SCHEMA)
+    return conn
+
+
+def read_vasprun_summary(vasp_xml: str) -> dict:
+    """
+    Cheap metadata of a vasprun.xml: the header is read from the start of the file and
+    the Fermi level from DOSCAR or the end of the file, never parsing the whole xml.
+    """
+    with open(vasp_xml, "r", errors="replace") as f:
+        head = f.read(HEAD_BYTES)
+
+    summary = {}
+    species = re.findall(
+        r"<rc>\s*<c>\s*([A-Za-z]+)\s*</c>\s*<c>\s*\d+\s*</c>\s*</rc>", head
+    )
+    if species:
+        counts = Counter(species)
+        summary["formula"] = "".join(
+            "{}{}".format(el, n if n > 1 else "") for el, n in counts.items()
+        )
+    for key, pattern in (
+        ("natoms", r"<atoms>\s*(\d+)\s*</atoms>"),
+        ("nbands", r'name="NBANDS">\s*(\d+)'),
+        ("ispin", r'name="ISPIN">\s*(\d+)'),
+    ):
+        match = re.search(pattern, head)
+        if match:
+            summary[key] = int(match.group(1))
+    kpointlist = re.search(r'<varray name="kpointlist"\s*>(.*?)</varray>', head, re.S)
+    if kpointlist:
+        summary["nkpts"] = kpointlist.group(1).count("<v>")
+    summary["efermi"] = read_efermi_fast(vasp_xml)
+    return summary
+
+
+def read_efermi_fast(vasp_xml: str) -> Optional[float]:
+    """
+    Fermi level from line 6 of a DOSCAR next to vasprun.xml, or from the last
+    efermi tag found near the end of vasprun.xml
+    """
+    doscar = os.path.join(os.path.dirname(vasp_xml), "DOSCAR")
+    try:
+        with open(doscar) as f:
+            for _ in range(5):
+                f.readline()
+            return float(f.readline().split()[3])
+    except (OSError, IndexError, ValueError):
+        pass
+
+    match = search_file_tail(vasp_xml, rb'<i name="efermi">\s*([-\d.Ee+]+)\s*</i>')
+    return float(match.group(1)) if match else None
+
+
+def _stat(path: Optional[str]) -> tuple:
+    if not path:
+        return None, None
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def _find_calc_files(dirpath: str, filenames: list[str]) -> Optional[dict]:
+    """
+    A calculation directory has vasprun.xml and KPOINTS, PROCAR and a Wannier band file
+    are optional
+    """
+    names = set(filenames)
+    if "vasprun.xml" not in names or "KPOINTS" not in names:
+        return None
+    files = {
+        "vasprun": os.path.join(dirpath, "vasprun.xml"),
+        "kpoints": os.path.join(dirpath, "KPOINTS"),
+        "procar": os.path.join(dirpath, "PROCAR") if "PROCAR" in names else None,
+        "wann": None,
+    }
+    wann = sorted(name for name in names if name.endswith(WANN_SUFFIX))
+    if wann:
+        files["wann"] = os.path.join(dirpath, wann[0])
+    return files
+
+
+def _list_dir(path: str) -> tuple[list[str], list[str]]:
+    """
+    Subdirectories (not hidden, not followed if links) and calculation files of a
+    directory
+    """
+    subdirs, filenames = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+            elif entry.name in CALC_FILES or entry.name.endswith(WANN_SUFFIX):
+                filenames.append(entry.name)
+    return sorted(subdirs), sorted(filenames)
+
+
+def _walk(conn: sqlite3.Connection, root: str) -> list[tuple[str, list[str]]]:
+    """
+    Every directory below `root` with its calculation files. Only directories whose
+    mtime changed since the last scan are listed again, the others only cost a stat:
+    files created, removed or renamed change the mtime of their directory.
+    """
+    known = {row["dir"]: row for row in conn.execute("SELECT * FROM dirs")}
+    found = []
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        row = known.get(path)
+        if row is not None and row["mtime"] == mtime:
+            subdirs = row["subdirs"].split("\n") if row["subdirs"] else []
+            filenames = row["filenames"].split("\n") if row["filenames"] else []
+        else:
+            try:
+                subdirs, filenames = _list_dir(path)
+            except OSError:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                (path, mtime, "\n".join(subdirs), "\n".join(filenames)),
+            )
+        found.append((path, filenames))
+        stack.extend(os.path.join(path, name) for name in reversed(subdirs))
+
+    listed = {path for path, _ in found}
+    gone = [(d,) for d in known if d not in listed]
+    conn.executemany("DELETE FROM dirs WHERE dir = ?", gone)
+    return found
+
+
+def scan(root: str = WORK_DIR, db_path: str = INDEX_DB) -> int:
+    """
+    Walk `root` and update the index. Directories that did not change since the last
+    scan are not listed again (see `_walk`) and files whose size and mtime did not
+    change are not read again: the calculation files are still checked, as VASP
+    rewrites them in place. Returns the number of (re)indexed directories.
+    """
+    conn = connect(db_path)
+    known = {row["dir"]: row for row in conn.execute("SELECT * FROM calcs")}
+    seen = set()
+    updated = 0
+    for dirpath, filenames in _walk(conn, root):
+        files = _find_calc_files(dirpath, filenames)
+        if files is None:
+            continue
+        seen.add(dirpath)
+        try:
+            vasprun_size, vasprun_mtime = _stat(files["vasprun"])
+            procar_size, procar_mtime = _stat(files["procar"])
+            wann_size, wann_mtime = _stat(files["wann"])
+        except OSError:
+            continue
+
+        row = known.get(dirpath)
+        if (
+            row is not None
+            and row["vasprun_mtime"] == vasprun_mtime
+            and row["vasprun_size"] == vasprun_size
+        ):
+            if (
+                row["procar_mtime"] == procar_mtime
+                and row["wann_mtime"] == wann_mtime
+                and row["wann"] == files["wann"]
+            ):
+                continue
+            summary = {
+                key: row[key]
+                for key in ("formula", "natoms", "nbands", "nkpts", "ispin", "efermi")
+            }
+        else:
+            try:
+                summary = read_vasprun_summary(files["vasprun"])
+            except OSError:
+                continue
+
+        conn.execute(
+            "INSERT OR REPLACE INTO calcs VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                dirpath,
+                files["vasprun"],
+                files["kpoints"],
+                files["procar"],
+                files["wann"],
+                summary.get("formula"),
+                summary.get("natoms"),
+                summary.get("nbands"),
+                summary.get("nkpts"),
+                summary.get("ispin"),
+                summary.get("efermi"),
+                vasprun_size,
+                vasprun_mtime,
+                procar_size,
+                procar_mtime,
+                wann_size,
+                wann_mtime,
+                time.time(),
+            ),
+        )
+        updated += 1
+        if updated % 100 == 0:
+            conn.commit()
+
+    gone = [(d,) for d in known if d not in seen]
+    conn.executemany("DELETE FROM calcs WHERE dir = ?", gone)
+    conn.commit()
+    conn.close()
+    return updated
+
+
+def search(query: str, limit: int = 50, db_path: str = INDEX_DB) -> list[dict]:
+    """
+    Calculations whose directory or formula contains every word of `query`,
+    most recently modified first
+    """
+    words = query.split()
+    match = "(dir LIKE ? ESCAPE '\\' OR formula LIKE ? ESCAPE '\\')"
+    where = " AND ".join([match] * len(words)) or "1"
+    params = []
+    for word in words:
+        # the words are matched literally, not as LIKE patterns
+        word = re.sub(r"([\\%_])", r"\\\1", word)
+        params += ["%{}%".format(word)] * 2
+    conn = connect(db_path)
+    rows = conn.execute(
+        "SELECT * FROM calcs WHERE {} ORDER BY vasprun_mtime DESC LIMIT ?".format(
+            where
+        ),
+        params + [limit],
+    ).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def get_calc(calc_dir: str, db_path: str = INDEX_DB) -> Optional[dict]:
+    conn = connect(db_path)
+    row = conn.execute("SELECT * FROM calcs WHERE dir = ?", (calc_dir,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def _run_indexer(root: str, db_path: str, interval: float) -> None:
+    lock_path = db_path + ".lock"
+    while True:
+        # only one process (e.g. one of the gunicorn workers) scans at a time
+        with open(lock_path, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                pass
+            else:
+                try:
+                    scan(root, db_path)
+                except Exception:
+                    # keep indexing, the next scan may succeed
+                    logger.exception("Indexing %s failed", root)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        time.sleep(interval)
+
+
+def ensure_indexer(
+    root: str = WORK_DIR, db_path: str = INDEX_DB, interval: float = INDEX_INTERVAL
+) -> None:
+    """
+    Start the background indexer thread once per process. Threads do not survive a
+    fork, so the process id is checked as well. Processes forked from the one running
+    the indexer, e.g. the gunicorn workers when the master indexes (see
+    gunicorn.conf.py), do not start another one.
+    """
+    global _indexer, _indexer_pid
+    with _indexer_lock:
+        if _indexer is not None and _indexer_pid == os.getpid():
+            return
+        owner = os.environ.get(INDEXER_PID)
+        if owner and owner != str(os.getpid()):
+            return
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        _indexer = threading.Thread(
+            target=_run_indexer, args=(root, db_path, interval), daemon=True
+        )
+        _indexer_pid = os.getpid()
+        os.environ[INDEXER_PID] = str(_indexer_pid)
+        _indexer.start()
@@ -0,0 +1,137 @@
+"""
+x-coordinates and tick labels of band structure paths, shared by all parsers.
+
+Distances are the cumulative lengths of the steps between consecutive k-points in
+Cartesian coordinates of the reciprocal lattice (with the factor 2 pi, as pymatgen
+and Wannier90 use). The step between two line-mode segments has length zero, both
+when the segments share their end point (X-X) and when the path jumps (X|U), so
+disconnected branches touch at one tick. Segment lengths and labels are read from a
+line-mode KPOINTS, or from seedname_band.labelinfo.dat for Wannier90 bands.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+def reciprocal_lattice(lattice: np.ndarray) -> np.ndarray:
+    """
+    Reciprocal lattice vectors (rows) of the real space lattice vectors (rows)
+    """
+    return 2 * np.pi * np.linalg.inv(lattice).T
+
+
+def tick_label(label: str) -> str:
+    label = label.strip()
+    if label.upper() in ("GAMMA", "\\GAMMA", "G", "Γ"):
+        return r"$\Gamma$"
+    return label
+
+
+def read_line_mode(kpoint_file: str) -> Optional[tuple[int, list[str]]]:
+    """
+    Points per segment and labels of the segment ends (two per segment) of a
+    line-mode KPOINTS, None for any other KPOINTS
+    """
+    try:
+        with open(kpoint_file) as f:
+            lines = f.read().splitlines()
+        ndiv = int(lines[1].split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    if len(lines) < 4 or not lines[2].strip().lower().startswith("l"):
+        return None
+    labels = []
+    for line in lines[4:]:
+        if not line.strip():
+            continue
+        _, _, label = line.partition("!")
+        labels.append(label.strip())
+    if ndiv < 2 or len(labels) < 2:
+        return None
+    return ndiv, labels[: len(labels) // 2 * 2]
+
+
+def _merge_ticks(positions: np.ndarray, labels: list[str]) -> dict:
+    """
+    Ticks at distinct positions, labels of ticks at the same position joined as X|U
+    """
+    ticks, ticklabels = [], []
+    for position, label in zip(positions, labels):
+        label = tick_label(label)
+        if ticks and np.isclose(position, ticks[-1]):
+            if label and label not in ticklabels[-1]:
+                ticklabels[-1].append(label)
+            continue
+        ticks.append(float(position))
+        ticklabels.append([label] if label else [])
+    return {
+        "ticks": ticks,
+        "ticklabels": [r"$\mid$".join(labels) for labels in ticklabels],
+    }
+
+
+class KPath:
+    """
+    Path through the fractional k-points (nk, 3), split into segments of `ndiv`
+    points with `labels` at their ends when they come from a line-mode KPOINTS
+    """
+
+    def __init__(
+        self,
+        kpoints: np.ndarray,
+        reciprocal: np.ndarray,
+        ndiv: Optional[int] = None,
+        labels: Optional[list[str]] = None,
+    ):
+        self.kpoints = np.asarray(kpoints, dtype=float)
+        self.reciprocal = reciprocal
+        nk = len(self.kpoints)
+        # segments must tile the k-points, e.g. not for a KPOINTS of another run
+        if ndiv and labels and nk == ndiv * (len(labels) // 2):
+            self.ndiv, self.labels = ndiv, labels
+        else:
+            self.ndiv, self.labels = None, None
+
+    @classmethod
+    def from_kpoints_file(
+        cls, kpoints: np.ndarray, reciprocal: np.ndarray, kpoint_file: Optional[str]
+    ) -> "KPath":
+        line_mode = read_line_mode(kpoint_file) if kpoint_file else None
+        return cls(kpoints, reciprocal, *(line_mode or (None, None)))
+
+    @property
+    def distances(self) -> np.ndarray:
+        steps = np.linalg.norm(np.diff(self.kpoints @ self.reciprocal, axis=0), axis=1)
+        if self.ndiv:
+            # from the last point of a segment to the first of the next one
+            steps[self.ndiv - 1 :: self.ndiv] = 0
+        return np.concatenate([[0.0], np.cumsum(steps)])
+
+    @property
+    def ticks(self) -> dict:
+        """
+        Segment ends from KPOINTS, otherwise the first and last point without labels
+        """
+        distances = self.distances
+        if not self.ndiv:
+            return _merge_ticks(distances[[0, -1]], ["", ""])
+        starts = np.arange(0, len(distances), self.ndiv)
+        ends = np.stack([starts, starts + self.ndiv - 1], axis=1).ravel()
+        return _merge_ticks(distances[ends], self.labels)
+
+
+def read_labelinfo(path: str) -> Optional[dict]:
+    """
+    Ticks of seedname_band.labelinfo.dat: label, index, distance, k-point per line
+    """
+    try:
+        with open(path) as f:
+            rows = [line.split() for line in f if line.strip()]
+        labels = [row[0] for row in rows]
+        positions = np.array([float(row[2]) for row in rows])
+    except (OSError, IndexError, ValueError):
+        return None
+    if not rows:
+        return None
+    return _merge_ticks(positions, labels)
@@ -1,8 +1,14 @@
+from typing import Optional
+
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
 from dash import dcc, html
 from dash_iconify import DashIconify
 
+from .config import (DOS_SIGMA, KPLANE_MAX_RESOLUTION, KPLANE_RESOLUTION,
+                     TB_MAX_DENSITY, WATCH_INTERVAL, WOUT_INTERVAL)
+from .tb import PLANES
+
 
 def make_dmc_tooltips(child, label, **kwargs):
     return dmc.Tooltip(
@@ -50,6 +56,203 @@ def make_error_info(errors: list[str]):
     ]
 
 
+def make_reload_info(path: str):
+    return [
+        dmc.Notification(
+            id="wann-reload-info",
+            title="Wannier Bands Reloaded",
+            message=f"{path} was rewritten, the Wannier bands were updated.",
+            color="blue",
+            action="show",
+            autoClose=3000,
+        ),
+    ]
+
+
+def _make_table(columns: list[str], rows: list[list]):
+    return dmc.Table(
+        [
+            html.Thead(html.Tr([html.Th(column) for column in columns])),
+            html.Tbody([html.Tr([html.Td(cell) for cell in row]) for row in rows]),
+        ],
+        striped=True,
+        highlightOnHover=True,
+        fontSize="xs",
+    )
+
+
+def make_diagnostics_tables(summary: dict):
+    """
+    Tables of the diagnostics panel from `metrics.summary()`
+    """
+    latency = _make_table(
+        ["Timer", "Labels", "Count", "Mean (ms)", "p50 (ms)", "p95 (ms)"],
+        [
+            [
+                row["metric"],
+                row["labels"],
+                row["count"],
+                f"{row['mean'] * 1e3:.1f}",
+                f"{row['p50'] * 1e3:.1f}",
+                f"{row['p95'] * 1e3:.1f}",
+            ]
+            for row in summary["latency"]
+        ],
+    )
+    caches = _make_table(
+        ["Cache", "Hits", "Misses", "Hit rate"],
+        [
+            [row["cache"], row["hits"], row["misses"], f"{row['hit_rate']:.0%}"]
+            for row in summary["caches"]
+        ],
+    )
+    rss = _make_table(
+        ["Worker pid", "RSS (MB)"],
+        [[row["pid"], f"{row['rss_mb']:.0f}"] for row in summary["rss"]],
+    )
+    return [latency, html.Br(), caches, html.Br(), rss]
+
+
+def make_profile_table(profile: dict):
+    """
+    Top functions by cumulative time of a capture from `profiling.get_profile`
+    """
+    return [
+        dmc.Text(
+            f"{profile['callback']}: {profile['seconds'] * 1e3:.0f} ms, "
+            f"stored as {profile['id']}.prof",
+            size="xs",
+            color="dimmed",
+        ),
+        _make_table(
+            ["Function", "Calls", "Own (ms)", "Cumulative (ms)"],
+            [
+                [
+                    row["function"],
+                    row["ncalls"],
+                    f"{row['tottime'] * 1e3:.1f}",
+                    f"{row['cumtime'] * 1e3:.1f}",
+                ]
+                for row in profile["top"]
+            ],
+        ),
+    ]
+
+
+def make_wout_status(status: dict):
+    """
+    Progress, latest WF centres and spreads and warnings of a monitored .wout
+    """
+    state = "finished" if status["finished"] else "running"
+    children = [
+        dmc.Text(
+            f"{status['dis']} disentanglement iterations, "
+            f"{status['conv']} wannierization steps ({state})",
+            size="xs",
+            color="dimmed",
+        )
+    ]
+    if len(status["spreads"]):
+        children.append(
+            _make_table(
+                ["WF", "x", "y", "z", "Spread (Ang^2)"],
+                [
+                    [idx + 1] + [f"{value:.6f}" for value in centre] + [f"{spread:.5f}"]
+                    for idx, (centre, spread) in enumerate(
+                        zip(status["centres"], status["spreads"])
+                    )
+                ],
+            )
+        )
+    children += [
+        dmc.Text(warning, size="xs", color="orange") for warning in status["warnings"]
+    ]
+    return children
+
+
+def _format(value, fmt="{:.3f}"):
+    return "-" if value is None else fmt.format(value)
+
+
+def make_band_edge_tables(results: dict, comparison: Optional[dict] = None):
+    """
+    Gaps, band edges and effective masses of `analytics.analyze` results by name
+    (e.g. DFT, Wannier), and their differences
+    """
+    gap_rows, mass_rows = [], []
+    for name, result in results.items():
+        channels = result["channels"]
+        for spin, edges in channels.items():
+            spin = spin if len(channels) > 1 else ""
+            crossing = ", ".join(str(band + 1) for band in edges["crossings"])
+            gap_rows.append(
+                [
+                    name,
+                    spin,
+                    _format(edges["gap"]),
+                    _format(edges["direct_gap"]),
+                    *[
+                        (
+                            "-"
+                            if edges[edge] is None
+                            else "{:.3f} (band {}, x={:.3f})".format(
+                                edges[edge]["energy"],
+                                edges[edge]["band"] + 1,
+                                edges[edge]["x"],
+                            )
+                        )
+                        for edge in ("vbm", "cbm")
+                    ],
+                    crossing or "none",
+                ]
+            )
+            for edge in ("vbm", "cbm"):
+                if edges[edge] is not None:
+                    mass_rows.append(
+                        [name, spin, edge.upper(), edges[edge]["band"] + 1]
+                        + [_format(m) for m in edges[edge]["masses"]]
+                    )
+    children = [
+        _make_table(
+            [
+                "Bands",
+                "Spin",
+                "Gap (eV)",
+                "Direct gap (eV)",
+                "VBM (eV)",
+                "CBM (eV)",
+                "Bands crossing E_F",
+            ],
+            gap_rows,
+        ),
+        html.Br(),
+        _make_table(
+            ["Bands", "Spin", "Edge", "Band", "m* before (m_e)", "m* after (m_e)"],
+            mass_rows,
+        ),
+    ]
+    if comparison:
+        children += [
+            html.Br(),
+            dmc.Text("Wannier - DFT", size="xs", color="dimmed"),
+            _make_table(
+                ["Spin", "Gap (meV)", "Direct gap (meV)", "VBM (meV)", "CBM (meV)"],
+                [
+                    [spin]
+                    + [
+                        _format(
+                            None if diff.get(key) is None else diff[key] * 1e3,
+                            "{:+.1f}",
+                        )
+                        for key in ("gap", "direct_gap", "vbm", "cbm")
+                    ]
+                    for spin, diff in comparison.items()
+                ],
+            ),
+        ]
+    return children
+
+
 header = dbc.Navbar(
     dbc.Row(
         [
@@ -74,6 +277,45 @@ header = dbc.Navbar(
 
 file_input_panel = [
     # html.Div(file_input_tooltips),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.TextInput(
+                id="calc-search",
+                label="Search Calculations",
+                placeholder="Formula or directory...",
+                icon=DashIconify(icon="mdi:magnify", width=16),
+                debounce=300,
+                style={"width": 300},
+            ),
+            label="Search the indexed calculations under the home directory",
+            color="gray",
+        ),
+        md=12,
+    ),
+    dbc.Col(
+        dmc.Select(
+            id="calc-search-results",
+            data=[],
+            clearable=True,
+            placeholder="Fill in all paths from a calculation",
+            value=None,
+            style={"width": 300},
+            mb=5,
+        ),
+        className="my-1",
+        md=12,
+    ),
+    dbc.Col(
+        dmc.Switch(
+            id="relevant-only",
+            label="only show VASP/Wannier files",
+            size="sm",
+            radius="lg",
+            checked=False,
+            mb=5,
+        ),
+        md=12,
+    ),
     dbc.Col(
         make_dmc_fileinput_tooltips(
             dmc.TextInput(
@@ -187,6 +429,60 @@ file_input_panel = [
         className="my-1",
         md=12,
     ),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.Group(
+                [
+                    dmc.TextInput(
+                        id="layer-name",
+                        placeholder="Layer name",
+                        size="sm",
+                        style={"width": 120},
+                    ),
+                    dmc.NumberInput(
+                        id="layer-shift",
+                        value=0,
+                        precision=2,
+                        step=0.1,
+                        size="sm",
+                        style={"width": 80},
+                    ),
+                    dmc.ActionIcon(
+                        DashIconify(icon="mdi:layers-plus", width=20),
+                        id="add-layer",
+                        n_clicks=0,
+                        color="blue",
+                        variant="subtle",
+                    ),
+                ],
+                spacing="xs",
+                mb=5,
+            ),
+            label=html.P(
+                [
+                    "Add the vasprun/KPOINTS/Wannier paths above as an overlay layer.",
+                    html.Br(),
+                    "The number is an extra energy shift (eV).",
+                ]
+            ),
+            color="gray",
+            multiline=True,
+            width=300,
+        ),
+        md=12,
+    ),
+    dbc.Col(
+        dmc.MultiSelect(
+            id="layer-select",
+            label="Overlay Layers",
+            data=[],
+            value=[],
+            clearable=True,
+            style={"width": 300},
+            mb=5,
+        ),
+        md=12,
+    ),
 ]
 
 
@@ -222,11 +518,30 @@ control_panel = [
                 dmc.Checkbox(label="Vasp", value="vasp"),
                 dmc.Checkbox(label="Projection", value="proj"),
                 dmc.Checkbox(label="Wannier", value="wann"),
+                dmc.Checkbox(label="DOS", value="dos"),
+                dmc.Checkbox(label="Wannier TB", value="tb"),
             ],
             value=["proj"],
         ),
         md=12,
     ),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.SegmentedControl(
+                id="band-order",
+                data=[
+                    {"label": "By Energy", "value": "energy"},
+                    {"label": "By Character", "value": "character"},
+                ],
+                value="energy",
+                size="xs",
+                mb=5,
+            ),
+            label="Connect bands by orbital character (needs PROCAR)",
+            color="gray",
+        ),
+        md=12,
+    ),
     dbc.Col(
         dmc.Switch(
             id="spin-pol",
@@ -238,6 +553,63 @@ control_panel = [
             mb=5,
         )
     ),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.Switch(
+                id="watch-mode",
+                label="reload Wannier bands on change",
+                size="md",
+                radius="lg",
+                checked=False,
+                mb=5,
+            ),
+            label="Replace the Wannier bands in the figure whenever "
+            "wannier90_band.dat is rewritten, e.g. by a rerun",
+            color="gray",
+            multiline=True,
+            width=250,
+        )
+    ),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.SegmentedControl(
+                id="proj-color",
+                data=[
+                    {"label": "Weight", "value": "weight"},
+                    {"label": "Sx", "value": "sx"},
+                    {"label": "Sy", "value": "sy"},
+                    {"label": "Sz", "value": "sz"},
+                ],
+                value="weight",
+                size="xs",
+                mb=5,
+                disabled=True,
+            ),
+            label="Color projected bands by weight or by spin texture (SOC PROCAR)",
+            color="gray",
+        ),
+        md=12,
+    ),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.SegmentedControl(
+                id="proj-style",
+                data=[
+                    {"label": "Colored", "value": "color"},
+                    {"label": "Fat Bands", "value": "fat"},
+                ],
+                value="color",
+                size="xs",
+                mb=5,
+            ),
+            label="Fat bands: marker size proportional to the weight, "
+            "points with small weights are left out",
+            color="gray",
+            multiline=True,
+            width=250,
+        ),
+        md=12,
+    ),
     dbc.Col(
         dmc.MultiSelect(
             id="atom-select",
@@ -248,6 +620,23 @@ control_panel = [
         ),
         md=8,
     ),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.TextInput(
+                id="site-select",
+                label="Select Sites",
+                placeholder="e.g. 1-4, O, Fe2@2.5",
+                debounce=500,
+                mb=5,
+            ),
+            label="Sites by number (from 1) or range, species, label (Fe2) or "
+            "distance (12@2.5: within 2.5 Å of site 12); replaces the atoms above",
+            color="gray",
+            multiline=True,
+            width=250,
+        ),
+        md=8,
+    ),
     dbc.Col(
         dmc.MultiSelect(
             id="orbital-select",
@@ -257,6 +646,95 @@ control_panel = [
         ),
         md=8,
     ),
+    dbc.Col(
+        make_dmc_tooltips(
+            dmc.Group(
+                [
+                    dmc.TextInput(
+                        id="group-color",
+                        placeholder="auto color",
+                        size="sm",
+                        style={"width": 140},
+                    ),
+                    dmc.ActionIcon(
+                        DashIconify(icon="mdi:plus-box-multiple-outline", width=20),
+                        id="add-group",
+                        n_clicks=0,
+                        color="blue",
+                        variant="subtle",
+                    ),
+                ],
+                spacing="xs",
+                mb=5,
+            ),
+            label="Add the selected atoms and orbitals as a projection group. "
+            "Selected groups are drawn as fat bands instead of the single selection.",
+            color="gray",
+            multiline=True,
+            width=300,
+        ),
+        md=12,
+    ),
+    dbc.Col(
+        dmc.MultiSelect(
+            id="group-select",
+            label="Projection Groups",
+            data=[],
+            value=[],
+            clearable=True,
+            mb=5,
+        ),
+        md=12,
+    ),
+    dbc.Col(
+        dmc.SegmentedControl(
+            id="group-mode",
+            data=[
+                {"label": "Overlay", "value": "overlay"},
+                {"label": "RGB Mix", "value": "rgb"},
+            ],
+            value="overlay",
+            size="xs",
+            mb=5,
+        ),
+        md=12,
+    ),
+    make_dmc_tooltips(
+        dmc.NumberInput(
+            id="dos-sigma",
+            label="DOS Broadening (eV)",
+            value=DOS_SIGMA,
+            min=0,
+            step=0.01,
+            precision=3,
+            size="sm",
+            mb=5,
+            style={"width": 150},
+        ),
+        label="Gaussian broadening of the DOS computed from the bands, "
+        "a DOS read from vasprun.xml is already broadened by VASP",
+        color="gray",
+        multiline=True,
+        width=250,
+    ),
+    make_dmc_tooltips(
+        dmc.NumberInput(
+            id="tb-density",
+            label="Wannier TB Density",
+            value=1,
+            min=1,
+            max=TB_MAX_DENSITY,
+            step=1,
+            size="sm",
+            mb=5,
+            style={"width": 150},
+        ),
+        label="Points per interval of the VASP k-points at which the bands of "
+        "seedname_hr.dat / seedname_tb.dat are interpolated",
+        color="gray",
+        multiline=True,
+        width=250,
+    ),
     make_dmc_tooltips(
         dmc.TextInput(
             id="yrange",
@@ -385,32 +863,76 @@ control_panel = [
 
 graph_panel = [
     dcc.Store(id="loaded-data"),
+    dcc.Store(id="session-id", storage_type="session"),
+    dcc.Store(id="layers", data=[]),
+    dcc.Store(id="proj-groups", data=[]),
+    # which traces of the figure hold what, for patching them in place
+    dcc.Store(id="trace-map", data={}),
+    dcc.Interval(id="watch-interval", interval=WATCH_INTERVAL, disabled=True),
     dmc.NotificationsProvider(
         [html.Div(id="notify-container")],
         position="bottom-right",
     ),
-    dmc.LoadingOverlay(
-        html.Div(
-            children=[
-                dcc.Graph(
-                    id="graph",
-                    config={
-                        "displaylogo": False,
-                        "toImageButtonOptions": {
-                            "format": "png",
-                            "filename": "wann-app",
-                            "height": 600,
-                            "width": 800,
-                            "scale": 4,
-                        },
-                    },
-                    # required to render latex
-                    mathjax=True,
-                )
-            ],
-            id="graph-overlay",
-        ),
-        loaderProps={"variant": "dots", "color": "blue", "size": "xl"},
+    # the band character next to the bands it describes
+    dbc.Row(
+        [
+            dbc.Col(
+                dmc.LoadingOverlay(
+                    html.Div(
+                        children=[
+                            dcc.Graph(
+                                id="graph",
+                                config={
+                                    "displaylogo": False,
+                                    "toImageButtonOptions": {
+                                        "format": "png",
+                                        "filename": "wann-app",
+                                        "height": 600,
+                                        "width": 800,
+                                        "scale": 4,
+                                    },
+                                },
+                                # required to render latex
+                                mathjax=True,
+                            )
+                        ],
+                        id="graph-overlay",
+                    ),
+                    loaderProps={"variant": "dots", "color": "blue", "size": "xl"},
+                ),
+                width=8,
+            ),
+            dbc.Col(
+                [
+                    dmc.Text("Band Character", weight=500, size="sm"),
+                    dmc.Text(
+                        "Fraction of the PROCAR weight of every band on each "
+                        "species and shell, click a cell to highlight the band",
+                        size="xs",
+                        color="dimmed",
+                    ),
+                    dmc.SegmentedControl(
+                        id="composition-reduce",
+                        data=[
+                            {"label": "Mean over k", "value": "mean"},
+                            {"label": "Max over k", "value": "max"},
+                        ],
+                        value="mean",
+                        size="xs",
+                        className="my-2",
+                    ),
+                    html.Div(
+                        dcc.Graph(
+                            id="composition-graph", config={"displaylogo": False}
+                        ),
+                        # as high as the band plot, scrolling through many bands
+                        style={"maxHeight": "520px", "overflowY": "auto"},
+                    ),
+                    html.Div(id="composition-status"),
+                ],
+                width=4,
+            ),
+        ],
     ),
     dbc.Row(
         [
@@ -428,6 +950,245 @@ graph_panel = [
         align="end",
         justify="between",
     ),
+    html.Br(),
+    dmc.Accordion(
+        dmc.AccordionItem(
+            [
+                dmc.AccordionControl(
+                    "Band Edges",
+                    icon=DashIconify(icon="mdi:arrow-expand-vertical", width=20),
+                ),
+                dmc.AccordionPanel(
+                    [
+                        dmc.Text(
+                            "Band gaps, bands crossing the Fermi level and effective "
+                            "masses along the path before and after the band edges, "
+                            "of the DFT and Wannier bands",
+                            size="xs",
+                            color="dimmed",
+                        ),
+                        html.Div(id="band-edges"),
+                    ]
+                ),
+            ],
+            value="band-edges",
+        ),
+        id="band-edges-accordion",
+    ),
+    dmc.Accordion(
+        dmc.AccordionItem(
+            [
+                dmc.AccordionControl(
+                    "Wannier90 Convergence",
+                    icon=DashIconify(icon="mdi:chart-bell-curve-cumulative", width=20),
+                ),
+                dmc.AccordionPanel(
+                    [
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    dmc.TextInput(
+                                        id="wout-input",
+                                        label="wout File",
+                                        placeholder="path/to/wannier90.wout",
+                                        debounce=500,
+                                        size="sm",
+                                    ),
+                                    md=9,
+                                ),
+                                dbc.Col(
+                                    make_dmc_tooltips(
+                                        dmc.Switch(
+                                            id="wout-follow",
+                                            label="Follow",
+                                            checked=True,
+                                            size="md",
+                                            radius="lg",
+                                        ),
+                                        label="Read what Wannier90 appends while "
+                                        "the panel is open",
+                                        color="gray",
+                                    ),
+                                    md=3,
+                                ),
+                            ],
+                            align="end",
+                        ),
+                        dcc.Graph(id="wout-graph", config={"displaylogo": False}),
+                        html.Div(id="wout-status"),
+                        # file, run and number of points already in wout-graph
+                        dcc.Store(id="wout-state", data={}),
+                        dcc.Interval(
+                            id="wout-interval", interval=WOUT_INTERVAL, disabled=True
+                        ),
+                    ]
+                ),
+            ],
+            value="wout",
+        ),
+        id="wout-accordion",
+    ),
+    dmc.Accordion(
+        dmc.AccordionItem(
+            [
+                dmc.AccordionControl(
+                    "Wannier k-Plane",
+                    icon=DashIconify(icon="mdi:grid", width=20),
+                ),
+                dmc.AccordionPanel(
+                    [
+                        dmc.Text(
+                            "Bands of the Wannier tight-binding model on a plane of "
+                            "the Brillouin zone, in fractional coordinates",
+                            size="xs",
+                            color="dimmed",
+                        ),
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    dmc.Select(
+                                        id="kplane-plane",
+                                        label="Plane",
+                                        data=[
+                                            {"value": plane, "label": plane}
+                                            for plane in PLANES
+                                        ],
+                                        value="b1-b2",
+                                        size="sm",
+                                    ),
+                                    md=3,
+                                ),
+                                dbc.Col(
+                                    make_dmc_tooltips(
+                                        dmc.NumberInput(
+                                            id="kplane-offset",
+                                            label="Offset",
+                                            value=0,
+                                            step=0.05,
+                                            precision=3,
+                                            size="sm",
+                                        ),
+                                        label="Shift of the plane along the third "
+                                        "reciprocal lattice vector",
+                                        color="gray",
+                                    ),
+                                    md=3,
+                                ),
+                                dbc.Col(
+                                    dmc.NumberInput(
+                                        id="kplane-resolution",
+                                        label="Resolution",
+                                        value=KPLANE_RESOLUTION,
+                                        min=10,
+                                        max=KPLANE_MAX_RESOLUTION,
+                                        step=10,
+                                        size="sm",
+                                    ),
+                                    md=3,
+                                ),
+                                dbc.Col(
+                                    make_dmc_tooltips(
+                                        dmc.NumberInput(
+                                            id="kplane-energy",
+                                            label="Energy (eV)",
+                                            value=0,
+                                            step=0.1,
+                                            precision=3,
+                                            size="sm",
+                                        ),
+                                        label="Relative to the Fermi level of "
+                                        "vasprun.xml when one is loaded",
+                                        color="gray",
+                                    ),
+                                    md=3,
+                                ),
+                            ],
+                            align="end",
+                        ),
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    dmc.SegmentedControl(
+                                        id="kplane-style",
+                                        data=[
+                                            {"label": "Contours", "value": "contour"},
+                                            {"label": "Heatmap", "value": "heatmap"},
+                                        ],
+                                        value="contour",
+                                        size="xs",
+                                    ),
+                                    md=6,
+                                ),
+                                dbc.Col(
+                                    dmc.Button(
+                                        "Compute",
+                                        id="kplane-button",
+                                        n_clicks=0,
+                                        size="sm",
+                                        variant="outline",
+                                    ),
+                                    md=3,
+                                ),
+                            ],
+                            align="end",
+                            className="my-2",
+                        ),
+                        dmc.LoadingOverlay(
+                            dcc.Graph(id="kplane-graph", config={"displaylogo": False}),
+                            loaderProps={"variant": "dots", "color": "blue"},
+                        ),
+                        html.Div(id="kplane-status"),
+                    ]
+                ),
+            ],
+            value="kplane",
+        ),
+        id="kplane-accordion",
+    ),
+    dmc.Accordion(
+        dmc.AccordionItem(
+            [
+                dmc.AccordionControl(
+                    "Diagnostics",
+                    icon=DashIconify(icon="mdi:speedometer", width=20),
+                ),
+                dmc.AccordionPanel(
+                    [
+                        dmc.Text(
+                            "Latency, cache hit rates and memory of all workers, "
+                            "also served in Prometheus format at /metrics",
+                            size="xs",
+                            color="dimmed",
+                        ),
+                        html.Div(id="diagnostics"),
+                        html.Br(),
+                        make_dmc_tooltips(
+                            dmc.Select(
+                                id="profile-select",
+                                label="Captured Profiles",
+                                placeholder="No profiles captured",
+                                data=[],
+                                size="sm",
+                                mb=5,
+                            ),
+                            label="Open the app with ?profile=1 or send the header "
+                            "X-Wann-Profile: 1 to profile callbacks",
+                            color="gray",
+                            multiline=True,
+                            width=300,
+                        ),
+                        html.Div(id="profile-stats"),
+                        # only enabled while the panel is open
+                        dcc.Interval(
+                            id="diagnostics-interval", interval=5000, disabled=True
+                        ),
+                    ]
+                ),
+            ],
+            value="diagnostics",
+        ),
+        id="diagnostics-accordion",
+    ),
 ]
 
 layout = dbc.Container(
@@ -0,0 +1,346 @@
+"""
+In-process metrics (histograms, counters, gauges) shared between gunicorn workers.
+
+Every process keeps its own metrics and regularly writes a snapshot to
+METRICS_DIR/<pid>.json. The /metrics endpoint and the diagnostics panel merge the
+snapshots of all processes, so a scrape hitting any worker sees the whole server.
+"""
+
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from .config import METRICS_DIR
+from .startup import rss_mb
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+# name: (type, help, buckets)
+METRICS = {
+    "wann_app_callback_seconds": ("histogram", "Dash callback latency", TIME_BUCKETS),
+    "wann_app_request_seconds": (
+        "histogram",
+        "Dash update request latency including JSON serialization",
+        TIME_BUCKETS,
+    ),
+    "wann_app_response_bytes": (
+        "histogram",
+        "Size of Dash update responses, e.g. figure payloads",
+        SIZE_BUCKETS,
+    ),
+    "wann_app_parser_seconds": ("histogram", "Parser stage latency", TIME_BUCKETS),
+    "wann_app_parser_read_bytes": (
+        "histogram",
+        "Size of files read by the parsers",
+        SIZE_BUCKETS,
+    ),
+    "wann_app_parser_array_bytes": (
+        "histogram",
+        "Size of the arrays produced by the parsers",
+        SIZE_BUCKETS,
+    ),
+    "wann_app_plot_seconds": ("histogram", "Figure building latency", TIME_BUCKETS),
+    "wann_app_cache_requests_total": ("counter", "Cache lookups by result", None),
+    "wann_app_worker_rss_bytes": ("gauge", "Resident memory of each process", None),
+}
+
+# seconds between snapshots written by a process
+DUMP_INTERVAL = 1.0
+
+_histograms: dict[tuple, list] = {}
+_counters: dict[tuple, float] = {}
+_lock = threading.Lock()
+_last_dump = 0.0
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def observe(name: str, value: float, **labels) -> None:
+    buckets = METRICS[name][2]
+    with _lock:
+        hist = _histograms.get(_key(name, labels))
+        if hist is None:
+            # bucket counts (the last one is +Inf), sum
+            hist = _histograms[_key(name, labels)] = [[0] * (len(buckets) + 1), 0.0]
+        hist[0][bisect.bisect_left(buckets, value)] += 1
+        hist[1] += value
+    _maybe_dump()
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _maybe_dump()
+
+
+@contextmanager
+def timer(name: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name: str, **labels):
+    """
+    Decorator recording the latency of every call in histogram `name`
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def observe_file(path: str, **labels) -> None:
+    try:
+        observe("wann_app_parser_read_bytes", os.path.getsize(path), **labels)
+    except (OSError, TypeError):
+        pass
+
+
+def _snapshot() -> dict:
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "rss": rss_mb() * 2**20,
+            "histograms": [
+                [name, dict(labels), counts[:], total]
+                for (name, labels), (counts, total) in _histograms.items()
+            ],
+            "counters": [
+                [name, dict(labels), value]
+                for (name, labels), value in _counters.items()
+            ],
+        }
+
+
+def dump() -> None:
+    global _last_dump
+    _last_dump = time.time()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, "{}.json".format(os.getpid()))
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _maybe_dump() -> None:
+    if time.time() - _last_dump > DUMP_INTERVAL:
+        try:
+            dump()
+        except OSError:
+            pass
+
+
+def clear() -> None:
+    """
+    Remove the snapshots of a previous server run, called when gunicorn starts
+    """
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        os.remove(path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect() -> dict:
+    """
+    Merge the snapshots of all processes. Counters and histograms of exited workers
+    are kept so that totals never go backwards, RSS is only reported for live ones.
+    """
+    try:
+        dump()
+    except OSError:
+        pass
+    histograms, counters, rss = {}, {}, {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if _pid_alive(snapshot["pid"]):
+            rss[snapshot["pid"]] = snapshot["rss"]
+        for name, labels, counts, total in snapshot["histograms"]:
+            if name not in METRICS:
+                continue
+            merged = histograms.setdefault(_key(name, labels), [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+        for name, labels, value in snapshot["counters"]:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+    return {"histograms": histograms, "counters": counters, "rss": rss}
+
+
+def _escape(value) -> str:
+    # label values of the text format escape backslash, double quote and line feed
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in pairs) + "}"
+
+
+def prometheus_text() -> str:
+    data = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, kind))
+        if kind == "histogram":
+            for (metric, labels), (counts, total) in sorted(data["histograms"].items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for le, count in zip(list(buckets) + ["+Inf"], counts):
+                    cumulative += count
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            name, _format_labels(labels, [("le", le)]), cumulative
+                        )
+                    )
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), total))
+                lines.append(
+                    "{}_count{} {}".format(name, _format_labels(labels), cumulative)
+                )
+        elif kind == "counter":
+            for (metric, labels), value in sorted(data["counters"].items()):
+                if metric == name:
+                    lines.append("{}{} {}".format(name, _format_labels(labels), value))
+        elif name == "wann_app_worker_rss_bytes":
+            for pid, value in sorted(data["rss"].items()):
+                lines.append(
+                    "{}{} {}".format(name, _format_labels([("pid", pid)]), value)
+                )
+    return "\n".join(lines) + "\n"
+
+
+def quantile(buckets, counts, q: float) -> float:
+    """
+    Estimate a quantile from histogram bucket counts by linear interpolation
+    """
+    total = sum(counts)
+    if total == 0:
+        return math.nan
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for upper, count in zip(list(buckets) + [math.inf], counts):
+        if cumulative + count >= rank and count > 0:
+            if math.isinf(upper):
+                return lower
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = upper
+    return lower
+
+
+def summary() -> dict:
+    """
+    Rows for the diagnostics panel: latency per callback / parser stage / plot,
+    cache hit rates and worker RSS
+    """
+    data = collect()
+    latency = []
+    for (name, labels), (counts, total) in sorted(data["histograms"].items()):
+        kind = METRICS[name][2]
+        if kind is not TIME_BUCKETS:
+            continue
+        count = sum(counts)
+        latency.append(
+            {
+                "metric": name.replace("wann_app_", "").replace("_seconds", ""),
+                "labels": ", ".join("{}={}".format(k, v) for k, v in labels),
+                "count": count,
+                "mean": total / count if count else math.nan,
+                "p50": quantile(kind, counts, 0.5),
+                "p95": quantile(kind, counts, 0.95),
+            }
+        )
+
+    caches = {}
+    for (name, labels), value in data["counters"].items():
+        if name == "wann_app_cache_requests_total":
+            labels = dict(labels)
+            caches.setdefault(labels["cache"], {"hit": 0, "miss": 0})[
+                labels["result"]
+            ] += value
+    cache_rows = [
+        {
+            "cache": cache,
+            "hits": int(c["hit"]),
+            "misses": int(c["miss"]),
+            "hit_rate": c["hit"] / (c["hit"] + c["miss"]),
+        }
+        for cache, c in sorted(caches.items())
+    ]
+    rss_rows = [
+        {"pid": pid, "rss_mb": value / 2**20}
+        for pid, value in sorted(data["rss"].items())
+    ]
+    return {"latency": latency, "caches": cache_rows, "rss": rss_rows}
+
+
+def instrument_callbacks(app) -> None:
+    """
+    Record the latency of every registered Dash callback, and the total latency
+    (including serialization) and size of every update response
+    """
+    for callback in app.callback_map.values():
+        func = callback["callback"]
+        name = getattr(func, "__name__", "callback")
+        callback["callback"] = timed("wann_app_callback_seconds", callback=name)(func)
+
+    from flask import g, request
+
+    server = app.server
+
+    @server.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def _record_request(response):
+        if request.path.endswith("/_dash-update-component") and "metrics_start" in g:
+            body = request.get_json(silent=True) or {}
+            output = str(body.get("output", ""))[:100]
+            observe(
+                "wann_app_request_seconds",
+                time.perf_counter() - g.metrics_start,
+                output=output,
+            )
+            observe(
+                "wann_app_response_bytes",
+                response.calculate_content_length() or 0,
+                output=output,
+            )
+        return response
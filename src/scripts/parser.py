@@ -1,21 +1,51 @@
+import os
 import re
-from distutils.version import LooseVersion
 from typing import Any, Optional
 
 import numpy as np
-import pandas as pd
-import pyprocar
-from pandas import MultiIndex
-from pymatgen.electronic_structure.plotter import BSPlotter
-from pymatgen.io.vasp import BSVasprun
-from pyprocar import ProcarParser
 
-from .utils import block_stdout
+from .bands import connect_bands
+from .kpath import KPath, read_labelinfo, reciprocal_lattice
+from .metrics import observe, observe_file, timer
+from .sites import Sites
+from .utils import block_stdout, group_by_species, search_file_tail
 
-if LooseVersion(pyprocar.__version__) < LooseVersion("6.0.0"):
-    from pyprocar import ProcarSelect
-else:
-    from pyprocar.core import ProcarSelect
+# pymatgen, pyprocar (with its VTK stack) and pandas take seconds and hundreds of MB
+# to import, so they are only imported when a parser is first used; h5py reads
+# vaspout.h5
+HEAVY_MODULES = [
+    "pandas",
+    "scipy.optimize",
+    "pymatgen.io.vasp",
+    "pymatgen.electronic_structure.plotter",
+    "pyprocar",
+    "h5py",
+]
+
+
+def preload_heavy_modules() -> None:
+    """
+    Import the heavy dependencies up front, e.g. in the gunicorn master before forking
+    so that the workers share the imported modules copy-on-write
+    """
+    import importlib
+
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+
+def _procar_classes():
+    from distutils.version import LooseVersion
+
+    import pyprocar
+    from pyprocar import ProcarParser
+
+    if LooseVersion(pyprocar.__version__) < LooseVersion("6.0.0"):
+        from pyprocar import ProcarSelect
+    else:
+        from pyprocar.core import ProcarSelect
+
+    return ProcarParser, ProcarSelect
 
 
 class ParseXmlError(Exception):
@@ -38,21 +68,224 @@ class ParseWannError(Exception):
         super().__init__("Can't parse wannier90_band.dat file")
 
 
+class ParseTBError(Exception):
+    def __init__(self):
+        super().__init__("Can't parse wannier90_hr.dat / wannier90_tb.dat file")
+
+
+class ParseEigenvalError(Exception):
+    def __init__(self):
+        super().__init__("Can't parse EIGENVAL with DOSCAR/OUTCAR and POSCAR/CONTCAR")
+
+
+class ParseVaspoutError(Exception):
+    def __init__(self):
+        super().__init__("Can't parse vaspout.h5")
+
+
+def is_eigenval(path: str) -> bool:
+    return os.path.basename(path).startswith("EIGENVAL")
+
+
+def _beside(path: str, names: tuple) -> Optional[str]:
+    """
+    First non-empty file of `names` in the directory of `path`
+    """
+    for name in names:
+        candidate = os.path.join(os.path.dirname(path), name)
+        if os.path.isfile(candidate) and os.path.getsize(candidate) > 0:
+            return candidate
+    return None
+
+
+def _is_complete_xml(vasp_xml: str) -> bool:
+    """
+    Whether vasprun.xml was closed, i.e. the run was not killed while writing it
+    """
+    return search_file_tail(vasp_xml, rb"</modeling>", max_bytes=4096) is not None
+
+
+def find_eigenval(vasp_xml: str, size_ratio: float) -> Optional[str]:
+    """
+    EIGENVAL to read the bands from instead of `vasp_xml` (vasprun.xml or its
+    directory): when vasprun.xml is missing, truncated or more than `size_ratio`
+    times larger, and the Fermi level and structure can be read next to EIGENVAL
+    """
+    if is_eigenval(vasp_xml):
+        return vasp_xml if os.path.isfile(vasp_xml) else None
+    directory = vasp_xml if os.path.isdir(vasp_xml) else os.path.dirname(vasp_xml)
+    eigenval = os.path.join(directory, "EIGENVAL")
+    if not os.path.isfile(eigenval):
+        return None
+    if not (
+        _beside(eigenval, ("DOSCAR", "OUTCAR"))
+        and _beside(eigenval, ("CONTCAR", "POSCAR"))
+    ):
+        return None
+    if (
+        os.path.isfile(vasp_xml)
+        and _is_complete_xml(vasp_xml)
+        and os.path.getsize(vasp_xml) < size_ratio * os.path.getsize(eigenval)
+    ):
+        return None
+    return eigenval
+
+
+def read_eigenval(eigenval: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fractional k-points (nkpts, 3) and eigenvalues (nspin, nkpts, nbands) of EIGENVAL
+    """
+    with open(eigenval) as f:
+        header = [f.readline() for _ in range(6)]
+        data = np.fromstring(f.read(), sep=" ")
+    ispin = int(header[0].split()[3])
+    nkpts, nbands = (int(value) for value in header[5].split()[1:3])
+    # per k-point: k-point and weight, then index, energies (and occupations)
+    per_kpoint = data.size // nkpts
+    ncols = (per_kpoint - 4) // nbands
+    if data.size != nkpts * per_kpoint or ncols * nbands + 4 != per_kpoint:
+        raise ValueError("Unexpected size of {}".format(eigenval))
+    blocks = data.reshape(nkpts, per_kpoint)
+    values = blocks[:, 4:].reshape(nkpts, nbands, ncols)
+    return blocks[:, :3], np.ascontiguousarray(
+        np.moveaxis(values[:, :, 1 : 1 + ispin], 2, 0)
+    )
+
+
+def read_poscar(poscar: str) -> dict:
+    """
+    Atomic symbols, lattice vectors (rows, Angstrom) and fractional positions of a
+    VASP 5 POSCAR or CONTCAR
+    """
+    with open(poscar) as f:
+        lines = f.read().splitlines()
+    scale = float(lines[1].split()[0])
+    lattice = np.array([line.split()[:3] for line in lines[2:5]], dtype=float)
+    if scale < 0:
+        # a negative scale is the volume of the cell
+        scale = (-scale / abs(np.linalg.det(lattice))) ** (1 / 3)
+    lattice *= scale
+    # "Fe_pv/abc12" as written by some tools
+    names = [name.split("/")[0].split("_")[0] for name in lines[5].split()]
+    counts = [int(count) for count in lines[6].split()]
+    line = 7
+    if lines[line].strip()[:1] in "sS":
+        # selective dynamics
+        line += 1
+    cartesian = lines[line].strip()[:1] in "cCkK"
+    positions = np.array(
+        [row.split()[:3] for row in lines[line + 1 : line + 1 + sum(counts)]],
+        dtype=float,
+    )
+    if cartesian:
+        positions = positions * scale @ np.linalg.inv(lattice)
+    return {
+        "atoms": [name for name, count in zip(names, counts) for _ in range(count)],
+        "lattice": lattice,
+        "positions": positions,
+    }
+
+
+def _read_efermi_beside(eigenval: str) -> float:
+    """
+    Fermi level from line 6 of DOSCAR, or the last one written to OUTCAR, next to
+    EIGENVAL, without reading either file in full
+    """
+    doscar = _beside(eigenval, ("DOSCAR",))
+    if doscar:
+        with open(doscar) as f:
+            for _ in range(5):
+                f.readline()
+            return float(f.readline().split()[3])
+    outcar = _beside(eigenval, ("OUTCAR",))
+    match = outcar and search_file_tail(outcar, rb"E-fermi\s*:\s*([-\d.Ee+]+)")
+    if not match:
+        raise ValueError("No Fermi level next to {}".format(eigenval))
+    return float(match.group(1))
+
+
+def read_efermi(vasp_xml: str) -> float:
+    """
+    Fermi level of vasprun.xml or vaspout.h5, or of DOSCAR/OUTCAR for an EIGENVAL
+    """
+    from .vaspout import is_vaspout, read_vaspout_efermi
+
+    if is_vaspout(vasp_xml):
+        return read_vaspout_efermi(vasp_xml)
+    if is_eigenval(vasp_xml):
+        return _read_efermi_beside(vasp_xml)
+    with open(vasp_xml, "r") as f:
+        contents = f.read()
+    pattern = r'<i name="efermi">\s*([\d.-]+)\s*</i>'
+    matches = re.findall(pattern, contents)
+    return float(matches[0])
+
+
+def read_structure(vasp_xml: str) -> dict:
+    """
+    Atomic symbols, lattice vectors (rows, Angstrom) and fractional positions of the
+    initial structure, read from the top of vasprun.xml only, from vaspout.h5, or
+    from the CONTCAR or POSCAR next to an EIGENVAL
+    """
+    import xml.etree.ElementTree as ET
+
+    from .vaspout import is_vaspout, read_vaspout_structure
+
+    if is_vaspout(vasp_xml):
+        return read_vaspout_structure(vasp_xml)
+    if is_eigenval(vasp_xml):
+        return read_poscar(_beside(vasp_xml, ("CONTCAR", "POSCAR")))
+
+    structure = {}
+    for _, elem in ET.iterparse(vasp_xml):
+        if elem.tag == "array" and elem.get("name") == "atoms":
+            structure["atoms"] = [
+                rc.find("c").text.strip() for rc in elem.find("set").findall("rc")
+            ]
+        elif elem.tag == "structure" and elem.get("name") == "initialpos":
+            for name in ("basis", "positions"):
+                varray = elem.find(".//varray[@name='{}']".format(name))
+                structure[name] = np.array(
+                    [v.text.split() for v in varray.findall("v")], dtype=float
+                )
+            structure["lattice"] = structure.pop("basis")
+        if "atoms" in structure and "lattice" in structure:
+            break
+    return structure
+
+
 class VaspParser:
     def __init__(self, vasp_xml: str, kpoint_file: Optional[str] = None):
         try:
-            vasprun = BSVasprun(vasp_xml)
+            from pymatgen.electronic_structure.plotter import BSPlotter
+            from pymatgen.io.vasp import BSVasprun
+
+            observe_file(vasp_xml, parser="vasp")
+            with timer("wann_app_parser_seconds", stage="vasprun"):
+                vasprun = BSVasprun(vasp_xml)
             self.atom_list: list[str] = vasprun.atomic_symbols
         except Exception:
             raise ParseXmlError
 
         if kpoint_file:
             try:
-                bs_symm = vasprun.get_band_structure(kpoint_file, line_mode=True)
-                bs_plotter = BSPlotter(bs_symm)
-                self.efermi = bs_symm.efermi
-                self._data = bs_plotter.bs_plot_data(zero_to_efermi=False)
+                with timer("wann_app_parser_seconds", stage="band_structure"):
+                    bs_symm = vasprun.get_band_structure(kpoint_file, line_mode=True)
+                    bs_plotter = BSPlotter(bs_symm)
+                    self.efermi = bs_symm.efermi
+                    # fractional coordinates of the points of self.kpath
+                    self.kpoints = np.array([k.frac_coords for k in bs_symm.kpoints])
+                    self._data = bs_plotter.bs_plot_data(zero_to_efermi=False)
                 self.is_spin_polarized = bs_symm.is_spin_polarized
+                observe(
+                    "wann_app_parser_array_bytes",
+                    sum(
+                        np.asarray(seg).nbytes
+                        for segs in self._data["energy"].values()
+                        for seg in segs
+                    ),
+                    parser="vasp",
+                )
             except Exception:
                 raise ParseKpointsError
 
@@ -99,15 +332,98 @@ class VaspParser:
         return {"ticks": ticks, "ticklabels": ticklabels}
 
 
+class BandArrays:
+    """
+    Bands held as an array (nspin, nkpts, nbands) with the k-path through their
+    k-points: the interface of VaspParser for band plots, shared by the parsers
+    reading bands without pymatgen
+    """
+
+    def __init__(
+        self,
+        kpoints: np.ndarray,
+        energies: np.ndarray,
+        efermi: float,
+        atom_list: list[str],
+        path: KPath,
+    ):
+        self.kpoints = kpoints
+        self._energies = energies
+        self.efermi = efermi
+        self.atom_list = atom_list
+        self.is_spin_polarized = len(energies) == 2
+        self._path = path
+
+    @property
+    def bands(self):
+        return self._energies[0] - self.efermi
+
+    @property
+    def bands_up(self):
+        return self.bands
+
+    @property
+    def bands_down(self):
+        if self.is_spin_polarized:
+            return self._energies[1] - self.efermi
+        else:
+            raise Exception("Not spin polarized")
+
+    @property
+    def kpath(self):
+        return self._path.distances
+
+    @property
+    def ticks(self):
+        return self._path.ticks
+
+
+class EigenvalParser(BandArrays):
+    """
+    Bands of EIGENVAL with the Fermi level of DOSCAR/OUTCAR and the structure of
+    CONTCAR/POSCAR next to it, read without vasprun.xml
+    """
+
+    def __init__(self, eigenval: str, kpoint_file: Optional[str] = None):
+        try:
+            observe_file(eigenval, parser="eigenval")
+            with timer("wann_app_parser_seconds", stage="eigenval"):
+                kpoints, energies = read_eigenval(eigenval)
+            observe("wann_app_parser_array_bytes", energies.nbytes, parser="eigenval")
+            efermi = read_efermi(eigenval)
+            structure = read_structure(eigenval)
+        except Exception:
+            raise ParseEigenvalError
+        path = KPath.from_kpoints_file(
+            kpoints, reciprocal_lattice(structure["lattice"]), kpoint_file
+        )
+        super().__init__(kpoints, energies, efermi, structure["atoms"], path)
+
+
 class WannParser:
-    def __init__(self, bandfile: str, vasp_xml: str | None = None):
+    def __init__(
+        self,
+        bandfile: str,
+        vasp_xml: str | None = None,
+        efermi: Optional[float] = None,
+    ):
         self.bandfile = bandfile
         self.vasp_xml = vasp_xml
+        self.efermi = efermi
         self._data = None
 
     def read_file(self) -> None:
+        from pandas import MultiIndex
+
         try:
-            band_data = WannParser._read_wann_data(self.bandfile)
+            observe_file(self.bandfile, parser="wann")
+            with timer("wann_app_parser_seconds", stage="wannier_bands"):
+                band_data = WannParser._read_wann_data(self.bandfile)
+            observe(
+                "wann_app_parser_array_bytes",
+                band_data.memory_usage(index=False).sum(),
+                parser="wann",
+            )
 
             num_bands = band_data.shape[1] - 1
             columns = [("kpath", "")]
@@ -115,13 +431,15 @@ class WannParser:
             band_data.columns = MultiIndex.from_tuples(columns)
             self._data = band_data
 
-            if self.vasp_xml:
+            if self.vasp_xml or self.efermi is not None:
                 self._offset_by_fermi()
         except Exception:
             raise ParseWannError
 
     @staticmethod
     def _read_wann_data(bandfile: str):
+        import pandas as pd
+
         bands = []
         band = []
         kpath = []
@@ -149,12 +467,9 @@ class WannParser:
         return data
 
     def _offset_by_fermi(self) -> None:
-        with open(self.vasp_xml, "r") as f:
-            contents = f.read()
-        pattern = r'<i name="efermi">\s*([\d.-]+)\s*</i>'
-        matches = re.findall(pattern, contents)
-        efermi = float(matches[0])
-        self._data["bands"] = self._data["bands"] - efermi
+        if self.efermi is None:
+            self.efermi = read_efermi(self.vasp_xml)
+        self._data["bands"] = self._data["bands"] - self.efermi
 
         return
 
@@ -166,64 +481,339 @@ class WannParser:
     def kpath(self):
         return np.array(self._data["kpath"])
 
-
-class ProjParser:
-    @block_stdout
-    def __init__(self, procar: str, vasp_xml: str):
+    @property
+    def ticks(self) -> Optional[dict]:
+        """
+        Ticks of the seedname_band.labelinfo.dat written next to the bands, if any
+        """
+        if not self.bandfile.endswith(".dat"):
+            return None
+        return read_labelinfo(self.bandfile[: -len(".dat")] + ".labelinfo.dat")
+
+
+class ProjArrays:
+    """
+    Projections held as arrays: the bands (nkpts, nbands) relative to the Fermi level
+    with the spin channels side by side as pyprocar returns them (see `spin_blocks`),
+    and the weights of every atom and orbital. The interface of the projections for
+    the app, shared by ProjParser and the lazy VaspoutProjParser, which provide
+    `is_spin_polarized`, `is_soc`, `orbital_weights`, `project`, `project_groups`
+    and `spin_texture`.
+    """
+
+    def __init__(
+        self,
+        procar: str,
+        vasp_xml: str,
+        bands: np.ndarray,
+        kpoints: np.ndarray,
+        efermi: float,
+        orbitals: list[str],
+        num_ions: int,
+        structure: dict,
+    ):
         self.procar = procar
         self.vasp_xml = vasp_xml
-        pc_parser = ProcarParser()
-        try:
-            pc_parser.readFile(self.procar)
-            self.orbitals: list[str] = pc_parser.orbitalName[
-                : pc_parser.orbitalCount - 1
-            ]
-            self._data = ProcarSelect(pc_parser, deepCopy=True)
-            self._offset_by_fermi()
-        except Exception:
-            raise ParseProcarError
-
-    def _offset_by_fermi(self) -> None:
-        with open(self.vasp_xml, "r") as f:
-            contents = f.read()
-        pattern = r'<i name="efermi">\s*([\d.-]+)\s*</i>'
-        matches = re.findall(pattern, contents)
-        efermi = float(matches[0])
         self.efermi = efermi
-        self._data.bands = self._data.bands - efermi
-
-    @property
-    def is_spin_polarized(self):
-        return self._data.spd.shape[2] == 2
+        self._bands = bands - efermi
+        self._kpoints = kpoints
+        self.orbitals = orbitals
+        self.num_ions = num_ions
+        self.atom_list: list[str] = structure["atoms"]
+        self.lattice: np.ndarray = structure["lattice"]
+        self.sites = Sites(self.atom_list, self.lattice, structure["positions"])
 
     @property
     def bands(self):
-        return self._data.bands
+        return self._bands
 
     @property
     def kpath(self):
-        diff = self._data.kpoints[1:, :] - self._data.kpoints[0:-1, :]
-        segs = np.linalg.norm(diff, axis=1)
-        kpath = np.cumsum(segs)
-        return kpath
+        return self.path().distances
+
+    def path(self, kpoint_file: Optional[str] = None) -> KPath:
+        """
+        Path through the PROCAR k-points, with the segments and labels of a line-mode
+        KPOINTS if given
+        """
+        return KPath.from_kpoints_file(
+            self._kpoints, reciprocal_lattice(self.lattice), kpoint_file
+        )
+
+    @property
+    def spin_blocks(self) -> list[slice]:
+        """
+        Band slices of the spin channels. For ISPIN=2 pyprocar appends the spin down
+        bands to the spin up bands, and the weights (spin density) of each block are
+        those of its own channel, so both channels are views of the same arrays.
+        """
+        num_bands = self._bands.shape[-1]
+        if not self.is_spin_polarized:
+            return [slice(0, num_bands)]
+        num_bands //= 2
+        return [slice(0, num_bands), slice(num_bands, 2 * num_bands)]
+
+    def window_blocks(self, window: Optional[tuple[float, float]]) -> list[slice]:
+        """
+        Band slice of every spin block with energies in `window` (emin, emax) at some
+        k-point, possibly empty, or the whole blocks without a window. The bands are
+        sorted by energy at every k-point, so those in a window are contiguous.
+        """
+        if window is None:
+            return self.spin_blocks
+        bands = self._bands
+        slices = []
+        for block in self.spin_blocks:
+            inside = np.flatnonzero(
+                (bands[:, block].max(axis=0) >= window[0])
+                & (bands[:, block].min(axis=0) <= window[1])
+            )
+            start = block.start + (inside[0] if len(inside) else 0)
+            stop = block.start + (inside[-1] + 1 if len(inside) else 0)
+            slices.append(slice(int(start), int(stop)))
+        return slices
 
     @property
     def bands_up(self):
-        num_bands = int(self._data.bands.shape[-1] / 2)
-        return self._data.bands[:, :num_bands]
+        return self._bands[:, self.spin_blocks[0]]
 
     @property
     def bands_down(self):
-        num_bands = int(self._data.bands.shape[-1] / 2)
         if self.is_spin_polarized:
-            return self._data.bands[:, num_bands:]
+            return self._bands[:, self.spin_blocks[1]]
         else:
             raise Exception("Not spin-polarized")
 
+    def characters(self, groups: list[list[int]]) -> np.ndarray:
+        """
+        Orbital character of every band, summed over each group of atoms.
+        Returns an array of shape (nkpts, nbands, len(groups) * norbitals)
+        """
+        spd = self.orbital_weights
+        return np.concatenate(
+            [spd[:, :, group].sum(axis=2) for group in groups], axis=2
+        )
+
+    @property
+    def shells(self) -> list[str]:
+        """
+        Angular momentum (s, p, d, f) of the orbitals present, in order
+        """
+        shells = []
+        for orbital in self.orbitals:
+            shell = "d" if orbital == "x2-y2" else orbital[0]
+            if shell not in shells:
+                shells.append(shell)
+        return shells
+
+    def composition(self) -> dict:
+        """
+        Character of every band on each species and shell (e.g. "Fe d"): the
+        fraction of the band weight at each k-point, averaged ("mean") and maximal
+        ("max") over the k-points, arrays of shape (nbands, nspecies * nshells).
+        """
+        species = group_by_species(self.atom_list)
+        species_masks = np.zeros((len(species), self.num_ions))
+        for row, atoms in enumerate(species.values()):
+            species_masks[row, atoms] = 1
+        shells = self.shells
+        shell_masks = np.zeros((len(shells), len(self.orbitals)))
+        for col, orbital in enumerate(self.orbitals):
+            shell_masks[
+                shells.index("d" if orbital == "x2-y2" else orbital[0]), col
+            ] = 1
+
+        with timer("wann_app_parser_seconds", stage="procar_composition"):
+            weights = np.einsum(
+                "kbao,sa,lo->kbsl",
+                self.orbital_weights,
+                species_masks,
+                shell_masks,
+                optimize=True,
+            )
+            weights = weights.reshape(weights.shape[:2] + (-1,))
+            total = weights.sum(axis=2, keepdims=True)
+            fractions = weights / np.where(total > 0, total, 1)
+        return {
+            "labels": [
+                "{} {}".format(name, shell) for name in species for shell in shells
+            ],
+            "mean": fractions.mean(axis=0),
+            "max": fractions.max(axis=0),
+            "energies": self.bands.mean(axis=0),
+        }
+
+    def band_order(self, groups: list[list[int]], max_jump: float = 1.0) -> np.ndarray:
+        """
+        Band order connected by orbital character, see `connect_bands`.
+        For spin polarized data the up and down blocks are connected separately.
+        """
+        with timer("wann_app_parser_seconds", stage="band_order"):
+            return self._band_order(groups, max_jump)
+
+    def _band_order(self, groups: list[list[int]], max_jump: float) -> np.ndarray:
+        characters = self.characters(groups)
+        bands = self._bands
+        orders = []
+        for block in self.spin_blocks:
+            order = connect_bands(bands[:, block], characters[:, block], max_jump)
+            orders.append(order + block.start)
+        return np.hstack(orders)
+
+
+class ProjParser(ProjArrays):
+    """
+    Projections of PROCAR parsed by pyprocar, which also offers its own selection
+    (`select_atom_and_orb`, `weights`)
+    """
+
+    @block_stdout
+    def __init__(self, procar: str, vasp_xml: str, efermi: Optional[float] = None):
+        ProcarParser, ProcarSelect = _procar_classes()
+        pc_parser = ProcarParser()
+        try:
+            observe_file(procar, parser="procar")
+            with timer("wann_app_parser_seconds", stage="procar"):
+                pc_parser.readFile(procar)
+            observe(
+                "wann_app_parser_array_bytes", pc_parser.spd.nbytes, parser="procar"
+            )
+            orbitals = pc_parser.orbitalName[: pc_parser.orbitalCount - 1]
+            # the selections below never modify the parsed array in place,
+            # so keep it around unselected instead of making a deep copy
+            self._spd = pc_parser.spd
+            self._data = ProcarSelect(pc_parser, deepCopy=False)
+            if efermi is None:
+                efermi = read_efermi(vasp_xml)
+            structure = read_structure(vasp_xml)
+        except Exception:
+            raise ParseProcarError
+        super().__init__(
+            procar,
+            vasp_xml,
+            self._data.bands,
+            self._data.kpoints,
+            efermi,
+            orbitals,
+            max(pc_parser.ionsCount - 1, 1),
+            structure,
+        )
+        # the pyprocar selection holds the bands relative to the Fermi level as well
+        self._data.bands = self._bands
+
+    @property
+    def is_spin_polarized(self):
+        return self._spd.shape[2] == 2
+
     @property
     def weights(self):
         return self._data.spd
 
+    @property
+    def orbital_weights(self) -> np.ndarray:
+        """
+        Weight of every atom and orbital, a view of shape (nkpts, nbands, nions, norb)
+        """
+        return self._spd[:, :, 0, : self.num_ions, 1:-1]
+
+    @property
+    def is_soc(self) -> bool:
+        # total, Sx, Sy, Sz
+        return self._spd.shape[2] == 4
+
+    def _masks(self, atoms: list[int], orbs: list[int]) -> tuple:
+        atom_mask = np.zeros(self._spd.shape[3])
+        atom_mask[atoms] = 1
+        orb_mask = np.zeros(self._spd.shape[4])
+        # the first orbital column holds the ion index
+        orb_mask[[orb + 1 if orb >= 0 else orb for orb in orbs]] = 1
+        return atom_mask, orb_mask
+
+    def project(
+        self,
+        ispin: list[int],
+        atoms: list[int],
+        orbs: list[int],
+        window: Optional[tuple[float, float]] = None,
+    ) -> np.ndarray:
+        """
+        Weights summed over the given spin channels, atoms and orbitals, the same as
+        `select_atom_and_orb` followed by `weights` but without modifying the parser,
+        so that a parsed PROCAR can be shared and projected repeatedly. With an
+        energy `window` only the bands in it are projected, the others are zero.
+        Returns an array of shape (nkpts, nbands).
+        """
+        if window is not None:
+            return self.project_groups([(atoms, orbs)], ispin, window)[0]
+        spin_mask = np.zeros(self._spd.shape[2])
+        spin_mask[ispin] = 1
+        atom_mask, orb_mask = self._masks(atoms, orbs)
+        with timer("wann_app_parser_seconds", stage="procar_project"):
+            # contracting with masks reads the parsed array without copying it
+            return np.einsum(
+                "kbsao,s,a,o->kb",
+                self._spd,
+                spin_mask,
+                atom_mask,
+                orb_mask,
+                optimize=True,
+            )
+
+    def project_groups(
+        self,
+        groups: list[tuple[list[int], list[int]]],
+        ispin: tuple = (0,),
+        window: Optional[tuple[float, float]] = None,
+    ) -> np.ndarray:
+        """
+        Weights of several (atoms, orbitals) groups in one contraction over the parsed
+        array, of the bands in `window` only if given (see `project`).
+        Returns an array of shape (len(groups), nkpts, nbands).
+        """
+        spin_mask = np.zeros(self._spd.shape[2])
+        spin_mask[list(ispin)] = 1
+        masks = [self._masks(atoms, orbs) for atoms, orbs in groups]
+        atom_masks = np.array([atom_mask for atom_mask, _ in masks])
+        orb_masks = np.array([orb_mask for _, orb_mask in masks])
+        with timer("wann_app_parser_seconds", stage="procar_groups"):
+            if window is None:
+                return np.einsum(
+                    "kbsao,s,ga,go->gkb",
+                    self._spd,
+                    spin_mask,
+                    atom_masks,
+                    orb_masks,
+                    optimize=True,
+                )
+            weights = np.zeros((len(groups),) + self._bands.shape)
+            for bands in self.window_blocks(window):
+                weights[:, :, bands] = np.einsum(
+                    "kbsao,s,ga,go->gkb",
+                    self._spd[:, bands],
+                    spin_mask,
+                    atom_masks,
+                    orb_masks,
+                    optimize=True,
+                )
+            return weights
+
+    def spin_texture(self, atoms: list[int], orbs: list[int]) -> np.ndarray:
+        """
+        Sx, Sy, Sz of every band summed over the given atoms and orbitals, for SOC
+        calculations. Returns an array of shape (3, nkpts, nbands).
+        """
+        if not self.is_soc:
+            raise Exception("Not a spin-orbit calculation")
+        atom_mask, orb_mask = self._masks(atoms, orbs)
+        with timer("wann_app_parser_seconds", stage="procar_spin_texture"):
+            return np.einsum(
+                "kbsao,a,o->skb",
+                self._spd[:, :, 1:4],
+                atom_mask,
+                orb_mask,
+                optimize=True,
+            )
+
     @block_stdout
     def select_atom_and_orb(
         self, ispin: list[int], atoms: list[int], orbs: list[int], separate=False
@@ -254,8 +844,9 @@ class ProjParser:
             "tot",
         ]
         """
-        self._data.selectIspin(ispin, separate=separate)
-        self._data.selectAtoms(atoms)
-        self._data.selectOrbital(orbs)
+        with timer("wann_app_parser_seconds", stage="procar_select"):
+            self._data.selectIspin(ispin, separate=separate)
+            self._data.selectAtoms(atoms)
+            self._data.selectOrbital(orbs)
 
         return
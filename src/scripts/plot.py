@@ -1,5 +1,8 @@
 import numpy as np
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from .metrics import timed
 
 
 def normalize_kpath(kpath):
@@ -9,8 +12,16 @@ def normalize_kpath(kpath):
     return (kpath - min_val) / (max_val - min_val)
 
 
+@timed("wann_app_plot_seconds", plot="plain_bandplot")
 def plain_bandplot(
-    fig: go.Figure, kpath, bands, color, label=None, yrange=[-4, 4], **kwargs
+    fig: go.Figure,
+    kpath,
+    bands,
+    color,
+    label=None,
+    yrange=[-4, 4],
+    dash=None,
+    **kwargs,
 ):
     num_bands = bands.shape[1]
 
@@ -23,7 +34,7 @@ def plain_bandplot(
                 # name=f"Trace{idx}",
                 customdata=[f"{idx+1}"] * len(kpath),
                 hovertemplate="band-index: %{customdata}<br>energy: %{y:.3f} eV<extra></extra>",
-                line=dict(color=color, width=2),
+                line=dict(color=color, width=2, dash=dash),
                 legendgroup=label,
                 name=label,
                 showlegend=(True if idx == 0 else False),
@@ -34,6 +45,7 @@ def plain_bandplot(
     return fig
 
 
+@timed("wann_app_plot_seconds", plot="proj_bandplot")
 def proj_bandplot(
     fig: go.Figure,
     kpath,
@@ -42,6 +54,9 @@ def proj_bandplot(
     normalize=False,
     cmap="jet",
     label=None,
+    colorbar=None,
+    cmin=None,
+    cmax=None,
     **kwargs,
 ):
 
@@ -58,8 +73,11 @@ def proj_bandplot(
                     color=weights[:, idx],
                     colorscale=cmap,
                     colorbar_thickness=25,
-                    cmin=weights.min(),
-                    cmax=weights.max(),
+                    cmin=weights.min() if cmin is None else cmin,
+                    cmax=weights.max() if cmax is None else cmax,
+                    # one color bar per call, e.g. one for each spin channel
+                    showscale=colorbar is not None and idx == 0,
+                    colorbar=colorbar,
                 ),
                 customdata=[f"{idx+1}"] * len(kpath),
                 hovertemplate="band-index: %{customdata}<br>energy: %{y:.3f} eV<extra></extra>",
@@ -77,6 +95,324 @@ def proj_bandplot(
     return fig
 
 
+def fat_band_mask(weights, threshold, weight_max=None):
+    """
+    Points of the fat bands that are drawn: weights relative to `weight_max`
+    (default: the largest weight) of at least `threshold`.
+    Returns the mask and the relative weights.
+    """
+    if weight_max is None:
+        weight_max = weights.max()
+    relative = weights / weight_max if weight_max > 0 else np.zeros_like(weights)
+    return relative >= threshold, relative
+
+
+@timed("wann_app_plot_seconds", plot="fat_bandplot")
+def fat_bandplot(
+    fig: go.Figure,
+    kpath,
+    bands,
+    weights,
+    color,
+    threshold=0.02,
+    weight_max=None,
+    max_size=14,
+    opacity=False,
+    label=None,
+    colorscale=None,
+    cmin=None,
+    cmax=None,
+    colorbar=None,
+    **kwargs,
+):
+    """
+    Fat bands: all bands in one WebGL marker trace, marker size (and optionally
+    opacity) proportional to the weight. Points below `threshold` are not drawn.
+    `color` is a single color or an array of values (nkpts, nbands) for `colorscale`.
+    """
+    mask, relative = fat_band_mask(weights, threshold, weight_max)
+    k_idx, band_idx = np.nonzero(mask)
+    relative = relative[mask]
+
+    marker = dict(size=max_size * relative, sizemode="diameter", line_width=0)
+    if opacity:
+        marker["opacity"] = 0.2 + 0.8 * relative
+    if isinstance(color, str):
+        marker["color"] = color
+    else:
+        marker.update(
+            color=np.asarray(color)[mask],
+            colorscale=colorscale,
+            cmin=cmin,
+            cmax=cmax,
+            showscale=colorbar is not None,
+            colorbar=colorbar,
+        )
+
+    fig.add_trace(
+        go.Scattergl(
+            x=np.asarray(kpath)[k_idx],
+            y=bands[mask],
+            mode="markers",
+            marker=marker,
+            customdata=np.stack([band_idx + 1, weights[mask]], axis=-1),
+            hovertemplate="band-index: %{customdata[0]}<br>energy: %{y:.3f} eV"
+            "<br>weight: %{customdata[1]:.3f}<extra></extra>",
+            name=label,
+            legendgroup=label,
+            showlegend=True,
+            **kwargs,
+        )
+    )
+    return fig
+
+
+def _to_rgb(color: str) -> np.ndarray:
+    """
+    Red, green and blue (0-255) of a CSS color: rgb()/rgba(), hex (#rgb, #rrggbb,
+    with alpha too) or a name. Raises ValueError for anything else.
+    """
+    color = color.strip().lower()
+    if color.startswith(("rgb(", "rgba(")) and color.endswith(")"):
+        values = color[color.index("(") + 1 : -1].split(",")
+        if len(values) not in (3, 4):
+            raise ValueError("Invalid color {}".format(color))
+        rgb = np.array([float(value) for value in values[:3]])
+    else:
+        from matplotlib.colors import to_rgb
+
+        rgb = 255 * np.array(to_rgb(color))
+    if not ((rgb >= 0) & (rgb <= 255)).all():
+        raise ValueError("Invalid color {}".format(color))
+    return rgb
+
+
+def normalize_color(color: str) -> str:
+    """
+    A CSS color as rgb(), the form that `group_bandplot` mixes. Raises ValueError
+    for an invalid color.
+    """
+    return "rgb({:.0f},{:.0f},{:.0f})".format(*_to_rgb(color))
+
+
+@timed("wann_app_plot_seconds", plot="group_bandplot")
+def group_bandplot(
+    fig: go.Figure,
+    kpath,
+    bands,
+    weights,
+    colors,
+    names,
+    mode="overlay",
+    threshold=0.02,
+    max_size=14,
+    label_suffix="",
+):
+    """
+    Fat bands of several projection groups, weights of shape (ngroups, nkpts, nbands).
+    "overlay" draws one fat band trace per group, sized on a common scale.
+    "rgb" draws one trace sized by the total weight and colored by mixing the group
+    colors (CSS colors, see `_to_rgb`) in proportion to their weights.
+    """
+    weight_max = weights.max()
+    if mode == "overlay":
+        for group_weights, color, name in zip(weights, colors, names):
+            fat_bandplot(
+                fig,
+                kpath,
+                bands,
+                group_weights,
+                color,
+                threshold=threshold,
+                weight_max=weight_max,
+                max_size=max_size,
+                label=name + label_suffix,
+                opacity=True,
+            )
+        return fig
+
+    total = weights.sum(axis=0)
+    mask, relative = fat_band_mask(total, threshold)
+    k_idx, band_idx = np.nonzero(mask)
+    shares = weights[:, mask] / total[mask]
+    rgb = shares.T @ np.array([_to_rgb(color) for color in colors])
+    point_colors = ["rgb({:.0f},{:.0f},{:.0f})".format(*point) for point in rgb]
+    fig.add_trace(
+        go.Scattergl(
+            x=np.asarray(kpath)[k_idx],
+            y=bands[mask],
+            mode="markers",
+            marker=dict(
+                size=max_size * relative[mask],
+                sizemode="diameter",
+                line_width=0,
+                color=point_colors,
+            ),
+            customdata=np.column_stack([band_idx + 1, shares.T]),
+            hovertemplate="band-index: %{customdata[0]}<br>energy: %{y:.3f} eV<br>"
+            + "<br>".join(
+                "{}: %{{customdata[{}]:.2f}}".format(name, i + 1)
+                for i, name in enumerate(names)
+            )
+            + "<extra></extra>",
+            name=" + ".join(names) + label_suffix,
+            showlegend=True,
+        )
+    )
+    return fig
+
+
+@timed("wann_app_plot_seconds", plot="dos_plot")
+def dos_plot(fig: go.Figure, energies, dos, color, label=None, fill=False, xaxis="x2"):
+    """
+    DOS curve in the side panel, energies on the shared y-axis
+    """
+    fig.add_trace(
+        go.Scatter(
+            x=dos,
+            y=energies,
+            mode="lines",
+            line=dict(color=color, width=1.5),
+            fill="tozerox" if fill else None,
+            hovertemplate="DOS: %{x:.3f}<br>energy: %{y:.3f} eV<extra></extra>",
+            legendgroup=label,
+            name=label,
+            xaxis=xaxis,
+        )
+    )
+    return fig
+
+
+@timed("wann_app_plot_seconds", plot="wout_figure")
+def wout_figure(curves: list[tuple], names: list[str]) -> go.Figure:
+    """
+    Convergence of the disentanglement (first curve) and of the spreads (the others)
+    """
+    fig = make_subplots(
+        rows=1,
+        cols=2,
+        subplot_titles=("Disentanglement", "Wannierization"),
+        horizontal_spacing=0.12,
+    )
+    for idx, ((x, y), name) in enumerate(zip(curves, names)):
+        fig.add_trace(
+            go.Scattergl(x=x, y=y, mode="lines", name=name),
+            row=1,
+            col=1 if idx == 0 else 2,
+        )
+    fig.update_xaxes(title="Iteration", showgrid=False)
+    fig.update_yaxes(title="Ang^2", showgrid=False)
+    fig.update_layout(
+        height=350,
+        margin=dict(l=50, r=20, t=40, b=40),
+        legend=dict(orientation="h", yanchor="top", y=-0.2, x=0.01),
+    )
+    return fig
+
+
+def kplane_figure(
+    grid: np.ndarray,
+    energies: np.ndarray,
+    energy: float,
+    style: str,
+    axes: tuple[str, str],
+    broadening: float,
+    colors: list,
+) -> go.Figure:
+    """
+    Constant energy contours of bands on a k-plane, energies (nu, nv, nbands), over
+    a heatmap of the Lorentzian broadened spectral weight at `energy` if `style` is
+    "heatmap"
+    """
+    fig = go.Figure()
+    if style == "heatmap":
+        weight = broadening / np.pi / ((energies - energy) ** 2 + broadening**2)
+        fig.add_trace(
+            go.Heatmap(
+                x=grid,
+                y=grid,
+                z=weight.sum(axis=2).T,
+                colorscale="Greys",
+                showscale=False,
+                hovertemplate="%{x:.3f}, %{y:.3f}<extra></extra>",
+            )
+        )
+    crossing = np.flatnonzero(
+        (energies.min(axis=(0, 1)) <= energy) & (energies.max(axis=(0, 1)) >= energy)
+    )
+    for idx, band in enumerate(crossing):
+        fig.add_trace(
+            go.Contour(
+                x=grid,
+                y=grid,
+                z=energies[:, :, band].T,
+                contours=dict(start=energy, end=energy, size=1, coloring="lines"),
+                line=dict(width=2),
+                colorscale=[[0, colors[idx % len(colors)]]] * 2,
+                showscale=False,
+                name="band {}".format(band + 1),
+                showlegend=True,
+                hovertemplate="band {}<extra></extra>".format(band + 1),
+            )
+        )
+    fig.update_layout(
+        xaxis=dict(title=axes[0], showgrid=False, constrain="domain"),
+        yaxis=dict(title=axes[1], showgrid=False, scaleanchor="x", constrain="domain"),
+        width=500,
+        height=500,
+        margin=dict(l=50, r=20, t=30, b=40),
+        legend=dict(orientation="h", yanchor="top", y=-0.15, x=0.01),
+    )
+    return fig
+
+
+def composition_figure(
+    matrix: np.ndarray, columns: list[str], rows: list[str], energies: np.ndarray
+) -> go.Figure:
+    """
+    Heatmap of the character of the bands (rows) on species and shells (columns),
+    with the mean energy of every band in the hover text
+    """
+    fig = go.Figure(
+        go.Heatmap(
+            x=columns,
+            y=rows,
+            z=matrix,
+            zmin=0,
+            zmax=1,
+            customdata=np.repeat(energies[:, None], len(columns), axis=1),
+            colorscale="Blues",
+            colorbar=dict(len=0.5, thickness=15),
+            hovertemplate="band %{y}, %{x}: %{z:.2f}<br>"
+            "mean energy: %{customdata:.3f} eV<extra></extra>",
+        )
+    )
+    fig.update_layout(
+        xaxis=dict(side="top", showgrid=False),
+        yaxis=dict(title="Band", type="category", showgrid=False),
+        height=min(max(300, 14 * len(rows)), 1200),
+        margin=dict(l=50, r=20, t=40, b=20),
+    )
+    return fig
+
+
+def add_notice(fig, text: str, color="red"):
+    """
+    A note above the top left corner of the plot, e.g. why an option was not applied
+    """
+    fig.add_annotation(
+        text=text,
+        xref="paper",
+        yref="paper",
+        x=0,
+        y=1,
+        xanchor="left",
+        yanchor="bottom",
+        showarrow=False,
+        font=dict(color=color, size=11),
+    )
+
+
 def make_symm_lines(fig, ticks: dict, color, width=1, use_dash=True, style="dash"):
     for tick, label in zip(ticks["ticks"], ticks["ticklabels"]):
         fig.add_vline(
@@ -0,0 +1,164 @@
+"""
+Opt-in cProfile capture of Dash callbacks.
+
+A callback is profiled when its name is listed in WANN_APP_PROFILE_CALLBACKS, when the
+update request carries the header `X-Wann-Profile: 1`, or when the app was opened with
+`?profile=1` (the page url is sent as the referrer of every update request).
+Each capture is stored in PROFILE_DIR as a .prof file, loadable with pstats or
+snakeviz, next to a .json file with the callback inputs and the top functions.
+"""
+
+import cProfile
+import glob
+import json
+import os
+import pstats
+import time
+from functools import wraps
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from .config import PROFILE_CALLBACKS, PROFILE_DIR, PROFILE_KEEP, PROFILE_TOP_N
+
+PROFILE_HEADER = "X-Wann-Profile"
+PROFILE_QUERY = "profile"
+
+
+def _is_on(value: Optional[str]) -> bool:
+    return value is not None and value.lower() in ("1", "true", "yes", "on")
+
+
+def _requested() -> bool:
+    from flask import has_request_context, request
+
+    if not has_request_context():
+        return False
+    if _is_on(request.headers.get(PROFILE_HEADER)):
+        return True
+    if _is_on(request.args.get(PROFILE_QUERY)):
+        return True
+    referrer = urlparse(request.referrer or "")
+    return _is_on(parse_qs(referrer.query).get(PROFILE_QUERY, [None])[0])
+
+
+def _request_body() -> Optional[dict]:
+    from flask import has_request_context, request
+
+    if not has_request_context():
+        return None
+    return request.get_json(silent=True)
+
+
+def top_functions(stats: pstats.Stats, n: int = PROFILE_TOP_N) -> list[dict]:
+    """
+    The `n` functions with the largest cumulative time
+    """
+    stats.sort_stats("cumulative")
+    rows = []
+    for func in stats.fcn_list[:n]:
+        cc, ncalls, tottime, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        rows.append(
+            {
+                "function": "{}:{}({})".format(os.path.basename(filename), line, name),
+                "ncalls": ncalls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            }
+        )
+    return rows
+
+
+def _save(name: str, profile: cProfile.Profile, seconds: float, args) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = time.time()
+    capture_id = "{}{:03d}-{}-{}".format(
+        time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+        int(now % 1 * 1000),
+        name,
+        os.getpid(),
+    )
+    path = os.path.join(PROFILE_DIR, capture_id)
+    profile.dump_stats(path + ".prof")
+    meta = {
+        "id": capture_id,
+        "callback": name,
+        "time": now,
+        "seconds": seconds,
+        "args": args,
+        # replay the capture by posting this body to /_dash-update-component
+        "request": _request_body(),
+        "top": top_functions(pstats.Stats(profile)),
+    }
+    with open(path + ".json", "w") as f:
+        json.dump(meta, f, default=str)
+    _prune()
+    return capture_id
+
+
+def _prune(keep: int = PROFILE_KEEP) -> None:
+    metas = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=os.path.getmtime)
+    for path in metas[:-keep]:
+        for ext in (".json", ".prof"):
+            try:
+                os.remove(os.path.splitext(path)[0] + ext)
+            except OSError:
+                pass
+
+
+def profiled(name: str):
+    """
+    Decorator profiling the calls of a callback that are configured or requested
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if name not in PROFILE_CALLBACKS and not _requested():
+                return func(*args, **kwargs)
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                try:
+                    _save(name, profile, time.perf_counter() - start, list(args))
+                except OSError:
+                    pass
+
+        return wrapper
+
+    return decorator
+
+
+def profile_callbacks(app, exclude: tuple = ()) -> None:
+    for callback in app.callback_map.values():
+        func = callback["callback"]
+        name = getattr(func, "__name__", "callback")
+        if name in exclude:
+            continue
+        callback["callback"] = profiled(name)(func)
+
+
+def list_profiles(limit: int = PROFILE_KEEP) -> list[dict]:
+    """
+    Metadata of the stored captures, newest first
+    """
+    profiles = []
+    for path in glob.glob(os.path.join(PROFILE_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda meta: meta["time"], reverse=True)
+    return profiles[:limit]
+
+
+def get_profile(capture_id: str) -> Optional[dict]:
+    path = os.path.join(PROFILE_DIR, os.path.basename(capture_id) + ".json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
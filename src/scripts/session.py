@@ -0,0 +1,402 @@
+"""
+Server-side store of the parsed datasets, selections and derived arrays of every
+browser session.
+
+The browser only keeps a session id (`dcc.Store` with session storage). Entries are
+dropped least recently used first when a session or all sessions of the worker exceed
+their memory budget, and whole sessions after SESSION_TTL seconds without use. A
+dropped entry is loaded again by its loader on the next access.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from .analytics import analyze
+from .config import SESSION_MEMORY_MB, SESSION_TTL, TOTAL_SESSION_MEMORY_MB
+from .dataset import (file_key, load_layers, load_proj, load_tb, load_vasp,
+                      load_wann)
+from .dos import projected_histograms, read_vasprun_dos
+from .metrics import inc
+from .parser import ProjArrays, VaspParser, WannParser, is_eigenval
+from .tb import TBModel, densify, plane_vectors
+from .vaspout import is_vaspout
+
+
+def estimate_nbytes(obj: Any, depth: int = 5, _seen: Optional[set] = None) -> int:
+    """
+    Memory held by the numpy arrays and pandas objects reachable from `obj`
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen or depth < 0:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, "memory_usage"):
+        # pandas DataFrame / Series
+        usage = obj.memory_usage(index=False)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if isinstance(obj, dict):
+        children = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        children = obj
+    elif hasattr(obj, "__dict__"):
+        children = vars(obj).values()
+    else:
+        return 0
+    return sum(estimate_nbytes(child, depth - 1, _seen) for child in children)
+
+
+class SessionStore:
+    def __init__(
+        self,
+        session_budget: float = SESSION_MEMORY_MB * 2**20,
+        total_budget: float = TOTAL_SESSION_MEMORY_MB * 2**20,
+        ttl: float = SESSION_TTL,
+    ):
+        self.session_budget = session_budget
+        self.total_budget = total_budget
+        self.ttl = ttl
+        # session id -> key -> [value, nbytes, last used]
+        self._sessions: dict[str, OrderedDict] = {}
+        self._last_used: dict[str, float] = {}
+        # objects can be shared by sessions (see dataset.py), they are counted once:
+        # id(value) -> [number of entries holding it, nbytes]
+        self._objects: dict[int, list] = {}
+        self._lock = threading.RLock()
+
+    def get(self, session_id: Optional[str], key: tuple, loader: Callable) -> Any:
+        """
+        Value of `key` in the session, calling `loader` if it is not stored (any more)
+        """
+        if not session_id:
+            return loader()
+
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._last_used[session_id] = now
+            entry = self._sessions.setdefault(session_id, OrderedDict()).get(key)
+            if entry is not None:
+                self._sessions[session_id].move_to_end(key)
+                entry[2] = now
+                inc("wann_app_cache_requests_total", cache="session", result="hit")
+                return entry[0]
+
+        inc("wann_app_cache_requests_total", cache="session", result="miss")
+        value = loader()
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            entries = self._sessions.setdefault(session_id, OrderedDict())
+            if key in entries:
+                self._release(entries.pop(key))
+            entries[key] = [value, nbytes, now]
+            record = self._objects.setdefault(id(value), [0, nbytes])
+            record[0] += 1
+            self._evict(session_id, key)
+        return value
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            for entry in self._sessions.pop(session_id, {}).values():
+                self._release(entry)
+            self._last_used.pop(session_id, None)
+
+    def session_nbytes(self, session_id: str) -> int:
+        with self._lock:
+            entries = self._sessions.get(session_id, {}).values()
+            return sum({id(entry[0]): entry[1] for entry in entries}.values())
+
+    def total_nbytes(self) -> int:
+        with self._lock:
+            return sum(record[1] for record in self._objects.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "entries": sum(len(entries) for entries in self._sessions.values()),
+                "nbytes": self.total_nbytes(),
+            }
+
+    def _release(self, entry: list) -> None:
+        record = self._objects[id(entry[0])]
+        record[0] -= 1
+        if record[0] == 0:
+            del self._objects[id(entry[0])]
+
+    def _expire(self, now: float) -> None:
+        for session_id, last_used in list(self._last_used.items()):
+            if now - last_used > self.ttl:
+                self.drop(session_id)
+
+    def _evict(self, session_id: str, keep: tuple) -> None:
+        """
+        Drop least recently used entries until both budgets are met, never the entry
+        `keep` that was just stored
+        """
+        entries = self._sessions[session_id]
+        while self.session_nbytes(session_id) > self.session_budget:
+            victim = next((key for key in entries if key != keep), None)
+            if victim is None:
+                break
+            self._release(entries.pop(victim))
+
+        while self.total_nbytes() > self.total_budget:
+            candidates = [
+                (entry[2], sid, key)
+                for sid, sid_entries in self._sessions.items()
+                for key, entry in sid_entries.items()
+                if (sid, key) != (session_id, keep)
+            ]
+            if not candidates:
+                break
+            _, sid, key = min(candidates)
+            self._release(self._sessions[sid].pop(key))
+
+
+store = SessionStore()
+
+
+def session_vasp(
+    session_id: Optional[str], vasp_xml: str, kpoint_file: str
+) -> VaspParser:
+    return store.get(
+        session_id,
+        ("vasp",) + file_key(vasp_xml, kpoint_file),
+        lambda: load_vasp(vasp_xml, kpoint_file),
+    )
+
+
+def session_proj(session_id: Optional[str], procar: str, vasp_xml: str) -> ProjArrays:
+    return store.get(
+        session_id,
+        ("proj",) + file_key(procar, vasp_xml),
+        lambda: load_proj(procar, vasp_xml),
+    )
+
+
+def session_wann(
+    session_id: Optional[str], bandfile: str, vasp_xml: Optional[str] = None
+) -> WannParser:
+    return store.get(
+        session_id,
+        ("wann",) + file_key(bandfile, vasp_xml),
+        lambda: load_wann(bandfile, vasp_xml=vasp_xml),
+    )
+
+
+def session_tb(session_id: Optional[str], tb_file: str) -> TBModel:
+    return store.get(session_id, ("tb",) + file_key(tb_file), lambda: load_tb(tb_file))
+
+
+def session_layers(session_id: Optional[str], layers: list[dict]) -> list[dict]:
+    """
+    Parsed files of the layers, see `load_layers`
+    """
+    paths = [
+        layer.get(kind) for layer in layers for kind in ("vasp", "kpoints", "wann")
+    ]
+    return store.get(
+        session_id, ("layers",) + file_key(*paths), lambda: load_layers(layers)
+    )
+
+
+def session_tb_bands(
+    session_id: Optional[str],
+    tb_file: str,
+    vasp_xml: str,
+    kpoint_file: str,
+    density: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Distances along the DFT path with `density` points per k-point interval and the
+    tight-binding bands on them relative to the VASP Fermi level
+    """
+
+    def loader():
+        vasp = session_vasp(session_id, vasp_xml, kpoint_file)
+        kpoints, kpath = densify(vasp.kpoints, vasp.kpath, density)
+        return kpath, session_tb(session_id, tb_file).eigenvalues(kpoints) - vasp.efermi
+
+    key = ("tb_bands",) + file_key(tb_file, vasp_xml, kpoint_file) + (density,)
+    return store.get(session_id, key, loader)
+
+
+def session_tb_plane(
+    session_id: Optional[str],
+    tb_file: str,
+    plane: str,
+    offset: float,
+    resolution: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Tight-binding bands on a k-plane, see `TBModel.plane_eigenvalues`
+    """
+    key = ("tb_plane",) + file_key(tb_file) + (plane, float(offset), resolution)
+    return store.get(
+        session_id,
+        key,
+        lambda: session_tb(session_id, tb_file).plane_eigenvalues(
+            *plane_vectors(plane, offset), resolution
+        ),
+    )
+
+
+def session_weights(
+    session_id: Optional[str],
+    procar: str,
+    vasp_xml: str,
+    ispin: list[int],
+    atoms: list[int],
+    orbitals: list[int],
+) -> np.ndarray:
+    """
+    Projected weights of a selection, see `ProjParser.project`
+    """
+    key = ("weights",) + file_key(procar, vasp_xml)
+    key += (tuple(ispin), tuple(sorted(atoms)), tuple(sorted(orbitals)))
+    return store.get(
+        session_id,
+        key,
+        lambda: session_proj(session_id, procar, vasp_xml).project(
+            ispin, atoms, orbitals
+        ),
+    )
+
+
+def session_group_weights(
+    session_id: Optional[str],
+    procar: str,
+    vasp_xml: str,
+    groups: list[tuple[list[int], list[int]]],
+) -> np.ndarray:
+    """
+    Weights of several projection groups, see `ProjParser.project_groups`
+    """
+    key = ("groups",) + file_key(procar, vasp_xml)
+    key += tuple((tuple(sorted(atoms)), tuple(sorted(orbs))) for atoms, orbs in groups)
+    return store.get(
+        session_id,
+        key,
+        lambda: session_proj(session_id, procar, vasp_xml).project_groups(groups),
+    )
+
+
+def session_composition(session_id: Optional[str], procar: str, vasp_xml: str) -> dict:
+    """
+    Species and shell character of every band, see `ProjArrays.composition`
+    """
+    return store.get(
+        session_id,
+        ("composition",) + file_key(procar, vasp_xml),
+        lambda: session_proj(session_id, procar, vasp_xml).composition(),
+    )
+
+
+def session_band_edges(
+    session_id: Optional[str], vasp_xml: str, kpoint_file: str
+) -> dict:
+    """
+    Gaps, Fermi level crossings and effective masses of the DFT bands, see
+    `analytics.analyze`
+    """
+
+    def loader():
+        vasp = session_vasp(session_id, vasp_xml, kpoint_file)
+        channels = {"up": vasp.bands_up}
+        if vasp.is_spin_polarized:
+            channels["down"] = vasp.bands_down
+        return analyze(vasp.kpath, channels)
+
+    return store.get(
+        session_id, ("band_edges",) + file_key(vasp_xml, kpoint_file), loader
+    )
+
+
+def session_wann_band_edges(
+    session_id: Optional[str], bandfile: str, vasp_xml: str
+) -> dict:
+    """
+    Gaps, Fermi level crossings and effective masses of the Wannier bands relative to
+    the VASP Fermi level
+    """
+
+    def loader():
+        wann = session_wann(session_id, bandfile, vasp_xml=vasp_xml)
+        return analyze(wann.kpath, {"up": wann.bands})
+
+    return store.get(
+        session_id, ("wann_band_edges",) + file_key(bandfile, vasp_xml), loader
+    )
+
+
+def session_vasprun_dos(session_id: Optional[str], vasp_xml: str) -> Optional[dict]:
+    """
+    DOS written by VASP, see `read_vasprun_dos`
+    """
+    return store.get(
+        session_id,
+        ("vasprun_dos",) + file_key(vasp_xml),
+        lambda: (
+            None
+            if is_eigenval(vasp_xml) or is_vaspout(vasp_xml)
+            else read_vasprun_dos(vasp_xml)
+        ),
+    )
+
+
+def session_dos_histograms(
+    session_id: Optional[str], procar: str, vasp_xml: str, grid: np.ndarray
+) -> np.ndarray:
+    """
+    Binned weights of every atom and orbital, see `projected_histograms`
+    """
+    key = ("dos_histograms",) + file_key(procar, vasp_xml)
+    key += (float(grid[0]), float(grid[1] - grid[0]), len(grid))
+    return store.get(
+        session_id,
+        key,
+        lambda: projected_histograms(session_proj(session_id, procar, vasp_xml), grid),
+    )
+
+
+def session_spin_texture(
+    session_id: Optional[str],
+    procar: str,
+    vasp_xml: str,
+    atoms: list[int],
+    orbitals: list[int],
+) -> np.ndarray:
+    """
+    Sx, Sy, Sz of a selection, see `ProjParser.spin_texture`
+    """
+    key = ("spin_texture",) + file_key(procar, vasp_xml)
+    key += (tuple(sorted(atoms)), tuple(sorted(orbitals)))
+    return store.get(
+        session_id,
+        key,
+        lambda: session_proj(session_id, procar, vasp_xml).spin_texture(
+            atoms, orbitals
+        ),
+    )
+
+
+def session_band_order(
+    session_id: Optional[str], procar: str, vasp_xml: str, groups: list[list[int]]
+) -> np.ndarray:
+    """
+    Band order connected by orbital character, see `ProjArrays.band_order`
+    """
+    key = ("band_order",) + file_key(procar, vasp_xml)
+    key += (tuple(tuple(group) for group in groups),)
+    return store.get(
+        session_id,
+        key,
+        lambda: session_proj(session_id, procar, vasp_xml).band_order(groups),
+    )
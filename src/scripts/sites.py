@@ -0,0 +1,115 @@
+"""
+Site-resolved atom selections of a structure, e.g. the atoms around a defect of a
+large supercell.
+
+A selection is a comma separated list of
+    7        site 7 (sites are numbered from 1 in the order of vasprun.xml)
+    3-10     sites 3 to 10 (10-3 is the same range)
+    O        all O atoms
+    Fe2      the second Fe atom
+    12@2.5   all sites within 2.5 Å of site 12 (or Fe2@2.5), periodic images included
+and is resolved to a sorted array of atom indices, which the projections use as is.
+The species and site label maps are built once per structure, so resolving a
+selection never loops over the atoms in Python.
+"""
+
+import itertools
+import re
+
+import numpy as np
+
+from .utils import group_by_species
+
+# lattice translations of the neighbouring cells, for minimum image distances
+_IMAGES = np.array(list(itertools.product((-1, 0, 1), repeat=3)))
+
+
+class Sites:
+    def __init__(self, atoms: list[str], lattice: np.ndarray, positions: np.ndarray):
+        """
+        atoms: species of every site, lattice: lattice vectors (rows, Å),
+        positions: fractional coordinates (nsites, 3)
+        """
+        self.atoms = atoms
+        self.lattice = np.asarray(lattice, dtype=float)
+        self.positions = np.asarray(positions, dtype=float)
+        self.species: dict[str, np.ndarray] = {
+            name: np.array(indices) for name, indices in group_by_species(atoms).items()
+        }
+        self.labels: dict[str, int] = {
+            "{}{}".format(name, number + 1): int(index)
+            for name, indices in self.species.items()
+            for number, index in enumerate(indices)
+        }
+
+    def __len__(self) -> int:
+        return len(self.atoms)
+
+    def species_indices(self, names: list[str]) -> np.ndarray:
+        """
+        Indices of all atoms of the given species
+        """
+        arrays = [self.species[name] for name in names if name in self.species]
+        if not arrays:
+            return np.zeros(0, dtype=int)
+        return np.sort(np.concatenate(arrays))
+
+    def site(self, token: str) -> int:
+        """
+        Index of a site given by its number (from 1) or label (e.g. Fe2)
+        """
+        token = token.strip()
+        if token.isdigit():
+            number = int(token)
+            if not 1 <= number <= len(self):
+                raise ValueError("No site {} (1-{})".format(number, len(self)))
+            return number - 1
+        if token in self.labels:
+            return self.labels[token]
+        raise ValueError("Unknown site {}".format(token))
+
+    def within(self, site: int, radius: float) -> np.ndarray:
+        """
+        Indices of the sites closer than `radius` (Å) to `site`, itself included
+        """
+        diff = self.positions - self.positions[site]
+        diff -= np.round(diff)
+        cartesian = (diff[:, None, :] + _IMAGES[None]) @ self.lattice
+        distances = np.linalg.norm(cartesian, axis=2).min(axis=1)
+        return np.flatnonzero(distances <= radius)
+
+    def select(self, text: str) -> np.ndarray:
+        """
+        Sorted atom indices of a selection, see the module docstring. Raises
+        ValueError for an invalid selection.
+        """
+        arrays = []
+        for token in text.split(","):
+            token = token.strip()
+            if not token:
+                continue
+            if "@" in token:
+                site, _, radius = token.partition("@")
+                try:
+                    radius = float(radius)
+                except ValueError:
+                    raise ValueError("Invalid distance in {}".format(token))
+                arrays.append(self.within(self.site(site), radius))
+            elif re.fullmatch(r"\d+\s*-\s*\d+", token):
+                first, last = sorted(self.site(part) for part in token.split("-"))
+                arrays.append(np.arange(first, last + 1))
+            elif token in self.species:
+                arrays.append(self.species[token])
+            else:
+                arrays.append(np.array([self.site(token)]))
+        if not arrays:
+            return np.zeros(0, dtype=int)
+        return np.unique(np.concatenate(arrays))
+
+    def describe(self, indices: np.ndarray) -> str:
+        """
+        Number of sites of every species in a selection, e.g. "4 sites: Fe 1, O 3"
+        """
+        names, counts = np.unique(np.array(self.atoms)[indices], return_counts=True)
+        parts = ["{} {}".format(name, count) for name, count in zip(names, counts)]
+        return "{} sites: {}".format(len(indices), ", ".join(parts))
@@ -0,0 +1,79 @@
+"""
+Report the import time and resident memory of the app and of its heavy dependencies.
+
+Run from the src directory:
+    python -m scripts.startup [--json]
+"""
+
+import argparse
+import importlib
+import json
+import os
+import time
+
+
+def rss_mb() -> float:
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        import resource
+
+        # peak rather than current RSS, in KB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(stage: str, func) -> dict:
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    rss_after = rss_mb()
+    return {
+        "stage": stage,
+        "seconds": seconds,
+        "rss_mb": rss_after,
+        "delta_mb": rss_after - rss_before,
+    }
+
+
+def profile_startup() -> list[dict]:
+    """
+    Import the app with lazy imports, then each heavy module in turn
+    """
+    # measure the lazy app even when the environment asks for preloading
+    os.environ["WANN_APP_PRELOAD"] = "0"
+    stages = [_measure("app", lambda: importlib.import_module("app"))]
+
+    from .parser import HEAVY_MODULES
+
+    for name in HEAVY_MODULES:
+        stages.append(_measure(name, lambda name=name: importlib.import_module(name)))
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args(argv)
+
+    stages = profile_startup()
+    if args.json:
+        print(json.dumps(stages, indent=2))
+        return
+
+    print(
+        "{:40s} {:>10s} {:>10s} {:>10s}".format(
+            "stage", "time (s)", "RSS (MB)", "+RSS (MB)"
+        )
+    )
+    for row in stages:
+        print(
+            "{stage:40s} {seconds:10.3f} {rss_mb:10.1f} {delta_mb:10.1f}".format(**row)
+        )
+    print("{:40s} {:10.3f}".format("total", sum(row["seconds"] for row in stages)))
+
+
+if __name__ == "__main__":
+    main()
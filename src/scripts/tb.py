@@ -0,0 +1,324 @@
+"""
+Wannier bands interpolated in the app from the tight-binding model written by
+Wannier90 (seedname_hr.dat, or seedname_tb.dat with write_tb = .true.).
+
+The hoppings are read once into dense arrays H(R) of shape (nrpts, num_wann,
+num_wann), already divided by the degeneracy of their R-vector, and kept in a binary
+cache next to the calculation index so that reopening a model skips the text parser.
+H(k) = sum_R exp(2 pi i k.R) H(R) of all k-points is a single matrix product of the
+phases (nk, nrpts) with the flattened hoppings, and the Hamiltonians are
+diagonalized by batched `eigvalsh` in chunks of bounded memory. For large models and
+k-planes the chunks are spread over threads, LAPACK releases the GIL.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+
+from .config import TB_CACHE_DIR, TB_CHUNK_BYTES, TB_PARALLEL_NWANN, TB_WORKERS
+from .metrics import observe, observe_file, timer
+from .parser import ParseTBError
+
+TB_SUFFIXES = ("_hr.dat", "_tb.dat")
+
+
+def _read_header(f, skip: int) -> tuple[int, int, np.ndarray]:
+    """
+    num_wann, nrpts and the degeneracies of the R-vectors (15 per line), after
+    `skip` header lines
+    """
+    for _ in range(skip):
+        f.readline()
+    num_wann = int(f.readline())
+    nrpts = int(f.readline())
+    degeneracies: list[str] = []
+    while len(degeneracies) < nrpts:
+        line = f.readline()
+        if not line:
+            raise ValueError("missing degeneracies")
+        degeneracies += line.split()
+    return num_wann, nrpts, np.array(degeneracies, dtype=float)
+
+
+def _hoppings(
+    values: np.ndarray, num_wann: int, nrpts: int, degeneracies: np.ndarray
+) -> np.ndarray:
+    """
+    Dense H(R) from rows m, n, Re, Im of every R-vector, values (nrpts, nw^2, 4)
+    """
+    m = values[0, :, 0].astype(int) - 1
+    n = values[0, :, 1].astype(int) - 1
+    hoppings = np.zeros((nrpts, num_wann, num_wann), dtype=complex)
+    hoppings[:, m, n] = values[:, :, 2] + 1j * values[:, :, 3]
+    hoppings /= degeneracies[:, np.newaxis, np.newaxis]
+    return hoppings
+
+
+def read_hr(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    R-vectors (nrpts, 3) and hoppings (nrpts, num_wann, num_wann) of seedname_hr.dat
+    """
+    with open(path) as f:
+        num_wann, nrpts, degeneracies = _read_header(f, skip=1)
+        # R1 R2 R3 m n Re Im, m running fastest
+        values = np.fromstring(f.read(), sep=" ")
+    values = values[: nrpts * num_wann**2 * 7].reshape(nrpts, num_wann**2, 7)
+    rvecs = values[:, 0, :3].astype(int)
+    return rvecs, _hoppings(values[:, :, 3:], num_wann, nrpts, degeneracies)
+
+
+def read_tb(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    R-vectors and hoppings of seedname_tb.dat, the position matrix elements that
+    follow the hoppings are not read
+    """
+    with open(path) as f:
+        # title and lattice vectors
+        num_wann, nrpts, degeneracies = _read_header(f, skip=4)
+        # blocks of R1 R2 R3 followed by num_wann^2 rows m n Re Im
+        block = 3 + 4 * num_wann**2
+        values = np.fromstring(f.read(), sep=" ")[: nrpts * block]
+    values = values.reshape(nrpts, block)
+    rvecs = values[:, :3].astype(int)
+    rows = values[:, 3:].reshape(nrpts, num_wann**2, 4)
+    return rvecs, _hoppings(rows, num_wann, nrpts, degeneracies)
+
+
+class TBModel:
+    """
+    Wannier tight-binding Hamiltonian, rvecs (nrpts, 3) in lattice vectors and
+    hoppings (nrpts, num_wann, num_wann) in eV divided by the R degeneracies
+    """
+
+    def __init__(self, rvecs: np.ndarray, hoppings: np.ndarray):
+        self.rvecs = rvecs
+        self.hoppings = hoppings
+        self._lower: Optional[np.ndarray] = None
+
+    @property
+    def num_wann(self) -> int:
+        return self.hoppings.shape[1]
+
+    def hamiltonian(self, kpoints: np.ndarray) -> np.ndarray:
+        """
+        H(k) of fractional k-points (nk, 3), shape (nk, num_wann, num_wann)
+        """
+        phases = np.exp(2j * np.pi * (kpoints @ self.rvecs.T))
+        flat = self.hoppings.reshape(len(self.rvecs), -1)
+        return (phases @ flat).reshape(len(kpoints), self.num_wann, self.num_wann)
+
+    def _lower_hoppings(self) -> np.ndarray:
+        # eigvalsh only reads the lower triangle, so only that half of the Fourier
+        # sums is computed
+        if self._lower is None:
+            rows, cols = np.tril_indices(self.num_wann)
+            self._lower = np.ascontiguousarray(self.hoppings[:, rows, cols])
+        return self._lower
+
+    def _diagonalize(self, lower: np.ndarray) -> np.ndarray:
+        """
+        Eigenvalues of the Hamiltonians given by their lower triangles (n, nw(nw+1)/2)
+        """
+        rows, cols = np.tril_indices(self.num_wann)
+        h = np.zeros((len(lower), self.num_wann, self.num_wann), dtype=complex)
+        h[:, rows, cols] = lower
+        return np.linalg.eigvalsh(h)
+
+    def _map(
+        self, solve: Callable, items: np.ndarray, row_bytes: int, parallel: bool
+    ) -> list:
+        """
+        `solve` applied to chunks of `items` of at most TB_CHUNK_BYTES of H(k), in
+        TB_WORKERS threads if `parallel`
+        """
+        chunk = max(TB_CHUNK_BYTES // row_bytes, 1)
+        parallel = parallel and TB_WORKERS > 1
+        if parallel:
+            chunk = min(chunk, -(-len(items) // TB_WORKERS))
+        chunks = [items[start : start + chunk] for start in range(0, len(items), chunk)]
+        if parallel and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=TB_WORKERS) as pool:
+                return list(pool.map(solve, chunks))
+        return [solve(part) for part in chunks]
+
+    def _path_eigenvalues(self, kpoints: np.ndarray) -> np.ndarray:
+        phases = np.exp(2j * np.pi * (kpoints @ self.rvecs.T))
+        return self._diagonalize(phases @ self._lower_hoppings())
+
+    def eigenvalues(self, kpoints: np.ndarray) -> np.ndarray:
+        """
+        Band energies (nk, num_wann) in eV, sorted at every k-point
+        """
+        with timer("wann_app_parser_seconds", stage="tb_eigenvalues"):
+            parts = self._map(
+                self._path_eigenvalues,
+                kpoints,
+                16 * self.num_wann**2,
+                parallel=self.num_wann >= TB_PARALLEL_NWANN,
+            )
+        return np.concatenate(parts) if parts else np.empty((0, self.num_wann))
+
+    def plane_eigenvalues(
+        self, origin: np.ndarray, v1: np.ndarray, v2: np.ndarray, resolution: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Band energies on the k-points origin + u v1 + v v2 (fractional) for
+        `resolution` values of u and of v in [-0.5, 0.5). Returns the values of u
+        (= of v) and the energies (resolution, resolution, num_wann), u first.
+
+        The Fourier sum is separable on such a grid: with a = R.v1 and b = R.v2,
+        H(u, v) = sum_a exp(2 pi i u a) sum_b exp(2 pi i v b) C(a, b), where C(a, b)
+        sums exp(2 pi i R.origin) H(R) over the R-vectors of (a, b). For planes
+        spanned by reciprocal lattice vectors a and b take a few integer values, so
+        the sums cost a small fraction of the direct one over all R-vectors.
+        """
+        grid = np.arange(resolution) / resolution - 0.5
+        lower = self._lower_hoppings()
+        a_values, a_index = np.unique(np.round(self.rvecs @ v1, 8), return_inverse=True)
+        b_values, b_index = np.unique(np.round(self.rvecs @ v2, 8), return_inverse=True)
+        shifted = lower * np.exp(2j * np.pi * (self.rvecs @ origin))[:, np.newaxis]
+        c = np.zeros((len(a_values), len(b_values), lower.shape[1]), dtype=complex)
+        np.add.at(c, (a_index.ravel(), b_index.ravel()), shifted)
+        # (na, nv, nw(nw+1)/2)
+        d = np.exp(2j * np.pi * np.outer(grid, b_values)) @ c
+        d = d.reshape(len(a_values), -1)
+
+        def solve(us: np.ndarray) -> np.ndarray:
+            h = np.exp(2j * np.pi * np.outer(us, a_values)) @ d
+            energies = self._diagonalize(h.reshape(-1, lower.shape[1]))
+            return energies.reshape(len(us), resolution, self.num_wann)
+
+        with timer("wann_app_parser_seconds", stage="tb_plane"):
+            parts = self._map(
+                solve, grid, 16 * resolution * self.num_wann**2, parallel=True
+            )
+        return grid, np.concatenate(parts)
+
+
+# k-planes spanned by two reciprocal lattice vectors, shifted along the third:
+# indices of the first axis, second axis and shift direction
+PLANES = {"b1-b2": (0, 1, 2), "b2-b3": (1, 2, 0), "b3-b1": (2, 0, 1)}
+
+
+def plane_vectors(plane: str, offset: float = 0.0) -> tuple:
+    """
+    Origin and axes (fractional) of one of PLANES shifted by `offset`
+    """
+    first, second, shift = (np.eye(3)[idx] for idx in PLANES[plane])
+    return offset * shift, first, second
+
+
+def _cache_file(path: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(TB_CACHE_DIR, digest + ".npz")
+
+
+def _read_cache(cache: str, stat: os.stat_result) -> Optional[TBModel]:
+    try:
+        with np.load(cache) as data:
+            if int(data["mtime_ns"]) == stat.st_mtime_ns and int(data["size"]) == (
+                stat.st_size
+            ):
+                return TBModel(data["rvecs"], data["hoppings"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def _write_cache(cache: str, stat: os.stat_result, model: TBModel) -> None:
+    tmp = "{}.{}.tmp".format(cache, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                rvecs=model.rvecs,
+                hoppings=model.hoppings,
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+            )
+        os.replace(tmp, cache)
+    except OSError:
+        # the cache is optional, e.g. on a read-only WORK_DIR
+        pass
+
+
+def read_tb_model(path: str) -> TBModel:
+    """
+    Model of seedname_hr.dat or seedname_tb.dat, from the binary cache if the file
+    did not change since it was last parsed
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise ParseTBError
+    cache = _cache_file(path)
+    model = _read_cache(cache, stat)
+    if model is not None:
+        return model
+
+    observe_file(path, parser="tb")
+    reader = read_tb if path.endswith("_tb.dat") else read_hr
+    try:
+        with timer("wann_app_parser_seconds", stage="tb"):
+            model = TBModel(*reader(path))
+    except Exception:
+        raise ParseTBError
+    observe("wann_app_parser_array_bytes", model.hoppings.nbytes, parser="tb")
+    _write_cache(cache, stat, model)
+    return model
+
+
+def is_tb_file(path: Optional[str]) -> bool:
+    return bool(path) and path.endswith(TB_SUFFIXES)
+
+
+def find_tb_file(path: Optional[str]) -> Optional[str]:
+    """
+    The tight-binding file given as `path`, or the one of the same seedname next to
+    seedname_band.dat, None if there is none
+    """
+    if is_tb_file(path):
+        return path
+    if not path or not path.endswith("_band.dat"):
+        return None
+    seed = path[: -len("_band.dat")]
+    for suffix in TB_SUFFIXES:
+        if os.path.isfile(seed + suffix):
+            return seed + suffix
+    return None
+
+
+def densify(
+    kpoints: np.ndarray, kpath: np.ndarray, density: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Path with `density - 1` points inserted in every interval of the DFT k-points,
+    fractional k-points and their distances along the plot axis. Intervals of zero
+    length, i.e. the jumps between disconnected branches, are left as they are.
+    """
+    density = max(int(density or 1), 1)
+    if density == 1 or len(kpoints) < 2:
+        return kpoints, kpath
+    t = np.arange(density) / density
+    steps = np.diff(kpath) > 0
+    starts = np.flatnonzero(steps)
+    # points of the intervals with length > 0, then every original k-point
+    new_k = (
+        kpoints[starts, np.newaxis]
+        + t[1:, np.newaxis] * (kpoints[starts + 1] - kpoints[starts])[:, np.newaxis]
+    )
+    new_x = (
+        kpath[starts, np.newaxis]
+        + t[1:] * (kpath[starts + 1] - kpath[starts])[:, np.newaxis]
+    )
+    # position of every point: originals at i * density, inserted right after theirs
+    index = np.arange(len(kpoints)) * density
+    inserted = (index[starts, np.newaxis] + np.arange(1, density)).ravel()
+    order = np.argsort(np.concatenate([index, inserted]), kind="stable")
+    all_k = np.concatenate([kpoints, new_k.reshape(-1, 3)])[order]
+    all_x = np.concatenate([kpath, new_x.ravel()])[order]
+    return all_k, all_x
@@ -1,8 +1,15 @@
 import os
+import re
 import sys
+import threading
+from collections import OrderedDict
+from fnmatch import fnmatch
 from functools import wraps
+from typing import Optional
 
-from .config import WORK_DIR
+from .config import (COMPLETION_CACHE_SIZE, COMPLETION_LIMIT, RELEVANT_FILES,
+                     WORK_DIR)
+from .metrics import inc
 
 
 class StdoutNull:
@@ -32,46 +39,123 @@ def block_stdout(func):
     return wrapper
 
 
-def generate_path_completions(path):
+_dir_cache: OrderedDict = OrderedDict()
+_dir_cache_lock = threading.Lock()
+
+
+def _list_dir(abs_path: str) -> list[tuple[str, bool]]:
+    """
+    List the non-hidden entries of a directory as (name, is_dir), directories first.
+    Listings are cached per directory and reused until its mtime changes.
+    """
+    mtime = os.stat(abs_path).st_mtime_ns
+    with _dir_cache_lock:
+        cached = _dir_cache.get(abs_path)
+        if cached and cached[0] == mtime:
+            _dir_cache.move_to_end(abs_path)
+            inc("wann_app_cache_requests_total", cache="completion", result="hit")
+            return cached[1]
+    inc("wann_app_cache_requests_total", cache="completion", result="miss")
+
+    with os.scandir(abs_path) as it:
+        entries = [(e.name, e.is_dir()) for e in it if not e.name.startswith(".")]
+    entries.sort(key=lambda entry: (not entry[1], entry[0]))
+
+    with _dir_cache_lock:
+        _dir_cache[abs_path] = (mtime, entries)
+        while len(_dir_cache) > COMPLETION_CACHE_SIZE:
+            _dir_cache.popitem(last=False)
+    return entries
+
+
+def generate_path_completions(path, relevant_only=False, limit=COMPLETION_LIMIT):
     """
-    This generates a list of paths for dash dropdown options
+    This generates a list of paths for dash dropdown options.
+    A path that is not a directory completes the last component as a prefix.
     """
     path_completions = []
-    # WORK_DIR = os.path.expanduser("~")
-    abs_path = os.path.join(WORK_DIR, path)
-    if os.path.isdir(abs_path):
-        files_and_dirs = os.listdir(abs_path)
-        dirs_only = [
-            f for f in files_and_dirs if os.path.isdir(os.path.join(abs_path, f))
-        ]
-        files_only = [
-            f for f in files_and_dirs if not os.path.isdir(os.path.join(abs_path, f))
-        ]
-        dirs_only.sort()
-        files_only.sort()
-        files_and_dirs = dirs_only + files_only
-        files_and_dirs_no_hidden = [f for f in files_and_dirs if not f.startswith(".")]
-        for item in files_and_dirs_no_hidden:
-            item_path = os.path.join(path, item)
-            abs_item_path = os.path.join(WORK_DIR, item_path)
-            if os.path.isdir(abs_item_path):
-                path_completions.append(
-                    {
-                        "label": "📁" + item + "/",
-                        "value": item_path + "/",
-                    }
-                )
-            else:
-                path_completions.append({"label": "📄" + item, "value": item_path})
+    if os.path.isdir(os.path.join(WORK_DIR, path)):
+        directory, prefix = path, ""
+    else:
+        directory, prefix = os.path.split(path)
+    try:
+        entries = _list_dir(os.path.join(WORK_DIR, directory))
+    except OSError:
+        return path_completions
+
+    num_matches = 0
+    for item, is_dir in entries:
+        if not item.startswith(prefix):
+            continue
+        if relevant_only and not is_dir:
+            if not any(fnmatch(item, pattern) for pattern in RELEVANT_FILES):
+                continue
+        num_matches += 1
+        if num_matches > limit:
+            continue
+        item_path = os.path.join(directory, item)
+        if is_dir:
+            path_completions.append(
+                {
+                    "label": "📁" + item + "/",
+                    "value": item_path + "/",
+                }
+            )
+        else:
+            path_completions.append({"label": "📄" + item, "value": item_path})
+
+    if num_matches > limit:
+        path_completions.append(
+            {
+                "label": "... {} more, keep typing".format(num_matches - limit),
+                "value": "",
+                "disabled": True,
+            }
+        )
     return path_completions
 
 
+def search_file_tail(
+    path: str, pattern: bytes, chunk_size: int = 1 << 20, max_bytes: int = 64 << 20
+) -> Optional[re.Match]:
+    """
+    Search a file backwards from its end in chunks and return the last match of a
+    bytes regex, reading at most `max_bytes`. Chunks overlap so that matches
+    spanning a chunk boundary are found.
+    """
+    regex = re.compile(pattern)
+    overlap = 4096
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        stop = max(end - max_bytes, 0)
+        while end > stop:
+            start = max(end - chunk_size, stop)
+            f.seek(start)
+            chunk = f.read(end - start + overlap)
+            matches = list(regex.finditer(chunk))
+            if matches:
+                return matches[-1]
+            end = start
+    return None
+
+
 def find_indices(lst, uniq_val):
     for idx, item in enumerate(lst):
         if item in uniq_val:
             yield idx
 
 
+def group_by_species(atom_list: list[str]) -> dict[str, list[int]]:
+    """
+    Map each species to the indices of its atoms, in order of first appearance
+    """
+    groups = {}
+    for idx, species in enumerate(atom_list):
+        groups.setdefault(species, []).append(idx)
+    return groups
+
+
 def check_yrange_input(value: str):
     error = False
     try:
@@ -0,0 +1,298 @@
+"""
+Bands and projections of vaspout.h5, the HDF5 output of VASP 6.
+
+Eigenvalues, k-points, the Fermi level and the structure are small and read when the
+file is opened. The projections (spin, ion, orbital, k-point, band) are the bulk of
+the file and stay on disk: every projection opens the file again and reads the
+hyperslab of the selected atoms only, and of the bands in an energy window if one is
+given, so a selection costs milliseconds however large the calculation. With
+KPOINTS_OPT the bands and projections of the additional k-points are used, as they
+hold the band structure path.
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+from .kpath import KPath, read_line_mode, reciprocal_lattice
+from .metrics import observe, observe_file, timer
+from .parser import BandArrays, ParseVaspoutError, ProjArrays
+
+VASPOUT = "vaspout.h5"
+EIGENVALUES = "results/electron_eigenvalues{}/eigenvalues"
+KPOINT_COORDS = "results/electron_eigenvalues{}/kpoint_coords"
+PROJECTIONS = "results/projectors{}/par"
+ORBITAL_NAMES = "results/projectors{}/lchar"
+# the copies of KPOINTS and KPOINTS_OPT, by the suffix of their results
+KPOINTS_INPUT = {"": "input/kpoints", "_kpoints_opt": "input/kpoints_opt"}
+EFERMI = "results/electron_dos/efermi"
+POSITIONS = "results/positions"
+# orbitals of LORBIT = 11 in the order of VASP, for files without their names
+ORBITALS = ["s", "py", "pz", "px", "dxy", "dyz", "dz2", "dxz", "x2-y2"]
+ORBITALS += ["fy3x2", "fxyz", "fyz2", "fz3", "fxz2", "fzx2", "fx3"]
+
+
+def is_vaspout(path: str) -> bool:
+    return path.endswith(".h5")
+
+
+def _open(vaspout: str):
+    import h5py
+
+    return h5py.File(vaspout, "r")
+
+
+def _has(vaspout: str, dataset: str) -> bool:
+    try:
+        with _open(vaspout) as f:
+            return dataset.format(_suffix(f)) in f
+    except (ImportError, OSError):
+        return False
+
+
+def find_vaspout(path: str, dataset: str = EIGENVALUES) -> Optional[str]:
+    """
+    vaspout.h5 to read instead of `path` (vasprun.xml, PROCAR, their directory or
+    vaspout.h5 itself) when it holds `dataset`, e.g. PROJECTIONS for PROCAR
+    """
+    if is_vaspout(path):
+        vaspout = path
+    else:
+        directory = path if os.path.isdir(path) else os.path.dirname(path)
+        vaspout = os.path.join(directory, VASPOUT)
+    if not os.path.isfile(vaspout) or not _has(vaspout, dataset):
+        return None
+    return vaspout
+
+
+def _suffix(f) -> str:
+    """
+    Suffix of the datasets holding the band structure: those of KPOINTS_OPT if the
+    run has them
+    """
+    if "results/electron_eigenvalues_kpoints_opt" in f:
+        return "_kpoints_opt"
+    return ""
+
+
+def _strings(dataset) -> list[str]:
+    return [
+        value.decode().strip() if isinstance(value, bytes) else str(value).strip()
+        for value in np.ravel(dataset[()])
+    ]
+
+
+def _structure(f) -> dict:
+    """
+    Atomic symbols, lattice vectors (rows, Angstrom) and fractional positions
+    """
+    group = f[POSITIONS]
+    names = _strings(group["ion_types"])
+    counts = np.ravel(group["number_ion_types"][()])
+    lattice = np.array(group["lattice_vectors"], dtype=float)
+    positions = np.array(group["position_ions"], dtype=float)
+    if lattice.ndim == 3:
+        # a trajectory, the last step is the structure of the bands
+        lattice, positions = lattice[-1], positions[-1]
+    if "scale" in group:
+        lattice *= float(np.ravel(group["scale"][()])[0])
+    return {
+        "atoms": [name for name, count in zip(names, counts) for _ in range(count)],
+        "lattice": lattice,
+        "positions": positions,
+    }
+
+
+def _line_mode(f, suffix: str) -> Optional[tuple[int, list[str]]]:
+    """
+    Points per segment and labels of the segment ends of a line-mode KPOINTS, as
+    VASP copies it to the file
+    """
+    name = KPOINTS_INPUT[suffix]
+    if name not in f or "mode" not in f[name]:
+        return None
+    group = f[name]
+    if not _strings(group["mode"])[0].lower().startswith("l"):
+        return None
+    labels = [""] * len(group["coordinates_kpoints"])
+    if "labels_kpoints" in group:
+        positions = np.ravel(group["positions_labels_kpoints"][()])
+        for label, position in zip(_strings(group["labels_kpoints"]), positions):
+            labels[int(position) - 1] = label
+    return int(np.ravel(group["number_kpoints"][()])[0]), labels
+
+
+def read_vaspout_efermi(vaspout: str) -> float:
+    with _open(vaspout) as f:
+        return float(np.ravel(f[EFERMI][()])[0])
+
+
+def read_vaspout_structure(vaspout: str) -> dict:
+    with _open(vaspout) as f:
+        return _structure(f)
+
+
+class VaspoutParser(BandArrays):
+    """
+    Bands of vaspout.h5. The k-path takes its segments and labels from the KPOINTS
+    given, otherwise from the copy of KPOINTS in the file.
+    """
+
+    def __init__(self, vaspout: str, kpoint_file: Optional[str] = None):
+        try:
+            observe_file(vaspout, parser="vaspout")
+            with timer("wann_app_parser_seconds", stage="vaspout"), _open(vaspout) as f:
+                suffix = _suffix(f)
+                energies = f[EIGENVALUES.format(suffix)][()]
+                kpoints = f[KPOINT_COORDS.format(suffix)][()]
+                efermi = float(np.ravel(f[EFERMI][()])[0])
+                structure = _structure(f)
+                line_mode = read_line_mode(kpoint_file) if kpoint_file else None
+                line_mode = line_mode or _line_mode(f, suffix)
+            observe("wann_app_parser_array_bytes", energies.nbytes, parser="vaspout")
+        except Exception:
+            raise ParseVaspoutError
+        path = KPath(
+            kpoints,
+            reciprocal_lattice(structure["lattice"]),
+            *(line_mode or (None, None))
+        )
+        super().__init__(kpoints, energies, efermi, structure["atoms"], path)
+
+
+class VaspoutProjParser(ProjArrays):
+    """
+    Projections of vaspout.h5 as arrays (see ProjArrays), read lazily: the
+    methods taking a selection read the slices of the selected atoms only, those
+    needing every weight (band character, DOS) read the spin density once.
+    """
+
+    def __init__(self, vaspout: str, vasp_xml: str, efermi: Optional[float] = None):
+        try:
+            observe_file(vaspout, parser="vaspout")
+            with timer("wann_app_parser_seconds", stage="vaspout_proj"), _open(
+                vaspout
+            ) as f:
+                suffix = _suffix(f)
+                energies = f[EIGENVALUES.format(suffix)][()]
+                kpoints = f[KPOINT_COORDS.format(suffix)][()]
+                self._projections = PROJECTIONS.format(suffix)
+                self._shape = f[self._projections].shape
+                names = ORBITAL_NAMES.format(suffix)
+                orbitals = (
+                    _strings(f[names]) if names in f else ORBITALS[: self._shape[2]]
+                )
+                if efermi is None:
+                    efermi = float(np.ravel(f[EFERMI][()])[0])
+                structure = _structure(f)
+        except Exception:
+            raise ParseVaspoutError
+        self._orbital_weights: Optional[np.ndarray] = None
+        # the spin channels side by side as in pyprocar, see `spin_blocks`
+        super().__init__(
+            vaspout,
+            vasp_xml,
+            np.hstack(list(energies)),
+            kpoints,
+            efermi,
+            orbitals,
+            self._shape[1],
+            structure,
+        )
+
+    @property
+    def is_spin_polarized(self):
+        return self._shape[0] == 2
+
+    @property
+    def is_soc(self) -> bool:
+        return self._shape[0] == 4
+
+    @property
+    def orbital_weights(self) -> np.ndarray:
+        if self._orbital_weights is None:
+            with timer("wann_app_parser_seconds", stage="vaspout_weights"), _open(
+                self.procar
+            ) as f:
+                par = f[self._projections]
+                # the density of every spin block, (nions, norb, nkpts, nbands)
+                blocks = [par[index] for index in range(len(self.spin_blocks))]
+            weights = np.concatenate(blocks, axis=-1).transpose(2, 3, 0, 1)
+            observe("wann_app_parser_array_bytes", weights.nbytes, parser="vaspout")
+            self._orbital_weights = weights
+        return self._orbital_weights
+
+    def _spins(self, ispin: list[int], block: int) -> list[tuple[int, float]]:
+        """
+        Spin index in the file and sign of every PROCAR spin channel of `ispin` in
+        spin block `block`: for ISPIN=2 channel 0 is the density and channel 1 the
+        magnetization, as pyprocar returns them
+        """
+        if self.is_spin_polarized:
+            return [
+                (block, -1.0 if channel == block == 1 else 1.0) for channel in ispin
+            ]
+        return [(channel, 1.0) for channel in ispin]
+
+    def _read(
+        self,
+        ispin: list[int],
+        groups: list[tuple[list[int], list[int]]],
+        window: Optional[tuple[float, float]],
+    ) -> np.ndarray:
+        """
+        Weights of (atoms, orbitals) groups of shape (len(groups), nkpts, nbands),
+        reading the atoms of all groups together and only the bands of `window`
+        """
+        weights = np.zeros((len(groups),) + self._bands.shape)
+        atoms = sorted({atom for group_atoms, _ in groups for atom in group_atoms})
+        if not atoms:
+            return weights
+        masks = np.zeros((len(groups), len(atoms), self._shape[2]))
+        for mask, (group_atoms, orbs) in zip(masks, groups):
+            rows = np.searchsorted(atoms, group_atoms)
+            mask[np.ix_(rows, np.asarray(orbs, dtype=int))] = 1
+        # h5py reads a list of indices as one selection, a slice is faster still
+        selection = slice(None) if len(atoms) == self.num_ions else atoms
+
+        with _open(self.procar) as f:
+            par = f[self._projections]
+            blocks = zip(self.spin_blocks, self.window_blocks(window))
+            for index, (block, bands) in enumerate(blocks):
+                if bands.start == bands.stop:
+                    continue
+                local = slice(bands.start - block.start, bands.stop - block.start)
+                for spin, sign in self._spins(ispin, index):
+                    data = par[spin, selection, :, :, local]
+                    weights[:, :, bands] += sign * np.einsum(
+                        "aokb,gao->gkb", data, masks, optimize=True
+                    )
+        return weights
+
+    def project(
+        self,
+        ispin: list[int],
+        atoms: list[int],
+        orbs: list[int],
+        window: Optional[tuple[float, float]] = None,
+    ) -> np.ndarray:
+        with timer("wann_app_parser_seconds", stage="vaspout_project"):
+            return self._read(ispin, [(atoms, orbs)], window)[0]
+
+    def project_groups(
+        self,
+        groups: list[tuple[list[int], list[int]]],
+        ispin: tuple = (0,),
+        window: Optional[tuple[float, float]] = None,
+    ) -> np.ndarray:
+        with timer("wann_app_parser_seconds", stage="vaspout_groups"):
+            return self._read(list(ispin), groups, window)
+
+    def spin_texture(self, atoms: list[int], orbs: list[int]) -> np.ndarray:
+        if not self.is_soc:
+            raise Exception("Not a spin-orbit calculation")
+        with timer("wann_app_parser_seconds", stage="vaspout_spin_texture"):
+            return np.stack(
+                [self._read([spin], [(atoms, orbs)], None)[0] for spin in (1, 2, 3)]
+            )
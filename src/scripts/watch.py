@@ -0,0 +1,173 @@
+"""
+Watch the loaded files for changes, e.g. a wannier90_band.dat rewritten by a rerun.
+
+On Linux the directories of the watched files are followed with inotify (through
+ctypes, no extra dependency), so checking a file that did not change costs a dict
+lookup. inotify does not see changes made on other hosts of a network filesystem,
+so files on NFS and the like, and every file where inotify is unavailable, are
+polled with stat instead.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+from .config import REMOTE_FILESYSTEMS, WATCH_POLL, WATCH_SETTLE
+from .dataset import file_key
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+_EVENT = struct.Struct("iIII")
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """
+    Type of the filesystem holding `path` from /proc/mounts, None if unknown
+    """
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace("\\040", " ")
+                inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+                if inside and len(mount) >= len(best):
+                    best, fstype = mount, fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+class Inotify:
+    """
+    Minimal inotify binding calling `callback(path)` from a daemon thread for every
+    event in a watched directory
+    """
+
+    def __init__(self, callback):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._callback = callback
+        self._directories: dict[int, str] = {}
+        threading.Thread(target=self._run, name="inotify", daemon=True).start()
+
+    def add(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), ctypes.c_uint32(WATCH_MASK)
+        )
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+        self._directories[wd] = directory
+
+    def _run(self) -> None:
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError:
+                return
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                wd, _, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size : offset + _EVENT.size + length]
+                offset += _EVENT.size + length
+                directory = self._directories.get(wd)
+                name = name.rstrip(b"\0")
+                if directory is not None and name:
+                    self._callback(os.path.join(directory, os.fsdecode(name)))
+
+
+class FileWatcher:
+    """
+    Tells whether watched files changed since a given `file_key`, once they are
+    no longer being written
+    """
+
+    def __init__(self, settle: float = WATCH_SETTLE, poll: bool = WATCH_POLL):
+        self.settle = settle
+        self._poll_only = poll
+        self._lock = threading.Lock()
+        # path -> whether it may have changed since it was last checked, always true
+        # for polled files
+        self._dirty: dict[str, bool] = {}
+        self._polled: set[str] = set()
+        self._directories: set[str] = set()
+        self._inotify: Optional[Inotify] = None
+
+    def watch(self, path: str) -> None:
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._dirty:
+                return
+            self._dirty[path] = True
+            if not self._add_inotify(os.path.dirname(path)):
+                self._polled.add(path)
+
+    def _add_inotify(self, directory: str) -> bool:
+        if directory in self._directories:
+            return True
+        if self._poll_only or filesystem_type(directory) in REMOTE_FILESYSTEMS:
+            return False
+        try:
+            if self._inotify is None:
+                self._inotify = Inotify(self._on_event)
+            self._inotify.add(directory)
+        except (OSError, AttributeError, TypeError):
+            # not Linux, or out of inotify watches
+            return False
+        self._directories.add(directory)
+        return True
+
+    def _on_event(self, path: str) -> None:
+        with self._lock:
+            if path in self._dirty:
+                self._dirty[path] = True
+
+    def uses_inotify(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        with self._lock:
+            return path in self._dirty and path not in self._polled
+
+    def changed(self, path: str, key) -> Optional[tuple]:
+        """
+        The current `file_key` of `path` if it differs from `key` (as stored in JSON)
+        and the file was not modified within the last `settle` seconds, else None
+        """
+        self.watch(path)
+        abs_path = os.path.abspath(path)
+        with self._lock:
+            if not self._dirty[abs_path] and abs_path not in self._polled:
+                return None
+            # cleared before the stat so that a write from now on is not missed
+            self._dirty[abs_path] = False
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is None or time.time() - mtime < self.settle:
+            # missing or still being written, check again next time
+            with self._lock:
+                self._dirty[abs_path] = True
+            return None
+        current = file_key(path)
+        if [list(item) for item in current] == [list(item) for item in key]:
+            return None
+        return current
+
+
+watcher = FileWatcher()
@@ -0,0 +1,279 @@
+"""
+Live monitor of a growing wannier90.wout.
+
+A monitor remembers the byte offset it has read up to and only parses what was
+appended since, with regular expressions run over the whole new chunk instead of
+line by line, so following outputs of hundreds of MB stays cheap. The parsed values
+are kept in arrays that grow in place, and the app sends the points added since the
+last poll to the browser as `extendData`.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .config import WOUT_MAX_READ, WOUT_MAX_WARNINGS, WOUT_MONITORS
+from .metrics import observe, timer
+
+# patterns match within one line only, fields are separated by [ \t]+. Patterns of
+# whole lines start with a literal newline rather than ^, which re finds much faster.
+_NUMBER = rb"([-+\d.EeDd*]+)"
+_FIELDS = (rb"[ \t]+" + _NUMBER) * 4
+
+# Iter, Omega_I(i-1), Omega_I(i), Delta (frac.), Time
+DIS_PATTERN = re.compile(rb"\n[ \t]*(\d+)" + _FIELDS + rb"[ \t]+<-- DIS")
+# Iter, Delta Spread, RMS Gradient, Spread (Ang^2), Time
+CONV_PATTERN = re.compile(rb"\n[ \t]*(\d+)" + _FIELDS + rb"[ \t]+<-- CONV")
+# Omega_D, Omega_OD, Omega_total
+SPRD_PATTERN = re.compile(
+    rb"O_D=[ \t]*%s[ \t]+O_OD=[ \t]*%s[ \t]+O_TOT=[ \t]*%s[ \t]+<-- SPRD"
+    % ((_NUMBER,) * 3)
+)
+# WF index, centre x, y, z, spread
+CENTRE_PATTERN = re.compile(
+    rb"WF centre and spread[ \t]+(\d+)[ \t]+"
+    rb"\([ \t]*%s,[ \t]*%s,[ \t]*%s[ \t]*\)[ \t]+%s" % ((_NUMBER,) * 4)
+)
+# closes every printed block of WF centres
+SUM_PATTERN = re.compile(rb"Sum of centres and spreads")
+DONE_PATTERN = re.compile(rb"All done: wannier90 exiting")
+
+
+def _float(value: bytes) -> float:
+    try:
+        return float(value.replace(b"D", b"E").replace(b"d", b"e"))
+    except ValueError:
+        return np.nan
+
+
+def _to_float(rows: list) -> np.ndarray:
+    """
+    Rows of Fortran numbers as an array, fields overflowing their format (****)
+    become nan
+    """
+    if not rows:
+        return np.empty((0, 0))
+    try:
+        values = [float(value) for row in rows for value in row]
+    except ValueError:
+        values = [_float(value) for row in rows for value in row]
+    return np.array(values).reshape(len(rows), -1)
+
+
+class _Series:
+    """
+    Rows of a fixed number of columns in an array that grows by doubling
+    """
+
+    def __init__(self, shape: tuple = ()):
+        self._data = np.empty((64,) + shape)
+        self.size = 0
+
+    def extend(self, rows: np.ndarray) -> None:
+        if not len(rows):
+            return
+        needed = self.size + len(rows)
+        if needed > len(self._data):
+            data = np.empty((max(needed, 2 * len(self._data)),) + self._data.shape[1:])
+            data[: self.size] = self._data[: self.size]
+            self._data = data
+        self._data[self.size : needed] = rows
+        self.size = needed
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[: self.size]
+
+
+class WoutMonitor:
+    """
+    Disentanglement and wannierization progress of one wannier90.wout.
+
+    dis: (n, 5) Iter, Omega_I(i-1), Omega_I(i), Delta (frac.), Time
+    conv: (n, 5) Iter, Delta Spread, RMS Gradient, Spread (Ang^2), Time
+    sprd: (n, 3) Omega_D, Omega_OD, Omega_total of each wannierization step
+    centres: (n, num_wann, 3) and spreads: (n, num_wann) of each printed step, with
+    centre_steps: (n,) the number of wannierization steps before each of them
+    """
+
+    def __init__(self, path: str, max_read: int = WOUT_MAX_READ):
+        self.path = path
+        self.max_read = max_read
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, identity) -> None:
+        # (device, inode), changes when the file is replaced, e.g. by a new run
+        self.identity = identity
+        self.offset = 0
+        self.dis = _Series((5,))
+        self.conv = _Series((5,))
+        self.sprd = _Series((3,))
+        self.centre_steps = _Series()
+        self.warnings: list[str] = []
+        self.finished = False
+        self._centres: Optional[_Series] = None
+        self._spreads: Optional[_Series] = None
+
+    def poll(self) -> bool:
+        """
+        Parse what was appended since the last poll, at most `max_read` bytes.
+        Returns whether anything new was parsed.
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return False
+            identity = (stat.st_dev, stat.st_ino)
+            if identity != self.identity or stat.st_size < self.offset:
+                self._reset(identity)
+            if stat.st_size == self.offset:
+                return False
+
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                chunk = f.read(self.max_read)
+            end = self._complete(chunk)
+            if end == 0:
+                if len(chunk) < self.max_read:
+                    # wait for the rest of the line or block
+                    return False
+                # a block or line longer than max_read
+                end = chunk.rfind(b"\n") + 1 or len(chunk)
+            with timer("wann_app_parser_seconds", stage="wout"):
+                # the line patterns start with the newline ending the previous line
+                self._parse(b"\n" + chunk[:end])
+            observe("wann_app_parser_read_bytes", end, parser="wout")
+            self.offset += end
+            return True
+
+    @staticmethod
+    def _complete(chunk: bytes) -> int:
+        """
+        Length of the complete lines of `chunk`, without a block of WF centres
+        that is still being written
+        """
+        end = chunk.rfind(b"\n") + 1
+        last_sum = chunk.rfind(b"Sum of centres and spreads", 0, end)
+        block = CENTRE_PATTERN.search(chunk, max(last_sum, 0), end)
+        if block is not None:
+            end = chunk.rfind(b"\n", 0, block.start()) + 1
+        return end
+
+    def _parse(self, chunk: bytes) -> None:
+        if b"<-- DIS" in chunk:
+            dis = DIS_PATTERN.findall(chunk)
+            self.dis.extend(_to_float(dis))
+
+        conv_before = self.conv.size
+        conv_positions = []
+        if b"<-- CONV" in chunk:
+            conv = list(CONV_PATTERN.finditer(chunk))
+            conv_positions = [match.start() for match in conv]
+            self.conv.extend(_to_float([match.groups() for match in conv]))
+        if b"<-- SPRD" in chunk:
+            self.sprd.extend(_to_float(SPRD_PATTERN.findall(chunk)))
+
+        # every block of WF centres ends with their sum
+        ends = [match.start() for match in SUM_PATTERN.finditer(chunk)]
+        starts = [0] + [chunk.find(b"\n", end) for end in ends[:-1]]
+        blocks = [
+            CENTRE_PATTERN.findall(chunk, start, end)
+            for start, end in zip(starts, ends)
+        ]
+        steps = conv_before + np.searchsorted(conv_positions, ends).astype(int)
+        for block, step in zip(blocks, steps):
+            if block:
+                self._add_centres(step, block)
+
+        if len(self.warnings) < WOUT_MAX_WARNINGS:
+            self._find_warnings(chunk)
+        if DONE_PATTERN.search(chunk):
+            self.finished = True
+
+    def _find_warnings(self, chunk: bytes) -> None:
+        lower = chunk.lower()
+        position = lower.find(b"warning")
+        while position >= 0 and len(self.warnings) < WOUT_MAX_WARNINGS:
+            start = chunk.rfind(b"\n", 0, position) + 1
+            stop = chunk.find(b"\n", position)
+            stop = len(chunk) if stop < 0 else stop
+            self.warnings.append(chunk[start:stop].decode(errors="replace").strip())
+            position = lower.find(b"warning", stop)
+
+    def _add_centres(self, steps: int, rows: list) -> None:
+        values = _to_float(rows)
+        if self._centres is None:
+            self._centres = _Series((len(values), 3))
+            self._spreads = _Series((len(values),))
+        if len(values) != self._centres.values.shape[1]:
+            # a block missing lines, e.g. after the output was cut off
+            return
+        # WF index, x, y, z, spread
+        self._centres.extend(values[np.newaxis, :, 1:4])
+        self._spreads.extend(values[np.newaxis, :, 4])
+        self.centre_steps.extend(np.array([steps]))
+
+    @property
+    def centres(self) -> np.ndarray:
+        return np.empty((0, 0, 3)) if self._centres is None else self._centres.values
+
+    @property
+    def spreads(self) -> np.ndarray:
+        return np.empty((0, 0)) if self._spreads is None else self._spreads.values
+
+
+# convergence curves, in the order of the traces of `plot.wout_figure`
+CURVES = ["Omega_I", "Omega_total", "Omega_D", "Omega_OD"]
+
+
+def curves(monitor: WoutMonitor, start: Optional[list] = None) -> list[tuple]:
+    """
+    (x, y) of every curve in CURVES from point `start[i]` on, i.e. the points that
+    were not sent yet
+    """
+    dis = monitor.dis.values
+    conv = monitor.conv.values
+    sprd = monitor.sprd.values
+    nsprd = min(len(conv), len(sprd))
+    full = [
+        (dis[:, 0], dis[:, 2]),
+        (conv[:, 0], conv[:, 3]),
+        (conv[:nsprd, 0], sprd[:nsprd, 0]),
+        (conv[:nsprd, 0], sprd[:nsprd, 1]),
+    ]
+    start = start or [0] * len(full)
+    return [(x[first:], y[first:]) for (x, y), first in zip(full, start)]
+
+
+_monitors: OrderedDict = OrderedDict()
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(path: str) -> WoutMonitor:
+    """
+    The monitor of `path`, shared by all sessions of the process
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    with _monitors_lock:
+        monitor = _monitors.get(path)
+        if monitor is None:
+            monitor = _monitors[path] = WoutMonitor(path)
+            while len(_monitors) > WOUT_MONITORS:
+                _monitors.popitem(last=False)
+        _monitors.move_to_end(path)
+        return monitor
+
+
+def default_wout(band_file: Optional[str]) -> Optional[str]:
+    """
+    <seedname>.wout next to <seedname>_band.dat
+    """
+    if not band_file or not band_file.endswith("_band.dat"):
+        return None
+    return band_file[: -len("_band.dat")] + ".wout"
@@ -0,0 +1,89 @@
+"""
+update_figure on a synthetic calculation, run from the src directory with
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+import app
+from benchmarks.synthetic import SyntheticCalc
+
+
+@pytest.fixture(scope="module")
+def loaded_data(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("calc")
+    SyntheticCalc(natoms=2, nbands=16, nkpts_per_seg=10).write_all(str(directory))
+    _, _, _, loaded, _, _, error = app.update_path_and_options(
+        1,
+        str(directory / "vasprun.xml"),
+        str(directory / "KPOINTS"),
+        str(directory / "PROCAR"),
+        str(directory / "wannier90_band.dat"),
+        "test",
+    )
+    assert not error
+    return loaded
+
+
+def _figure(loaded_data, tb_density, group_mode):
+    groups = [
+        {"name": "Fe s", "atoms": ["Fe"], "sites": None, "orbitals": ["s"]},
+        {"name": "O p", "atoms": ["O"], "sites": None, "orbitals": ["px", "py"]},
+    ]
+    # CSS colors as typed in the group color field
+    for group, color in zip(groups, ("red", "#1f7")):
+        group["color"] = color
+    selected = [group["name"] for group in groups] if group_mode else []
+    fig, _ = app.update_figure(
+        ["vasp", "proj", "tb"],
+        1,
+        loaded_data,
+        ["Fe"],
+        ["s", "pz"],
+        "-5, 5",
+        False,
+        "energy",
+        [],
+        [],
+        "test",
+        "weight",
+        "color",
+        groups,
+        selected,
+        group_mode or "color",
+        0.1,
+        tb_density,
+        "",
+    )
+    return fig
+
+
+@pytest.mark.parametrize("group_mode", [None, "color", "mix"])
+@pytest.mark.parametrize("tb_density", [1, 3])
+def test_traces_match_their_path(loaded_data, tb_density, group_mode):
+    """
+    The denser path of the Wannier TB bands is not used by the other traces
+    """
+    fig = _figure(loaded_data, tb_density, group_mode)
+    traces = {
+        trace.name: trace for trace in fig.data if trace.y is not None and len(trace.y)
+    }
+    assert {"vasp band", "wannier TB band"} <= set(traces)
+    kpath = {round(x, 8) for x in traces["vasp band"].x if x is not None}
+    projected = [
+        name for name in traces if name not in ("vasp band", "wannier TB band")
+    ]
+    assert projected
+    for name in projected:
+        x = traces[name].x
+        assert len(x) == len(traces[name].y), name
+        assert {round(value, 8) for value in x if value is not None} <= kpath, name
+
+
+def test_add_proj_group_normalizes_color():
+    groups, names, selected = app.add_proj_group(1, ["Fe"], None, ["s"], "red", [], [])
+    assert groups[0]["color"] == "rgb(255,0,0)"
+    assert names == selected == ["Fe s"]
+    assert app.update_group_color_error("#f00") is False
+    assert app.update_group_color_error("redd") == "Invalid color"